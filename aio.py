@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Asynchronous evaluation of permissions.
+
+The generators run inline (they only compute Needs), while the database
+lookups (ActionNeed expansions, records of buckets) go through an
+``asyncio`` SQLAlchemy session and are batched: the ActionNeeds of many
+permissions are expanded with one query per kind of action assignment.
+
+Requires SQLAlchemy>=1.4 and an async driver (e.g. ``asyncpg`` or
+``aiosqlite``), see ``RECORDS_PERMISSIONS_ASYNC_DATABASE_URI``.
+"""
+
+import asyncio
+from collections import namedtuple
+from itertools import chain
+
+from flask import current_app
+from invenio_access.models import ActionRoles, ActionSystemRoles, \
+    ActionUsers
+from invenio_access.permissions import superuser_access
+from invenio_access.proxies import current_access
+
+from .needs import NeedSet
+
+_ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql',
+}
+
+Expansion = namedtuple('Expansion', ['needs', 'excludes'])
+"""Users, roles and system roles granted (or denied) an ActionNeed."""
+
+
+def async_database_uri(app):
+    """URI of the async engine, derived from the synchronous one if unset."""
+    uri = app.config['RECORDS_PERMISSIONS_ASYNC_DATABASE_URI']
+    if uri:
+        return uri
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    scheme, _, rest = uri.partition('://')
+    dialect = scheme.split('+')[0]
+    if dialect not in _ASYNC_DRIVERS:
+        raise RuntimeError(
+            'No async driver known for {0}, set '
+            'RECORDS_PERMISSIONS_ASYNC_DATABASE_URI.'.format(dialect))
+    return '{0}://{1}'.format(_ASYNC_DRIVERS[dialect], rest)
+
+
+def get_async_sessionmaker():
+    """Async session factory of the application, created on first use."""
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+
+    ext = current_app.extensions['invenio-records-permissions']
+    if ext.async_sessionmaker is None:
+        engine = create_async_engine(async_database_uri(current_app))
+        ext.async_sessionmaker = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False
+        )
+    return ext.async_sessionmaker
+
+
+def _action_cache_key(need):
+    """Key of an ActionNeed in the invenio-access action cache."""
+    argument = getattr(need, 'argument', None)
+    if argument is not None:
+        return '{0}::{1}'.format(need.value, argument)
+    return need.value
+
+
+def _assigned(row, need):
+    """Tell if the action assignment ``row`` applies to ``need``."""
+    if row.action != need.value:
+        return False
+    argument = getattr(need, 'argument', None)
+    if argument is None:
+        return row.argument is None
+    return row.argument is None or row.argument == str(argument)
+
+
+async def aexpand_action_needs(action_needs, session=None):
+    """Expand ActionNeeds into the Needs assigned them in the database.
+
+    Expansions found in the invenio-access action cache are reused and the
+    others are stored there.
+
+    :returns: Dictionary of ActionNeed to :data:`Expansion`.
+    """
+    from sqlalchemy import select
+    from sqlalchemy.orm import selectinload
+
+    expansions = {}
+    missing = []
+    for need in set(action_needs):
+        cached = current_access.get_action_cache(_action_cache_key(need))
+        if cached is not None:
+            expansions[need] = Expansion(cached.needs, cached.excludes)
+        else:
+            missing.append(need)
+    if not missing:
+        return expansions
+
+    names = sorted({need.value for need in missing})
+    queries = [
+        select(ActionUsers).where(ActionUsers.action.in_(names)),
+        select(ActionRoles).where(ActionRoles.action.in_(names)).options(
+            selectinload(ActionRoles.role)
+        ),
+        select(ActionSystemRoles).where(ActionSystemRoles.action.in_(names)),
+    ]
+    if session is None:
+        async with get_async_sessionmaker()() as session:
+            rows = [await session.scalars(query) for query in queries]
+    else:
+        rows = [await session.scalars(query) for query in queries]
+    rows = list(chain.from_iterable(r.all() for r in rows))
+
+    for need in missing:
+        expansion = Expansion(set(), set())
+        for row in rows:
+            if _assigned(row, need):
+                (expansion.excludes if row.exclude else expansion.needs).add(
+                    row.need
+                )
+        current_access.set_action_cache(_action_cache_key(need), expansion)
+        expansions[need] = expansion
+    return expansions
+
+
+def _explicit_needs(permission):
+    """Needs and excludes generated for ``permission``, not expanded.
+
+    Lazy sets of Needs are kept as they are, in the returned list.
+    """
+    needs = {superuser_access} | set(permission.explicit_needs)
+    excludes = set(permission.explicit_excludes)
+    lazy = []
+    for generator in permission.generators:
+        generated = generator.needs(**permission.over)
+        if isinstance(generated, NeedSet):
+            lazy.append(generated)
+        else:
+            needs.update(generated)
+        excludes.update(generator.excludes(**permission.over))
+    return needs, excludes, lazy
+
+
+def _decide(needs, excludes, lazy, expansions, identity):
+    """Decision of invenio-access ``Permission.allows`` for expanded Needs.
+
+    Like ``Permission._load_permissions``, only the ActionNeeds of ``needs``
+    are expanded, explicit excludes are kept as they are.
+    """
+    all_needs = set(needs)
+    all_excludes = set(excludes)
+    for need in needs:
+        if need.method == 'action':
+            all_needs |= expansions[need].needs
+            all_excludes |= expansions[need].excludes
+    provides = identity.provides
+    granted = bool(all_needs & provides) or any(
+        need in needs_set for needs_set in lazy for need in provides
+    )
+    return granted and not (all_excludes & provides)
+
+
+async def aallows_many(permissions, identity, session=None):
+    """Decisions of ``permissions`` for ``identity``.
+
+    The ActionNeeds of all the permissions are expanded in a single batch,
+    except those already expanded in the ``action_expansions`` of the
+    permissions (see the asynchronous factories).
+    """
+    expansions = {}
+    for permission in permissions:
+        expansions.update(permission.action_expansions or {})
+    explicit = [_explicit_needs(permission) for permission in permissions]
+    action_needs = {
+        need for needs, _, _ in explicit for need in needs
+        if need.method == 'action' and need not in expansions
+    }
+    if action_needs:
+        expansions.update(
+            await aexpand_action_needs(action_needs, session=session)
+        )
+
+    decisions = []
+    for permission, (needs, excludes, lazy) in zip(permissions, explicit):
+        allowed = _decide(needs, excludes, lazy, expansions, identity)
+        if permission.decision_log is not None:
+            permission.decision_log.record(permission, identity, allowed)
+        decisions.append(allowed)
+    return decisions
+
+
+async def aallows(permission, identity, session=None):
+    """Decision of ``permission`` for ``identity``."""
+    decisions = await aallows_many([permission], identity, session=session)
+    return decisions[0]
+
+
+async def aload_bucket_records(bucket_ids, session=None):
+    """Records of the buckets ``bucket_ids`` in a single query.
+
+    :returns: Dictionary of bucket id (string) to
+        :class:`invenio_records_files.api.Record`.
+    """
+    from invenio_records.models import RecordMetadata
+    from invenio_records_files.api import Record, RecordsBuckets
+    from sqlalchemy import select
+
+    query = select(RecordsBuckets.bucket_id, RecordMetadata).join(
+        RecordMetadata, RecordsBuckets.record_id == RecordMetadata.id
+    ).where(RecordsBuckets.bucket_id.in_(list(bucket_ids)))
+    if session is None:
+        async with get_async_sessionmaker()() as session:
+            result = await session.execute(query)
+    else:
+        result = await session.execute(query)
+    return {
+        str(bucket_id): Record(model.json, model=model)
+        for bucket_id, model in result.all()
+    }
+
+
+async def agather_records_and_expansions(bucket_ids, action_needs):
+    """Load bucket records and expand ActionNeeds concurrently.
+
+    Each lookup uses its own session, the queries run in parallel.
+    """
+    return await asyncio.gather(
+        aload_bucket_records(bucket_ids),
+        aexpand_action_needs(action_needs),
+    )
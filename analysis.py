@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Static simplification of the generators of policy actions.
+
+The generators of an action are reduced to an equivalent, minimal list
+using the properties they declare (see
+:class:`~invenio_records_permissions.generators.Generator`):
+
+- a generator which ``always_denies`` denies everyone, whatever the others;
+- a generator which ``always_grants`` makes the other non excluding
+  generators redundant;
+- a generator subsumed by another one (e.g. a duplicate) is redundant,
+  unless it ``may_exclude``.
+
+Both the decisions and the search filters use the reduced list, e.g.
+``[AnyUserIfPublic(), RecordOwners(), AnyUser()]`` evaluates and filters
+like ``[AnyUser()]``.
+"""
+
+from collections import namedtuple
+
+Simplification = namedtuple('Simplification', ['generators', 'dead'])
+"""Reduced list of generators and the generators it leaves out."""
+
+
+def simplify_generators(generators):
+    """Minimal list of generators equivalent to ``generators``."""
+    generators = list(generators)
+    for generator in generators:
+        if generator.always_denies:
+            return Simplification(
+                [generator], [g for g in generators if g is not generator]
+            )
+
+    kept = []
+    for generator in generators:
+        if not generator.may_exclude and any(
+            other.subsumes(generator) for other in kept
+        ):
+            continue
+        # Drop the kept generators the new one makes redundant
+        kept = [
+            other for other in kept
+            if other.may_exclude or not generator.subsumes(other)
+        ]
+        kept.append(generator)
+
+    kept_ids = {id(g) for g in kept}
+    return Simplification(
+        kept, [g for g in generators if id(g) not in kept_ids]
+    )
+
+
+def simplify_policy(policy):
+    """Simplifications of the actions of a policy class.
+
+    :returns: Dictionary of action to :data:`Simplification`.
+    """
+    return {
+        name[len('can_'):]: simplify_generators(getattr(policy, name))
+        for name in dir(policy) if name.startswith('can_')
+    }
+
+
+def dead_generators(policy):
+    """Describe the generators of a policy class left out by simplification.
+
+    :returns: A list of ``(action, generator class names)`` tuples.
+    """
+    return [
+        (action, [type(g).__name__ for g in simplification.dead])
+        for action, simplification in sorted(simplify_policy(policy).items())
+        if simplification.dead
+    ]
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Fast path for anonymous identities.
+
+For an anonymous identity (no user id, hence no roles) the output of the
+generators only depends on the IP classes of the request. Search filters
+and record independent decisions are therefore computed once per IP classes
+and reused for ``RECORDS_PERMISSIONS_ANONYMOUS_CACHE_TTL`` seconds, or
+until the decision may change (see ``BasePermissionPolicy.expires_at``) if
+that is sooner. The caches are cleared when grants of actions to system
+roles (e.g. to ``any_user``) are committed in the process.
+
+Optionally, anonymous searches can use filtered index aliases, one per
+combination of IP classes, which have the permission filter built in.
+"""
+
+from time import monotonic
+
+from elasticsearch_dsl.query import Q
+from flask import current_app, g, has_request_context
+from flask_principal import AnonymousIdentity
+from invenio_access.permissions import any_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from .network import current_ip_classes, get_network_classifier
+from .utils import utcnow
+
+
+class AnonymousCache(object):
+    """Cache of filters or decisions whose entries expire."""
+
+    def __init__(self, ttl):
+        """Constructor.
+
+        :param ttl: Lifetime of the entries (seconds).
+        """
+        self.ttl = ttl
+        self._entries = {}
+
+    def get(self, key, default=None):
+        """Unexpired value of ``key``, ``default`` if there is none."""
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= monotonic():
+            return default
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, expires_at=None):
+        """Store ``value``, at most until the datetime ``expires_at``."""
+        ttl = self.ttl
+        if expires_at is not None:
+            ttl = min(ttl, (expires_at - utcnow()).total_seconds())
+        self._entries[key] = (value, monotonic() + ttl)
+
+    def clear(self):
+        """Remove all the entries."""
+        self._entries.clear()
+
+
+def clear_on_system_role_changes(caches):
+    """Clear ``caches`` when grants to system roles are committed.
+
+    Only changes made through the ORM of the process are seen, the TTL of
+    the caches bounds how long other changes are ignored.
+    """
+    from invenio_access.models import ActionSystemRoles
+
+    key = 'permissions_anonymous_caches_{0}'.format(id(caches))
+
+    def changed(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info[key] = True
+
+    def committed(session):
+        if session.info.pop(key, False):
+            for cache in caches:
+                cache.clear()
+
+    def rolled_back(session):
+        session.info.pop(key, None)
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(ActionSystemRoles, name, changed)
+    event.listen(Session, 'after_commit', committed)
+    event.listen(Session, 'after_rollback', rolled_back)
+
+
+def is_anonymous(identity):
+    """Tell if ``identity`` is not tied to a user."""
+    return not any(need.method == 'id' for need in identity.provides)
+
+
+def anonymous_cache_key(permission, identity):
+    """Key of the cached search filter or decision of an anonymous identity.
+
+    ``None`` if ``identity`` is not anonymous.
+    """
+    if identity is None or not has_request_context() or \
+            not is_anonymous(identity):
+        return None
+    return (
+        type(permission), permission.action, frozenset(identity.provides),
+        current_ip_classes(),
+    )
+
+
+def cached_anonymous_filter(permission, build):
+    """Search filter of ``permission`` for the current anonymous identity.
+
+    :param build: Function building the filter if it is not cached yet.
+    :returns: The filter or ``build()`` if caching does not apply.
+    """
+    ext = current_app.extensions.get('invenio-records-permissions')
+    cache = ext.anonymous_filters if ext is not None else None
+    key = None
+    if cache is not None:
+        key = anonymous_cache_key(permission, g.get('identity'))
+    if key is None:
+        return build()
+
+    body = cache.get(key)
+    if body is None:
+        body = build().to_dict()
+        cache.set(key, body, expires_at=permission.expires_at)
+    return Q(body)
+
+
+def prefixed_index(index):
+    """Name of ``index`` with the ``SEARCH_INDEX_PREFIX``, if any."""
+    prefix = current_app.config.get('SEARCH_INDEX_PREFIX') or ''
+    return index if index.startswith(prefix) else prefix + index
+
+
+def anonymous_alias_name(index, ip_classes):
+    """Name of the filtered alias of ``index`` for some IP classes.
+
+    The name includes the ``SEARCH_INDEX_PREFIX``.
+    """
+    return '-'.join([prefixed_index(index), 'anonymous'] + sorted(ip_classes))
+
+
+def current_anonymous_alias(index):
+    """Filtered alias to search ``index`` with, if any."""
+    if not current_app.config.get('RECORDS_PERMISSIONS_ANONYMOUS_ALIASES') or \
+            not has_request_context():
+        return None
+    identity = g.get('identity')
+    if identity is None or not is_anonymous(identity):
+        return None
+    return anonymous_alias_name(index, current_ip_classes())
+
+
+def anonymous_alias_filters(build):
+    """Search filter bodies of anonymous identities per alias suffix.
+
+    Must be called in an application context.
+
+    :param build: Function building the search filter.
+    :returns: Dictionary of IP classes to filter body.
+    """
+    filters = {}
+    for ip_classes in get_network_classifier().combinations():
+        with current_app.app_context(), \
+                current_app.test_request_context():
+            identity = AnonymousIdentity()
+            identity.provides.add(any_user)
+            g.identity = identity
+            g._permissions_ip_classes = ip_classes
+            filters[ip_classes] = build().to_dict()
+    return filters
+
+
+def update_anonymous_aliases(client, index, build):
+    """Create or update the filtered anonymous aliases of ``index``.
+
+    Aliases can not point to aliases: they are added on the concrete
+    indices behind ``index``.
+
+    :returns: The names of the aliases.
+    """
+    indices = sorted(client.indices.get_alias(index=prefixed_index(index)))
+    actions = []
+    for ip_classes, body in anonymous_alias_filters(build).items():
+        alias = anonymous_alias_name(index, ip_classes)
+        for concrete_index in indices:
+            actions.append({'add': {
+                'index': concrete_index, 'alias': alias, 'filter': body,
+            }})
+    client.indices.update_aliases(body={'actions': actions})
+    return sorted({action['add']['alias'] for action in actions})
@@ -8,27 +8,90 @@
 
 """Invenio Records Permissions API."""
 
+import operator
+import threading
+from functools import reduce
+from queue import Empty, Full, Queue
+
+from elasticsearch_dsl.connections import connections
 from elasticsearch_dsl.query import Q
 from flask import current_app
 from invenio_search.api import DefaultFilter, RecordsSearch
 
+try:
+    from invenio_search.api import PrefixedIndexList
+except ImportError:
+    # Older invenio-search versions do not prefix the index names
+    PrefixedIndexList = list
+
+from .anonymous import cached_anonymous_filter, current_anonymous_alias
 from .factories import record_read_permission_factory
+from .policies import get_record_permission_policy
+from .preauthorized import mark_preauthorized, preauthorizable
+from .profiling import permission_context
 
 
 def rdm_records_filter():
-    """Records filter."""
-    # TODO: Implement with new permissions metadata
+    """Records filter.
+
+    With policies registered per discriminator value (see
+    ``RECORDS_PERMISSIONS_POLICIES``), the records of each value are
+    filtered by the read filter of their policy, and the others by the one
+    of the default policy. A record with several registered values (e.g.
+    communities) is matched by the filter of any of them, while reading it
+    is decided by the policy of the first one.
+    """
+    ext = current_app.extensions.get('invenio-records-permissions')
+    profiler = ext.profiler if ext is not None else None
+    if profiler is not None:
+        return profiler.call(
+            lambda: permission_context(
+                record_read_permission_factory(), kind='search_filter'
+            ),
+            _rdm_records_filter,
+        )
+    return _rdm_records_filter()
+
+
+def _read_permission():
+    """Read permission the records filter is built from."""
     try:
-        perm_factory = current_app.config["RECORDS_REST_ENDPOINTS"]["recid"][
+        return current_app.config["RECORDS_REST_ENDPOINTS"]["recid"][
             "read_permission_factory_imp"
         ]()  # noqa
     except KeyError:
-        perm_factory = record_read_permission_factory
+        return record_read_permission_factory()
+
+
+def _rdm_records_filter():
+    """Build the records filter."""
+    # TODO: Implement with new permissions metadata
+    perm_factory = _read_permission()
     # FIXME: this might fail if factory returns None, meaning no "query_filter"
     # was implemente in the generators. However, IfPublic should always be
     # there.
 
-    filters = perm_factory.query_filters
+    def build():
+        qf = _combine(perm_factory.query_filters)
+        ext = current_app.extensions.get('invenio-records-permissions')
+        # Only the policies of the provided factories are registered
+        if ext is None or not ext.policies or \
+                type(perm_factory) is not get_record_permission_policy():
+            return qf
+        field = ext.policy_discriminator
+        queries = [~Q("terms", **{field: sorted(ext.policies)}) & qf]
+        for value, policy in ext.policies.items():
+            queries.append(Q("term", **{field: value}) & _combine(
+                policy(action=perm_factory.action).query_filters
+            ))
+        return reduce(operator.or_, queries)
+
+    # The filter of anonymous identities only depends on their IP classes
+    return cached_anonymous_filter(perm_factory, build)
+
+
+def _combine(filters):
+    """Filters combined like the search does, all records if none."""
     if filters:
         qf = None
         for f in filters:
@@ -50,3 +113,138 @@ class RecordsSearch(RecordsSearch):
         index = "records"
         doc_types = None
         default_filter = DefaultFilter(rdm_records_filter)
+
+    class AnonymousAliasMeta(Meta):
+        """Anonymous searches on a filtered alias need no default filter."""
+
+        default_filter = None
+
+    def __init__(self, **kwargs):
+        """Search on the filtered alias of anonymous identities if enabled.
+
+        The alias name is already prefixed. Clones, created with the index
+        of the search, keep searching the alias without default filter.
+        """
+        alias = current_anonymous_alias(self.Meta.index)
+        if alias is not None:
+            index = kwargs.setdefault('index', PrefixedIndexList([alias]))
+            if index == alias or list(index) == [alias]:
+                self.Meta = self.AnonymousAliasMeta
+        super(RecordsSearch, self).__init__(**kwargs)
+
+    def _clone(self):
+        """Clone the search, with its ``Meta``."""
+        s = super(RecordsSearch, self)._clone()
+        s.Meta = self.Meta
+        return s
+
+    def execute(self, ignore_cache=False):
+        """Execute the search and pre-authorize the hits.
+
+        If the permission filter implies the read decision, the hits are
+        marked as pre-authorized, see
+        :mod:`~invenio_records_permissions.preauthorized`.
+        """
+        response = super(RecordsSearch, self).execute(
+            ignore_cache=ignore_cache
+        )
+        # Decided here rather than per (cloned) search instance
+        permission = _read_permission()
+        if preauthorizable(permission):
+            mark_preauthorized(
+                type(permission),
+                response.to_dict().get('hits', {}).get('hits', []),
+            )
+        return response
+
+    def export(self, slices=4, size=1000, keep_alive='2m', buffer_size=None):
+        """Iterate over all the hits of the search, permissions applied.
+
+        The permission filter is the one built when the search was created,
+        it is not rebuilt per page. The hits are fetched in a point-in-time
+        with ``search_after``, split into ``slices`` fetched in parallel by
+        a pool of threads. At most ``buffer_size`` hits (by default one page
+        per slice) are held in memory; hits come in no particular order.
+
+        :param slices: Number of slices (and threads).
+        :param size: Page size.
+        :param keep_alive: How long the point-in-time is kept between pages.
+        :param buffer_size: Maximum number of hits waiting to be consumed.
+
+        The search client is the one the search was created with (``using``),
+        e.g. an in-process fake client in tests.
+        """
+        client = connections.get_connection(self._using)
+        # Threads have no application context to resolve proxies in
+        client = getattr(client, '_get_current_object', lambda: client)()
+
+        body = self.to_dict()
+        for key in ('from', 'size', 'sort', 'search_after'):
+            body.pop(key, None)
+        pit_id = client.open_point_in_time(
+            index=','.join(self._index or ['_all']), keep_alive=keep_alive
+        )['id']
+
+        hits = Queue(maxsize=buffer_size or slices * size)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    hits.put(item, timeout=0.1)
+                    return
+                except Full:
+                    continue
+
+        def fetch_slice(slice_id):
+            try:
+                search_after = None
+                while not stop.is_set():
+                    page = dict(
+                        body,
+                        size=size,
+                        sort=[{'_shard_doc': 'asc'}],
+                        pit={'id': pit_id, 'keep_alive': keep_alive},
+                    )
+                    if slices > 1:
+                        page['slice'] = {'id': slice_id, 'max': slices}
+                    if search_after is not None:
+                        page['search_after'] = search_after
+                    page_hits = client.search(body=page)['hits']['hits']
+                    for hit in page_hits:
+                        put(hit)
+                    if len(page_hits) < size:
+                        break
+                    search_after = page_hits[-1]['sort']
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        threads = [
+            threading.Thread(target=fetch_slice, args=(i, ), daemon=True)
+            for i in range(slices)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            running = slices
+            while running:
+                item = hits.get()
+                if item is done:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+            while True:
+                try:
+                    hits.get_nowait()
+                except Empty:
+                    break
+            for thread in threads:
+                thread.join()
+            client.close_point_in_time(body={'id': pit_id})
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Audit of who is allowed to act on which records.
+
+Records are streamed from the database in chunks (keyset pagination on the
+record id), evaluated against the policy by a pool of worker processes and
+written out in order. After each written chunk the last record id and the
+size of the output are stored in a checkpoint file, from which an
+interrupted audit can be resumed: the rows written after the checkpoint are
+dropped and audited again.
+
+Like ``allows()``, the audit expands the ActionNeeds of the record
+independent generators (e.g. ``Admin()``) into the users, roles and system
+roles assigned them, looked up once when the audit starts. ActionNeeds
+only generated for some records are not expanded and are reported in the
+``actions`` column. The IP dimension is modelled per IP class: the
+``networks`` column lists the classes whose members are allowed although
+the record is not public. Superusers are allowed on every record and are
+not listed.
+"""
+
+import csv
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+from flask import current_app, g
+from invenio_access.models import ActionRoles, ActionSystemRoles, \
+    ActionUsers
+from invenio_access.permissions import any_user
+from invenio_db import db
+from invenio_records.models import RecordMetadata
+
+from .network import get_network_classifier
+from .policies import get_policies, get_record_permission_policy
+
+AUDIT_COLUMNS = (
+    'record_id', 'action', 'public', 'users', 'roles', 'system_roles',
+    'networks', 'actions', 'denied',
+)
+"""Columns of the audit report."""
+
+_worker_app = None
+_worker_expansions = None
+
+
+def iter_record_chunks(chunk_size, after=None):
+    """Iterate over chunks of ``(record id, record metadata)`` tuples.
+
+    :param after: Only records with an id greater than it are returned.
+    """
+    query = db.session.query(RecordMetadata.id, RecordMetadata.json).filter(
+        RecordMetadata.json.isnot(None)
+    ).order_by(RecordMetadata.id)
+    while True:
+        chunk_query = query
+        if after is not None:
+            chunk_query = chunk_query.filter(RecordMetadata.id > after)
+        rows = chunk_query.limit(chunk_size).all()
+        if not rows:
+            return
+        yield [(str(record_id), data) for record_id, data in rows]
+        after = rows[-1][0]
+
+
+def expand_action_needs(action_needs):
+    """Needs assigned each ActionNeed in the database.
+
+    :returns: Dictionary of ActionNeed to ``(needs, excludes)`` sets.
+    """
+    expansions = {}
+    for need in action_needs:
+        needs, excludes = set(), set()
+        for model in (ActionUsers, ActionRoles, ActionSystemRoles):
+            for row in model.query_by_action(need).all():
+                (excludes if row.exclude else needs).add(row.need)
+        expansions[need] = (needs, excludes)
+    return expansions
+
+
+def policy_action_needs(policy, actions):
+    """ActionNeeds of the record independent generators of ``actions``."""
+    action_needs = set()
+    for action in actions:
+        for generator in policy(action=action).generators:
+            if generator.record_fields != ():
+                continue
+            action_needs.update(
+                need for need in chain(
+                    generator.needs(), generator.excludes()
+                ) if need.method == 'action'
+            )
+    return action_needs
+
+
+def _generate(generators, record, ip_classes):
+    """Needs and excludes of ``generators`` for some IP classes."""
+    g._permissions_ip_classes = ip_classes
+    needs, excludes = set(), set()
+    for generator in generators:
+        needs.update(generator.needs(record=record))
+        excludes.update(generator.excludes(record=record))
+    return needs, excludes
+
+
+def _expand(needs, excludes, expansions):
+    """Expand the ActionNeeds found in ``expansions``.
+
+    :returns: The expanded needs and excludes.
+    """
+    expanded_needs, expanded_excludes = set(), set()
+    for need in needs:
+        if need in expansions:
+            expanded_needs |= expansions[need][0]
+            expanded_excludes |= expansions[need][1]
+        else:
+            expanded_needs.add(need)
+    for need in excludes:
+        if need in expansions:
+            expanded_excludes |= expansions[need][0]
+        else:
+            expanded_excludes.add(need)
+    return expanded_needs, expanded_excludes
+
+
+def audit_record(policy, actions, record_id, record, expansions=None):
+    """Audit rows of a record, one per action.
+
+    Must be called in a request context.
+
+    :param policy: Policy class, ``None`` to use the policy of the record
+        (see ``RECORDS_PERMISSIONS_POLICIES``).
+    :param expansions: Expansions of ActionNeeds, see
+        :func:`expand_action_needs`.
+    """
+    policy = policy or get_record_permission_policy(record)
+    expansions = expansions or {}
+    ip_classes = sorted(get_network_classifier().classes)
+    rows = []
+    for action in actions:
+        generators = policy(action=action, record=record).generators
+        needs, excludes = _expand(
+            *_generate(generators, record, frozenset()),
+            expansions=expansions
+        )
+        allowed = needs - excludes
+        public = any_user in allowed
+
+        networks = []
+        network_generators = [
+            generator for generator in generators
+            if generator.identity_facts is None or
+            'network' in generator.identity_facts
+        ]
+        for ip_class in ip_classes if network_generators and not public \
+                else ():
+            class_needs, class_excludes = _expand(
+                *_generate(network_generators, record, frozenset([ip_class])),
+                expansions=expansions
+            )
+            if any_user in (needs | class_needs) - (excludes | class_excludes):
+                networks.append(ip_class)
+        g._permissions_ip_classes = frozenset()
+
+        def values(method):
+            return ';'.join(sorted(
+                str(need.value) for need in allowed if need.method == method
+            ))
+
+        rows.append((
+            record_id,
+            action,
+            public,
+            values('id'),
+            values('role'),
+            ';'.join(sorted(
+                str(need.value) for need in allowed
+                if need.method == 'system_role' and need != any_user
+            )),
+            ';'.join(networks),
+            values('action'),
+            any_user in excludes,
+        ))
+    return rows
+
+
+def _init_worker():
+    """Initialize a forked worker.
+
+    The session and the pooled connections inherited from the parent are
+    dropped, without closing them, so that the worker opens its own. A
+    request context is pushed, generators may expect one.
+    """
+    _worker_app.test_request_context().push()
+    db.session.registry.clear()
+    db.engine.dispose(close=False)
+
+
+def _audit_chunk(policy, actions, chunk):
+    """Audit rows of a chunk of records."""
+    rows = []
+    for record_id, record in chunk:
+        rows.extend(audit_record(
+            policy, actions, record_id, record, _worker_expansions
+        ))
+    return rows
+
+
+class CSVAuditWriter(object):
+    """Write audit rows as CSV, appending if the file exists."""
+
+    def __init__(self, path):
+        """Constructor."""
+        exists = os.path.exists(path) and os.path.getsize(path)
+        self._file = open(path, 'a', newline='')
+        self._writer = csv.writer(self._file)
+        if not exists:
+            self._writer.writerow(AUDIT_COLUMNS)
+            self._file.flush()
+
+    def write(self, rows):
+        """Write rows."""
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def tell(self):
+        """Size of the written file."""
+        return self._file.tell()
+
+    def truncate(self, position):
+        """Drop what was written after ``position``."""
+        self._file.truncate(position)
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+
+class ParquetAuditWriter(object):
+    """Write audit rows as Parquet, appending if the file exists.
+
+    Parquet files can not be appended to: each chunk is written to a part
+    file next to ``path``. Closing the writer merges the existing file and
+    the parts, including those left by an interrupted audit, into ``path``.
+    Its position is the number of rows of the file and the parts.
+    """
+
+    def __init__(self, path):
+        """Constructor."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._pq = pq
+        self._path = path
+        self._schema = pa.schema([
+            ('record_id', pa.string()),
+            ('action', pa.string()),
+            ('public', pa.bool_()),
+            ('users', pa.string()),
+            ('roles', pa.string()),
+            ('system_roles', pa.string()),
+            ('networks', pa.string()),
+            ('actions', pa.string()),
+            ('denied', pa.bool_()),
+        ])
+        self._parts = self._existing_parts()
+        self._rows = sum(
+            self._pq.ParquetFile(source).metadata.num_rows
+            for source in self._sources()
+        )
+
+    def _sources(self):
+        """The existing file, if any, and the parts."""
+        if os.path.exists(self._path):
+            return [self._path] + self._parts
+        return list(self._parts)
+
+    def _existing_parts(self):
+        """Part files of ``path``, in order."""
+        directory, name = os.path.split(os.path.abspath(self._path))
+        prefix = name + '.part'
+        return sorted(
+            os.path.join(directory, entry) for entry in os.listdir(directory)
+            if entry.startswith(prefix) and entry[len(prefix):].isdigit()
+        )
+
+    def write(self, rows):
+        """Write rows."""
+        columns = list(zip(*rows)) if rows else [[]] * len(AUDIT_COLUMNS)
+        part = '{0}.part{1:06d}'.format(self._path, len(self._parts))
+        self._pq.write_table(self._pa.Table.from_arrays(
+            [self._pa.array(c, type=f.type)
+             for c, f in zip(columns, self._schema)],
+            schema=self._schema,
+        ), part)
+        self._parts.append(part)
+        self._rows += len(rows)
+
+    def tell(self):
+        """Number of written rows."""
+        return self._rows
+
+    def truncate(self, position):
+        """Drop the last parts until ``position`` rows are left."""
+        while self._parts and self._rows > position:
+            part = self._parts.pop()
+            self._rows -= self._pq.ParquetFile(part).metadata.num_rows
+            os.remove(part)
+
+    def close(self):
+        """Merge the parts into the file."""
+        sources = self._sources()
+        tmp = self._path + '.tmp'
+        writer = self._pq.ParquetWriter(tmp, self._schema)
+        try:
+            for source in sources:
+                parquet_file = self._pq.ParquetFile(source)
+                for index in range(parquet_file.num_row_groups):
+                    writer.write_table(parquet_file.read_row_group(index))
+        finally:
+            writer.close()
+        os.replace(tmp, self._path)
+        for part in self._parts:
+            os.remove(part)
+        self._parts = []
+
+
+AUDIT_WRITERS = {
+    'csv': CSVAuditWriter,
+    'parquet': ParquetAuditWriter,
+}
+
+
+def read_checkpoint(path):
+    """Last audited record id and output position stored in ``path``.
+
+    :returns: A ``(record id, position)`` tuple, ``(None, None)`` if there
+        is no checkpoint.
+    """
+    if path and os.path.exists(path):
+        with open(path) as f:
+            fields = f.read().split()
+        if fields:
+            position = int(fields[1]) if len(fields) > 1 else None
+            return fields[0], position
+    return None, None
+
+
+def write_checkpoint(path, record_id, position):
+    """Atomically store the last audited record id and output position."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('{0} {1}'.format(record_id, position))
+    os.replace(tmp_path, path)
+
+
+def run_audit(policy, actions, writer, chunk_size=1000, jobs=None,
+              checkpoint=None, progress=None):
+    """Audit all records with ``policy`` for ``actions``.
+
+    If ``policy`` is ``None``, each record is audited with its own policy.
+    At most ``2 * jobs`` chunks are in flight, which bounds memory usage.
+    When resuming from ``checkpoint``, the output is truncated to the
+    position stored with it, so that no rows are duplicated.
+
+    :param progress: Callable receiving the number of audited records and
+        the elapsed time after each chunk.
+    :returns: The number of audited records.
+    """
+    global _worker_app, _worker_expansions
+    _worker_app = current_app._get_current_object()
+    # Inherited by the forked workers
+    action_needs = set()
+    for p in [policy] if policy else get_policies():
+        action_needs |= policy_action_needs(p, actions)
+    _worker_expansions = expand_action_needs(action_needs)
+
+    jobs = jobs or os.cpu_count() or 1
+    after, position = read_checkpoint(checkpoint)
+    if position is not None:
+        writer.truncate(position)
+    count = 0
+    start = time.time()
+    pending = deque()
+
+    def write_oldest():
+        nonlocal count
+        future, last_id, size = pending.popleft()
+        writer.write(future.result())
+        if checkpoint:
+            write_checkpoint(checkpoint, last_id, writer.tell())
+        count += size
+        if progress:
+            progress(count, time.time() - start)
+
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(jobs, mp_context=context,
+                             initializer=_init_worker) as executor:
+        for chunk in iter_record_chunks(chunk_size, after=after):
+            if len(pending) >= 2 * jobs:
+                write_oldest()
+            pending.append((
+                executor.submit(_audit_chunk, policy, actions, chunk),
+                chunk[-1][0],
+                len(chunk),
+            ))
+        while pending:
+            write_oldest()
+    return count
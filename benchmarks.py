@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Micro-benchmarks of the permission evaluation paths."""
+
+from itertools import chain
+from timeit import default_timer
+
+from flask_principal import AnonymousIdentity, Identity, UserNeed
+from invenio_access.permissions import any_user, authenticated_user
+
+from .compiler import compile_evaluator
+from .generators import RecordGroups, RecordOwners
+from .policies.base import BasePermissionPolicy
+
+
+def _decide(policy, action, records, identity, evaluators):
+    """Decisions of ``policy`` on ``records`` with only the given evaluators.
+
+    The other caches (anonymous decisions, pre-authorization, decision log)
+    are disabled so that only the evaluation itself is measured.
+    """
+    decisions = []
+    for record in records:
+        permission = policy(action=action, record=record)
+        permission.compiled_evaluators = evaluators
+        permission.anonymous_decisions = None
+        permission.preauthorization = None
+        permission.decision_log = None
+        decisions.append(permission.allows(identity))
+    return decisions
+
+
+def benchmark_evaluators(policy, identity, records, action='read', number=3):
+    """Compare the generic and compiled evaluations of a policy action.
+
+    Must be called in a request context if the generators read the IP
+    classes.
+
+    :returns: Dictionary with the best time of ``number`` runs of each path
+        (seconds), the speedup and the number of disagreeing decisions.
+    """
+    records = list(records)
+    generators = policy(action=action).generators
+    evaluator = compile_evaluator(generators)
+    if evaluator is None:
+        raise ValueError(
+            'The {0} action of {1} can not be compiled.'.format(
+                action, policy.__name__))
+    evaluators = {(policy, action): (generators, evaluator)}
+
+    timings = {}
+    results = {}
+    for name, cache in (('generic', None), ('compiled', evaluators)):
+        best = None
+        for _ in range(number):
+            start = default_timer()
+            results[name] = _decide(policy, action, records, identity, cache)
+            elapsed = default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+
+    return {
+        'policy': policy.__name__,
+        'action': action,
+        'records': len(records),
+        'generic': timings['generic'],
+        'compiled': timings['compiled'],
+        'speedup': (
+            timings['generic'] / timings['compiled']
+            if timings['compiled'] else None
+        ),
+        'disagreements': sum(
+            a != b for a, b in zip(results['generic'], results['compiled'])
+        ),
+    }
+
+
+class _LargeACLPolicy(BasePermissionPolicy):
+    """Policy reading the owners and groups of records."""
+
+    can_read = [RecordOwners(), RecordGroups()]
+
+
+class _EagerLargeACLPolicy(_LargeACLPolicy):
+    """Same policy, materializing all the Needs of the records."""
+
+    @property
+    def needs(self):
+        """Set of Needs granting permission, all of them created."""
+        needs = [
+            list(generator.needs(**self.over))
+            for generator in self.generators
+        ]
+        self.explicit_needs |= set(chain.from_iterable(needs))
+        self._load_permissions()
+        return self._permissions.needs
+
+
+class _Record(dict):
+    """Record able to cache its restriction descriptor, like API records."""
+
+
+def benchmark_need_sets(owners=10000, groups=1000, checks=100, number=3):
+    """Compare lazy and materialized Needs on records with many owners.
+
+    Must be called in an application context.
+
+    :returns: Dictionary with the best time of ``number`` runs of ``checks``
+        decisions per path (seconds) and the speedup.
+    """
+    record = _Record(
+        owners=list(range(1, owners + 1)),
+        group_restrictions=['group-{0}'.format(i) for i in range(groups)],
+        applied_restrictions=['owners', 'groups'],
+    )
+    owner = Identity(owners)
+    owner.provides.update([UserNeed(owners), authenticated_user, any_user])
+    anonymous = AnonymousIdentity()
+    anonymous.provides.add(any_user)
+    identities = [owner, anonymous]
+
+    timings = {}
+    results = {}
+    for name, policy in (('eager', _EagerLargeACLPolicy),
+                         ('lazy', _LargeACLPolicy)):
+        best = None
+        for _ in range(number):
+            start = default_timer()
+            results[name] = [
+                _decide(policy, 'read', [record], identity, None)[0]
+                for _ in range(checks) for identity in identities
+            ]
+            elapsed = default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+
+    return {
+        'owners': owners,
+        'groups': groups,
+        'checks': checks * len(identities),
+        'eager': timings['eager'],
+        'lazy': timings['lazy'],
+        'speedup': (
+            timings['eager'] / timings['lazy'] if timings['lazy'] else None
+        ),
+        'disagreements': sum(
+            a != b for a, b in zip(results['eager'], results['lazy'])
+        ),
+    }
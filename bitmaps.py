@@ -0,0 +1,576 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Bitmap index of the records readable by an identity.
+
+Every record gets an ordinal. For every Need generated by the indexable
+generators of a policy (user ids, roles, ``any_user`` for public records...)
+the index keeps a bitmap of the ordinals of the records granting it. The
+records readable by an identity are then the OR of the bitmaps of the Needs
+it provides, without any search round-trip.
+
+Bitmaps are compressed like Roaring bitmaps (see :class:`Bitmap`): a user
+owning a single record costs a few bytes whatever the record's ordinal.
+They are created once per key when records are added in bulk
+(:meth:`RecordAccessIndex.add_many`).
+The index can be dumped to a file and memory-mapped by several workers: the
+file pages are shared and only the bitmaps used by a query are materialized.
+
+With ``RECORDS_PERMISSIONS_ACCESS_INDEX``, the extension keeps an index of
+the read action of the default policy (see :func:`get_access_index`). It is
+updated when records are committed through the ORM of the process: workers
+of other processes only see the changes once they load a new dump.
+
+.. note::
+
+    Only generators deriving the Needs from the record itself are indexed
+    (see ``INDEXED_GENERATORS``). Others, like ``SuperUser`` or ``Admin``,
+    depend on the database or the request and must be checked separately.
+
+Records whose Needs change at a known time (e.g. when an embargo lifts) are
+tracked with that time: :meth:`RecordAccessIndex.refresh` re-adds them once
+it has passed.
+"""
+
+import heapq
+import json
+import mmap
+import struct
+import sys
+import threading
+from array import array
+
+from flask import current_app, has_app_context
+from invenio_records.models import RecordMetadata
+from sqlalchemy.orm import object_session
+
+from .generators import AllowedByAccessLevel, AnyUserAfterEmbargo, \
+    AnyUserIfPublic, RecordGroups, RecordOwners
+from .policies import get_record_permission_policy
+from .utils import parse_datetime, utcnow
+
+INDEXED_GENERATORS = (
+    AnyUserIfPublic, AnyUserAfterEmbargo, RecordOwners, RecordGroups,
+    AllowedByAccessLevel
+)
+"""Generators whose Needs only depend on the record."""
+
+_MAGIC = b'IRPBMP3\n'
+_HEADER = struct.Struct('<Q')
+_CHUNK_HEADER = struct.Struct('<IBI')
+
+_CHUNK_BITS = 16
+_CHUNK_MASK = (1 << _CHUNK_BITS) - 1
+_ARRAY_MAX = 4096
+"""Chunks with more values are dense (8 KB, the size of 4096 values)."""
+
+
+def need_key(need):
+    """Index key of a Need."""
+    return '{0}:{1}'.format(need.method, need.value)
+
+
+def _dense(lows):
+    """Dense chunk (an int of 65536 bits) with the bits of ``lows`` set."""
+    data = bytearray(1 << (_CHUNK_BITS - 3))
+    for low in lows:
+        data[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(data, 'little')
+
+
+def _container(lows):
+    """Chunk of the sorted unique ``lows``, sparse or dense by size."""
+    if len(lows) > _ARRAY_MAX:
+        return _dense(lows)
+    return array('H', lows)
+
+
+def _lows(container):
+    """Sorted low bits of a chunk."""
+    if isinstance(container, array):
+        return container
+    lows = []
+    data = container.to_bytes(1 << (_CHUNK_BITS - 3), 'little')
+    for position, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            lows.append(position * 8 + low.bit_length() - 1)
+            byte ^= low
+    return lows
+
+
+def _size(container):
+    """Number of values of a chunk."""
+    if isinstance(container, array):
+        return len(container)
+    return bin(container).count('1')
+
+
+class Bitmap(object):
+    """Compressed set of record ordinals.
+
+    Ordinals are grouped in chunks of 65536 by their high bits, like in
+    Roaring bitmaps. A chunk is a sorted ``array('H')`` of the low bits
+    while it has at most ``_ARRAY_MAX`` values, and a dense bitmap (a
+    Python int, OR-ed at C speed) above.
+    """
+
+    __slots__ = ('_chunks',)
+
+    def __init__(self, chunks=None):
+        """Constructor."""
+        self._chunks = chunks or {}
+
+    @classmethod
+    def from_ordinals(cls, ordinals):
+        """Bitmap of ``ordinals``, created at once."""
+        grouped = {}
+        for ordinal in ordinals:
+            grouped.setdefault(ordinal >> _CHUNK_BITS, set()).add(
+                ordinal & _CHUNK_MASK
+            )
+        return cls({
+            high: _container(sorted(lows)) for high, lows in grouped.items()
+        })
+
+    def updated(self, added=(), removed=()):
+        """New bitmap with ``added`` and without ``removed`` ordinals."""
+        changes = {}
+        for ordinal in added:
+            changes.setdefault(ordinal >> _CHUNK_BITS, ({}, {}))[0][
+                ordinal & _CHUNK_MASK] = True
+        for ordinal in removed:
+            changes.setdefault(ordinal >> _CHUNK_BITS, ({}, {}))[1][
+                ordinal & _CHUNK_MASK] = True
+        chunks = dict(self._chunks)
+        for high, (add, remove) in changes.items():
+            container = chunks.get(high, array('H'))
+            if isinstance(container, int):
+                # Bit operations rather than a set of 65536 values at most
+                container = (container | _dense(add)) & ~_dense(remove)
+                if _size(container) <= _ARRAY_MAX:
+                    container = array('H', _lows(container))
+                lows = container
+            else:
+                lows = set(container) | set(add)
+                lows -= set(remove)
+                container = _container(sorted(lows))
+            if lows:
+                chunks[high] = container
+            else:
+                chunks.pop(high, None)
+        return Bitmap(chunks)
+
+    def __or__(self, other):
+        """Union of two bitmaps."""
+        chunks = dict(self._chunks)
+        for high, container in other._chunks.items():
+            mine = chunks.get(high)
+            if mine is None:
+                chunks[high] = container
+            elif isinstance(mine, array) and isinstance(container, array):
+                chunks[high] = _container(sorted(set(mine) | set(container)))
+            else:
+                chunks[high] = (
+                    mine if isinstance(mine, int) else _dense(mine)
+                ) | (
+                    container if isinstance(container, int)
+                    else _dense(container)
+                )
+        return Bitmap(chunks)
+
+    def __iter__(self):
+        """Ordinals of the bitmap, in order."""
+        for high in sorted(self._chunks):
+            base = high << _CHUNK_BITS
+            for low in _lows(self._chunks[high]):
+                yield base + low
+
+    def __len__(self):
+        """Number of ordinals of the bitmap."""
+        return sum(_size(c) for c in self._chunks.values())
+
+    def __bool__(self):
+        """Tell if the bitmap has ordinals."""
+        return bool(self._chunks)
+
+    def __eq__(self, other):
+        """Tell if two bitmaps have the same ordinals."""
+        return isinstance(other, Bitmap) and list(self) == list(other)
+
+    def __contains__(self, ordinal):
+        """Tell if ``ordinal`` is in the bitmap."""
+        container = self._chunks.get(ordinal >> _CHUNK_BITS)
+        if container is None:
+            return False
+        low = ordinal & _CHUNK_MASK
+        if isinstance(container, array):
+            return low in container
+        return bool(container >> low & 1)
+
+    def to_bytes(self):
+        """Serialized bitmap, see :meth:`from_bytes`."""
+        parts = []
+        for high in sorted(self._chunks):
+            container = self._chunks[high]
+            if isinstance(container, array):
+                values = container
+                if sys.byteorder != 'little':
+                    values = array('H', values)
+                    values.byteswap()
+                data, dense = values.tobytes(), 0
+            else:
+                data, dense = container.to_bytes(
+                    1 << (_CHUNK_BITS - 3), 'little'
+                ), 1
+            parts.append(_CHUNK_HEADER.pack(high, dense, len(data)))
+            parts.append(data)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Bitmap serialized by :meth:`to_bytes`."""
+        chunks = {}
+        position = 0
+        while position < len(data):
+            high, dense, size = _CHUNK_HEADER.unpack_from(data, position)
+            position += _CHUNK_HEADER.size
+            chunk = bytes(data[position:position + size])
+            position += size
+            if dense:
+                chunks[high] = int.from_bytes(chunk, 'little')
+            else:
+                values = array('H')
+                values.frombytes(chunk)
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                chunks[high] = values
+        return cls(chunks)
+
+
+class RecordAccessIndex(object):
+    """Need to record-ordinals bitmap index for a policy action."""
+
+    def __init__(self, generators):
+        """Constructor.
+
+        :param generators: Generators of the indexed action. Generators not
+            in ``INDEXED_GENERATORS`` are ignored.
+        """
+        self.generators = [
+            g for g in generators if isinstance(g, INDEXED_GENERATORS)
+        ]
+        self.ids = []
+        self.ordinals = {}
+        self._bitmaps = {}
+        self._keys = {}
+        self._mapped = None
+        self._offsets = {}
+        self._key_names = []
+        self._stored_keys = []
+        self._changes = []
+
+    @classmethod
+    def from_policy(cls, policy, action='read'):
+        """Create an empty index for the ``action`` of a policy class."""
+        return cls(policy(action=action).generators)
+
+    @classmethod
+    def build(cls, policy, action='read', chunk_size=1000):
+        """Build the index in bulk from all the records in the database."""
+        index = cls.from_policy(policy, action=action)
+        query = RecordMetadata.query.filter(
+            RecordMetadata.json.isnot(None)
+        ).yield_per(chunk_size)
+        index.add_many((model.id, model.json) for model in query)
+        return index
+
+    def keys(self, record):
+        """Index keys of the Needs granted by ``record``."""
+        keys = set()
+        for generator in self.generators:
+            keys.update(need_key(n) for n in generator.needs(record=record))
+        return keys
+
+    def bitmap(self, key):
+        """Bitmap of the records granting the Need of index ``key``."""
+        if key in self._bitmaps:
+            return self._bitmaps[key]
+        if key in self._offsets:
+            offset, length = self._offsets[key]
+            return Bitmap.from_bytes(self._mapped[offset:offset + length])
+        return Bitmap()
+
+    def _ordinal(self, record_id):
+        """Ordinal of ``record_id``, allocated on first use."""
+        ordinal = self.ordinals.get(record_id)
+        if ordinal is None:
+            ordinal = self.ordinals[record_id] = len(self.ids)
+            self.ids.append(record_id)
+        return ordinal
+
+    def _record_keys(self, ordinal):
+        """Index keys currently set for the record at ``ordinal``."""
+        if ordinal in self._keys:
+            return self._keys[ordinal]
+        if ordinal < len(self._stored_keys):
+            # Loaded from a dump
+            return {self._key_names[i] for i in self._stored_keys[ordinal]}
+        return set()
+
+    def add(self, record_id, record):
+        """Add or update a record in the index."""
+        self.add_many([(record_id, record)])
+
+    def add_many(self, records):
+        """Add or update records in bulk.
+
+        The bits to set and clear are collected per key first, so that each
+        bitmap is created once rather than copied for every record.
+
+        :param records: Iterable of ``(record id, record)`` tuples.
+        """
+        # Key to {ordinal: whether its bit is set}, the last update wins
+        updates = {}
+        for record_id, record in records:
+            record_id = str(record_id)
+            ordinal = self._ordinal(record_id)
+            old_keys = self._record_keys(ordinal)
+            new_keys = self.keys(record)
+            for key in old_keys - new_keys:
+                updates.setdefault(key, {})[ordinal] = False
+            for key in new_keys - old_keys:
+                updates.setdefault(key, {})[ordinal] = True
+            self._keys[ordinal] = new_keys
+            changes = [
+                change for change in (
+                    generator.next_change(record=record)
+                    for generator in self.generators
+                ) if change is not None
+            ]
+            if changes:
+                heapq.heappush(self._changes, (min(changes), record_id))
+        self._apply(updates)
+
+    def _apply(self, updates):
+        """Set and clear the bits of ``updates`` (see ``add_many``)."""
+        for key, bits in updates.items():
+            self._bitmaps[key] = self.bitmap(key).updated(
+                added=[ordinal for ordinal, bit in bits.items() if bit],
+                removed=[ordinal for ordinal, bit in bits.items() if not bit],
+            )
+
+    @property
+    def expires_at(self):
+        """Datetime of the next change of an indexed record, if any."""
+        return self._changes[0][0] if self._changes else None
+
+    def refresh(self, now=None):
+        """Re-add the records whose Needs changed by ``now``.
+
+        :returns: The ids of the refreshed records.
+        """
+        now = now or utcnow()
+        due = set()
+        while self._changes and self._changes[0][0] <= now:
+            due.add(heapq.heappop(self._changes)[1])
+        due = sorted(due & set(self.ordinals))
+        if due:
+            for model in RecordMetadata.query.filter(
+                RecordMetadata.id.in_(due)
+            ):
+                self.add(model.id, model.json)
+        return due
+
+    def remove(self, record_id):
+        """Remove a record from the index."""
+        ordinal = self.ordinals.pop(str(record_id), None)
+        if ordinal is None:
+            return
+        self._apply({key: {ordinal: False}
+                     for key in self._record_keys(ordinal)})
+        self._keys[ordinal] = set()
+        self.ids[ordinal] = None
+
+    def readable(self, identity):
+        """Bitmap of the records readable by ``identity``."""
+        if self._changes and self._changes[0][0] <= utcnow():
+            self.refresh()
+        result = Bitmap()
+        for need in identity.provides:
+            result |= self.bitmap(need_key(need))
+        return result
+
+    def record_ids(self, bitmap):
+        """Iterate over the record ids of ``bitmap``."""
+        for ordinal in bitmap:
+            yield self.ids[ordinal]
+
+    def readable_ids(self, identity):
+        """Iterate over the ids of the records readable by ``identity``."""
+        return self.record_ids(self.readable(identity))
+
+    def count(self, identity):
+        """Number of records readable by ``identity``."""
+        return len(self.readable(identity))
+
+    def dump(self, path):
+        """Write the index to ``path``."""
+        keys = set(self._bitmaps) | set(self._offsets)
+        chunks = []
+        offsets = {}
+        position = 0
+        for key in sorted(keys):
+            data = self.bitmap(key).to_bytes()
+            offsets[key] = [position, len(data)]
+            chunks.append(data)
+            position += len(data)
+
+        # Keys of each record, as positions in the sorted keys
+        names = sorted(keys)
+        positions = {key: i for i, key in enumerate(names)}
+        record_keys = [
+            sorted(positions[key] for key in self._record_keys(ordinal))
+            for ordinal in range(len(self.ids))
+        ]
+
+        header = json.dumps({
+            'ids': self.ids,
+            'offsets': offsets,
+            'keys': names,
+            'record_keys': record_keys,
+            'changes': [
+                [change.isoformat(), record_id]
+                for change, record_id in self._changes
+            ],
+        }).encode()
+
+        with open(path, 'wb') as f:
+            f.write(_MAGIC)
+            f.write(_HEADER.pack(len(header)))
+            f.write(header)
+            for data in chunks:
+                f.write(data)
+
+    def load(self, path):
+        """Memory-map the index dumped at ``path``.
+
+        Updates made afterwards are kept in memory, on top of the mapping.
+        """
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(
+                '{0} is not a record access index of this version, rebuild '
+                'it.'.format(path))
+        start = len(_MAGIC) + _HEADER.size
+        length, = _HEADER.unpack(mapped[len(_MAGIC):start])
+        header = json.loads(mapped[start:start + length].decode())
+        data_start = start + length
+
+        self.ids = header['ids']
+        self.ordinals = {
+            record_id: ordinal for ordinal, record_id in enumerate(self.ids)
+            if record_id is not None
+        }
+        self._offsets = {
+            key: (data_start + offset, size)
+            for key, (offset, size) in header['offsets'].items()
+        }
+        self._mapped = mapped
+        self._bitmaps = {}
+        self._keys = {}
+        self._key_names = header['keys']
+        self._stored_keys = header['record_keys']
+        self._changes = [
+            (parse_datetime(change), record_id)
+            for change, record_id in header.get('changes', [])
+        ]
+        heapq.heapify(self._changes)
+        return self
+
+
+_SESSION_KEY = 'permissions_access_index_changes'
+_index_lock = threading.Lock()
+
+
+def get_access_index():
+    """Record access index of the application, built on first use.
+
+    Loaded from ``RECORDS_PERMISSIONS_ACCESS_INDEX_PATH`` if set, built from
+    the database otherwise. ``None`` if ``RECORDS_PERMISSIONS_ACCESS_INDEX``
+    is disabled.
+    """
+    config = current_app.config
+    if not config['RECORDS_PERMISSIONS_ACCESS_INDEX']:
+        return None
+    ext = current_app.extensions['invenio-records-permissions']
+    if ext.access_index is None:
+        policy = get_record_permission_policy()
+        path = config['RECORDS_PERMISSIONS_ACCESS_INDEX_PATH']
+        if path:
+            ext.access_index = RecordAccessIndex.from_policy(policy).load(path)
+        else:
+            ext.access_index = RecordAccessIndex.build(policy)
+    return ext.access_index
+
+
+def _track(record, data):
+    """Remember the change of ``record`` until its session commits."""
+    if current_app.extensions['invenio-records-permissions'] \
+            .access_index is None:
+        # Built from the database when first used
+        return
+    model = getattr(record, 'model', None)
+    session = object_session(model) if model is not None else None
+    if session is not None:
+        session.info.setdefault(_SESSION_KEY, {})[str(model.id)] = data
+
+
+def track_record_change(sender, record=None, **kwargs):
+    """Track a created or updated record.
+
+    Connected to ``after_record_insert`` and ``after_record_update``.
+    """
+    _track(record, record.dumps())
+
+
+def track_record_deletion(sender, record=None, **kwargs):
+    """Track a deleted record. Connected to ``after_record_delete``."""
+    _track(record, None)
+
+
+def apply_record_changes(session):
+    """Update the access index with the records committed in ``session``.
+
+    Connected to the ``after_commit`` event of the SQLAlchemy sessions.
+    """
+    changes = session.info.pop(_SESSION_KEY, None)
+    if not changes or not has_app_context():
+        return
+    index = current_app.extensions['invenio-records-permissions'] \
+        .access_index
+    if index is None:
+        return
+    with _index_lock:
+        index.add_many(
+            (record_id, data) for record_id, data in changes.items()
+            if data is not None
+        )
+        for record_id, data in changes.items():
+            if data is None:
+                index.remove(record_id)
+
+
+def discard_record_changes(session):
+    """Forget the records changed in ``session``, which rolled back.
+
+    Connected to the ``after_rollback`` event of the SQLAlchemy sessions.
+    """
+    session.info.pop(_SESSION_KEY, None)
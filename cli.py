@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Command line interface for invenio-records-permissions."""
+
+import json
+
+import click
+from flask import current_app, g
+from flask_principal import AnonymousIdentity, Identity, UserNeed
+from invenio_access.permissions import any_user, authenticated_user
+from invenio_search import current_search_client
+from flask.cli import with_appcontext
+
+from .anonymous import update_anonymous_aliases
+from .api import RecordsSearch, rdm_records_filter
+from .audit import AUDIT_WRITERS, run_audit
+from .benchmarks import benchmark_evaluators, benchmark_need_sets
+from .evaluator import synthetic_records
+from .loadtest import CHECKS, run_load_test
+from .policies import get_record_permission_policy
+
+
+@click.group()
+def permissions():
+    """Record permissions commands."""
+
+
+@permissions.command('warm-up')
+@with_appcontext
+def warm_up():
+    """Precompute the shared permission state (policies, networks...)."""
+    ext = current_app.extensions['invenio-records-permissions']
+    ext.warm_up(current_app)
+    click.secho('Record permissions warmed up.', fg='green')
+
+
+@permissions.command('audit')
+@click.option('--output', '-o', required=True, type=click.Path(),
+              help='Report file.')
+@click.option('--format', '-f', 'output_format', default='csv',
+              type=click.Choice(sorted(AUDIT_WRITERS)))
+@click.option('--action', '-a', 'actions', multiple=True,
+              default=['read'], show_default=True,
+              help='Policy action to audit (repeatable).')
+@click.option('--chunk-size', default=1000, show_default=True,
+              help='Number of records per chunk.')
+@click.option('--jobs', '-j', type=int, default=None,
+              help='Number of worker processes [default: CPU count].')
+@click.option('--checkpoint', type=click.Path(), default=None,
+              help='File storing the progress, to resume an audit.')
+@with_appcontext
+def audit(output, output_format, actions, chunk_size, jobs, checkpoint):
+    """Report who is allowed to perform actions on every record."""
+    try:
+        writer = AUDIT_WRITERS[output_format](output)
+    except ImportError:
+        raise click.UsageError(
+            'pyarrow is required for the {0} format.'.format(output_format))
+
+    def progress(count, elapsed):
+        click.echo('{0} records audited ({1:.0f} records/s)'.format(
+            count, count / elapsed if elapsed else 0), err=True)
+
+    try:
+        # Each record is audited with its own policy
+        count = run_audit(
+            None, actions, writer,
+            chunk_size=chunk_size, jobs=jobs, checkpoint=checkpoint,
+            progress=progress,
+        )
+    finally:
+        writer.close()
+    click.secho('{0} records audited.'.format(count), fg='green')
+
+
+@permissions.command('anonymous-aliases')
+@click.option('--index', default=None,
+              help='Index or alias to filter [default: the records index].')
+@with_appcontext
+def anonymous_aliases(index):
+    """Create the permission filtered aliases for anonymous searches."""
+    aliases = update_anonymous_aliases(
+        current_search_client, index or RecordsSearch.Meta.index,
+        rdm_records_filter,
+    )
+    for alias in aliases:
+        click.echo(alias)
+    click.secho('{0} aliases updated.'.format(len(aliases)), fg='green')
+
+
+@permissions.command('benchmark')
+@click.option('--records', '-n', 'count', default=10000, show_default=True,
+              help='Number of synthetic records.')
+@click.option('--action', '-a', default='read', show_default=True)
+@click.option('--user', '-u', 'user_id', type=int, default=None,
+              help='User id of the identity [default: anonymous].')
+@with_appcontext
+def benchmark(count, action, user_id):
+    """Compare the generic and compiled evaluations of the policy."""
+    if user_id is None:
+        identity = AnonymousIdentity()
+    else:
+        identity = Identity(user_id)
+        identity.provides.update([UserNeed(user_id), authenticated_user])
+    identity.provides.add(any_user)
+
+    with current_app.test_request_context():
+        g.identity = identity
+        try:
+            result = benchmark_evaluators(
+                get_record_permission_policy(), identity,
+                synthetic_records(count), action=action,
+            )
+        except ValueError as e:
+            raise click.UsageError(str(e))
+    click.echo(json.dumps(result, indent=2))
+
+
+@permissions.command('benchmark-needs')
+@click.option('--owners', default=10000, show_default=True,
+              help='Number of owners of the record.')
+@click.option('--groups', default=1000, show_default=True,
+              help='Number of groups of the record.')
+@click.option('--checks', default=100, show_default=True)
+@with_appcontext
+def benchmark_needs(owners, groups, checks):
+    """Compare lazy and materialized Needs of records with many owners."""
+    result = benchmark_need_sets(owners=owners, groups=groups, checks=checks)
+    click.echo(json.dumps(result, indent=2))
+
+
+def _parse_mix(ctx, param, value):
+    """Parse ``kind=weight,...`` into a dictionary."""
+    if not value:
+        return None
+    mix = {}
+    for item in value.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in CHECKS:
+            raise click.BadParameter(
+                'unknown check {0}, use {1}'.format(kind, ', '.join(CHECKS)))
+        try:
+            mix[kind] = float(weight) if weight else 1.0
+        except ValueError:
+            raise click.BadParameter('invalid weight {0}'.format(weight))
+    return mix
+
+
+@permissions.command('loadtest')
+@click.option('--records', '-n', default=1000, show_default=True,
+              help='Number of seeded records (and buckets).')
+@click.option('--identities', default=50, show_default=True,
+              help='Number of distinct identities.')
+@click.option('--concurrency', '-c', default=4, show_default=True,
+              help='Number of worker threads.')
+@click.option('--checks', default=10000, show_default=True,
+              help='Total number of checks.')
+@click.option('--mix', callback=_parse_mix, default=None,
+              help='Weights of the checks, e.g. "read=4,files=2,search=1".')
+@click.option('--policy', default=None,
+              help='Import string of the record policy.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--output', '-o', type=click.File('w'), default='-',
+              help='JSON results file [default: stdout].')
+def loadtest(records, identities, concurrency, checks, mix, policy, seed,
+             output):
+    """Load test the permission checks on a self-contained SQLite app."""
+    result = run_load_test(
+        records=records, identities=identities, concurrency=concurrency,
+        checks=checks, mix=mix, policy=policy, seed=seed,
+    )
+    json.dump(result, output, indent=2, sort_keys=True)
+    output.write('\n')
+    if result['errors']:
+        click.secho('{0} checks failed.'.format(result['errors']),
+                    fg='red', err=True)
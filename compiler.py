@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Specialized evaluators of policy actions.
+
+The generic evaluation of a policy action collects the Needs of every
+generator, expands them and intersects them with the Needs of the identity.
+When all the generators of an action provide a ``snippet`` (and an
+``exclude_snippet``), a Python function specialized for the action is
+generated instead, e.g. for ``can_read = [AnyUserIfPublic(), RecordOwners()]``
+and an identity with facts ``facts``::
+
+    def evaluate(facts, record):
+        restrictions = get_descriptor(record)
+        if (facts.any_user and not (...)) or (facts.any_user if ...):
+            return True
+        return facts.superuser
+
+The decisions are the same as the generic ones: excluded identities are
+denied, then any granting generator allows, then super users are allowed.
+Actions with a generator without snippets keep the generic evaluation.
+"""
+
+from flask import g, has_app_context
+from flask_principal import ActionNeed
+from invenio_access import Permission
+from invenio_access.permissions import any_user, superuser_access
+
+from .network import current_ip_classes
+from .restrictions import get_descriptor
+
+
+class _lazy(object):
+    """Attribute computed on first access, then stored on the instance."""
+
+    def __init__(self, compute):
+        """Constructor."""
+        self.compute = compute
+        self.__doc__ = compute.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.compute.__name__] = \
+            self.compute(instance)
+        return value
+
+
+class IdentityFacts(object):
+    """What the snippets read from an identity, computed on first use."""
+
+    def __init__(self, identity):
+        """Constructor."""
+        self.identity = identity
+        self._actions = {}
+
+    @_lazy
+    def any_user(self):
+        """Whether the identity provides ``any_user``."""
+        return any_user in self.identity.provides
+
+    @_lazy
+    def user_ids(self):
+        """Ids of the users of the identity."""
+        return frozenset(
+            need.value for need in self.identity.provides
+            if need.method == 'id'
+        )
+
+    @_lazy
+    def roles(self):
+        """Names of the roles of the identity."""
+        return frozenset(
+            need.value for need in self.identity.provides
+            if need.method == 'role'
+        )
+
+    @_lazy
+    def ip_classes(self):
+        """IP classes of the current request."""
+        return current_ip_classes()
+
+    @_lazy
+    def superuser(self):
+        """Whether the identity has ``superuser-access``."""
+        return Permission(superuser_access).allows(self.identity)
+
+    def has_action(self, name):
+        """Whether the identity is granted the action ``name``."""
+        if name not in self._actions:
+            self._actions[name] = Permission(
+                ActionNeed(name)
+            ).allows(self.identity)
+        return self._actions[name]
+
+
+def identity_facts(identity):
+    """Facts of ``identity``, cached on it.
+
+    The cached facts are reused while the identity provides the same Needs
+    and the IP classes of the request are the same.
+    """
+    key = (
+        frozenset(identity.provides),
+        g.get('_permissions_ip_classes') if has_app_context() else None,
+    )
+    cached = getattr(identity, '_permissions_facts', None)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    facts = IdentityFacts(identity)
+    identity._permissions_facts = (key, facts)
+    return facts
+
+
+def evaluator_source(generators):
+    """Source code of the evaluator of ``generators``.
+
+    ``None`` if a generator has no snippet.
+    """
+    grants, denies = [], []
+    for generator in generators:
+        grant = generator.snippet()
+        deny = generator.exclude_snippet()
+        if grant is None or deny is None:
+            return None
+        if grant != 'False':
+            grants.append(grant)
+        if deny != 'False':
+            denies.append(deny)
+
+    lines = ['def evaluate(facts, record):']
+    if any('restrictions' in snippet for snippet in grants + denies):
+        lines.append('    restrictions = get_descriptor(record)')
+    if denies:
+        lines.append('    if {0}:'.format(
+            ' or '.join('({0})'.format(s) for s in denies)))
+        lines.append('        return False')
+    if grants:
+        lines.append('    if {0}:'.format(
+            ' or '.join('({0})'.format(s) for s in grants)))
+        lines.append('        return True')
+    lines.append('    return facts.superuser')
+    return '\n'.join(lines) + '\n'
+
+
+def compile_evaluator(generators, name='<policy>'):
+    """Function ``(facts, record)`` deciding for ``generators``.
+
+    ``None`` if a generator has no snippet.
+    """
+    source = evaluator_source(generators)
+    if source is None:
+        return None
+    namespace = {'get_descriptor': get_descriptor}
+    exec(compile(source, name, 'exec'), namespace)
+    evaluate = namespace['evaluate']
+    evaluate.source = source
+    return evaluate
+
+
+def get_evaluator(policy, action, cache):
+    """Compiled evaluator of the ``action`` of ``policy``, kept in ``cache``.
+
+    The evaluator is compiled again if the generators of the action were
+    reassigned.
+
+    :param policy: Policy instance.
+    :returns: The evaluator or ``None`` if the action can not be compiled.
+    """
+    key = (type(policy), action)
+    generators = policy.generators
+    cached = cache.get(key)
+    if cached is not None and cached[0] is generators:
+        return cached[1]
+    evaluator = compile_evaluator(
+        generators,
+        name='<{0}.can_{1}>'.format(type(policy).__name__, action),
+    )
+    cache[key] = (generators, evaluator)
+    return evaluator
@@ -13,3 +13,153 @@ RECORDS_PERMISSIONS_RECORD_POLICY = (
     'invenio_records_permissions.policies.RecordPermissionPolicy'
 )
 """PermissionPolicy used by provided record permission factories."""
+
+RECORDS_PERMISSIONS_POLICIES = {}
+"""PermissionPolicy per record discriminator value.
+
+Dictionary of discriminator value (e.g. a ``$schema`` URL or a community id)
+to policy class or import string. Records without a registered value use
+``RECORDS_PERMISSIONS_RECORD_POLICY``. Entries of the
+``invenio_records_permissions.policies`` entry point group (named after the
+value) are registered too, the configuration taking precedence.
+"""
+
+RECORDS_PERMISSIONS_POLICY_DISCRIMINATOR = '$schema'
+"""Record field (dotted path) holding the discriminator of the policies."""
+
+RECORDS_PERMISSIONS_ENDPOINT_POLICIES = {}
+"""Discriminator value of the records created through each endpoint.
+
+Dictionary of Flask endpoint (e.g. ``invenio_records_rest.recid_list``) to
+a value of ``RECORDS_PERMISSIONS_POLICIES``. The create permission uses the
+policy of the endpoint of the request, never the discriminator submitted
+in the record, and ``RECORDS_PERMISSIONS_RECORD_POLICY`` for other
+endpoints.
+"""
+
+RECORDS_PERMISSIONS_REINDEX_ENABLED = False
+"""Send partial index updates when the permission fields of a record change."""
+
+RECORDS_PERMISSIONS_REINDEX_FIELDS = [
+    'owners',
+    'group_restrictions',
+    'applied_restrictions',
+    '_access',
+    'internal.access_levels',
+]
+"""Record fields (dotted paths) defining the access to a record."""
+
+RECORDS_PERMISSIONS_REINDEX_INDEX = 'records'
+"""Index (or alias) receiving the permission partial updates."""
+
+RECORDS_PERMISSIONS_REINDEX_BATCH_SIZE = 500
+"""Number of committed partial updates triggering a bulk request."""
+
+RECORDS_PERMISSIONS_ACCESS_INDEX = False
+"""Keep a bitmap index of the records readable by identities.
+
+The index of the read action of the default policy is built on first use
+(see ``invenio_records_permissions.bitmaps.get_access_index``) and updated
+when records are committed in the process.
+"""
+
+RECORDS_PERMISSIONS_ACCESS_INDEX_PATH = None
+"""Dump of the access index to memory-map instead of building it."""
+
+RECORDS_PERMISSIONS_WARM_UP = False
+"""Precompute the shared permission state when the extension is initialized.
+
+Enable it when the application is loaded before the server forks its
+workers. See also the ``invenio permissions warm-up`` command.
+"""
+
+RECORDS_PERMISSIONS_DECISION_LOG_SAMPLE_RATE = 0.0
+"""Fraction of the permission decisions written to the decision log.
+
+Decisions are logged to ``invenio_records_permissions.decisions`` by a
+background thread. ``0`` disables the log.
+"""
+
+RECORDS_PERMISSIONS_DECISION_LOG_SIZE = 1000
+"""Maximum number of decisions buffered before the oldest are dropped."""
+
+RECORDS_PERMISSIONS_NETWORKS = {}
+"""Named networks (IP classes) in addition to the IPs of ``setup.py``.
+
+Dictionary of IP class name to list of networks, e.g.
+``{'campus': ['10.0.0.0/8', '2001:db8::/32']}``. A record is restricted to
+a network by adding its name to the record's ``applied_restrictions`` and
+using the ``RecordNetwork`` generator.
+"""
+
+RECORDS_PERMISSIONS_UNKNOWN_RESTRICTIONS = 'warn'
+"""How to handle unknown values in the ``applied_restrictions`` of records.
+
+``'warn'`` logs a warning (once per unknown value), ``'error'`` raises an
+``UnknownRestrictionError`` and ``'ignore'`` ignores them.
+"""
+
+RECORDS_PERMISSIONS_ANONYMOUS_CACHE = False
+"""Reuse the search filters and record independent decisions of anonymous
+identities per IP classes."""
+
+RECORDS_PERMISSIONS_ANONYMOUS_CACHE_TTL = 60
+"""Seconds the search filters and decisions of anonymous identities are
+cached (grants to system roles may change in other processes)."""
+
+RECORDS_PERMISSIONS_ANONYMOUS_ALIASES = False
+"""Search on filtered aliases for anonymous identities.
+
+The aliases must be created first, with the
+``invenio permissions anonymous-aliases`` command.
+"""
+
+RECORDS_PERMISSIONS_FINGERPRINT_TTL = 60
+"""Seconds the dependencies of a policy used by permission fingerprints are
+cached (ActionNeed expansions may change)."""
+
+RECORDS_PERMISSIONS_PREAUTHORIZED_CHECK_RATE = 0.0
+"""Fraction of the pre-authorized read checks verified in full.
+
+Disagreements are logged as errors and the full decision is used.
+"""
+
+RECORDS_PERMISSIONS_COMPILED_POLICIES = False
+"""Evaluate the policy actions with generated, specialized functions.
+
+Only actions whose generators all provide snippets are compiled, the others
+keep the generic evaluation.
+"""
+
+RECORDS_PERMISSIONS_ASYNC_DATABASE_URI = None
+"""Database URI of the asynchronous permission evaluation.
+
+Defaults to ``SQLALCHEMY_DATABASE_URI`` with the async driver of its dialect
+(``asyncpg``, ``aiosqlite`` or ``aiomysql``).
+"""
+
+RECORDS_PERMISSIONS_PROFILE_SAMPLE_RATE = 0.0
+"""Fraction of the permission checks and search filters to profile."""
+
+RECORDS_PERMISSIONS_PROFILE_THRESHOLD = 0.1
+"""Latency (seconds) above which a profiled call is dumped."""
+
+RECORDS_PERMISSIONS_PROFILE_DIR = None
+"""Directory of the profile dumps.
+
+Defaults to ``permissions-profiles`` in the application instance folder.
+"""
+
+RECORDS_PERMISSIONS_PROFILE_MAX_FILES = 50
+"""Number of profile dumps kept, the oldest ones are removed first."""
+
+RECORDS_PERMISSIONS_IDENTITY_CACHE = False
+"""Load the roles and actions of the users from a versioned cache.
+
+Replaces the role loader of Flask-Security, the extension must be
+initialized after Invenio-Accounts. The cache is shared through
+invenio-cache if it is installed, kept per process otherwise.
+"""
+
+RECORDS_PERMISSIONS_IDENTITY_CACHE_TTL = 3600
+"""Lifetime (seconds) of the cached roles and actions of a user."""
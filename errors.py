@@ -11,3 +11,15 @@
 
 class UnknownGeneratorError(Exception):
     """Error raised when an unknown generator is detected."""
+
+
+class InvalidPolicyError(Exception):
+    """Error raised when a registered permission policy is invalid."""
+
+
+class UnknownRestrictionError(Exception):
+    """Error raised when a record has an unknown applied restriction."""
+
+
+class UnsupportedQueryError(Exception):
+    """Error raised when a query can not be evaluated in memory."""
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""In-memory evaluation of permission query filters.
+
+The query filters produced by the generators can be applied to records
+already in memory (cached search pages, local replicas, tests) without a
+search round-trip. A filter is compiled once into nested functions that
+evaluate a whole batch of records at a time: every clause receives the
+positions of the records still candidate and returns the matching ones, so
+``bool`` clauses only evaluate what is left to decide.
+
+Supported queries are the ones the generators use: ``match_all``,
+``match_none``, ``term``, ``terms``, ``match``, ``exists``, ``range`` (with
+``now`` as the only date math) and ``bool`` (``must``, ``filter``,
+``should``, ``must_not`` and ``minimum_should_match``). Text analysis is
+approximated by lower-cased whitespace tokens.
+"""
+
+import operator
+import random
+import re
+from functools import reduce
+
+from flask import g
+
+from .errors import UnsupportedQueryError
+from .utils import parse_datetime, utcnow
+
+
+def field_values(record, path):
+    """All the values at the dotted ``path`` of ``record``, lists flattened."""
+    values = [record]
+    for key in path.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, dict) and key in value:
+                found.append(value[key])
+        values = []
+        for value in found:
+            if isinstance(value, (list, tuple)):
+                values.extend(value)
+            else:
+                values.append(value)
+    return [v for v in values if v is not None]
+
+
+def _equals(value, expected):
+    """Term equality, objects matching on the expected keys."""
+    if isinstance(expected, dict):
+        return isinstance(value, dict) and all(
+            value.get(k) == v for k, v in expected.items()
+        )
+    if isinstance(value, bool) or isinstance(expected, bool):
+        return str(value).lower() == str(expected).lower()
+    return value == expected or str(value) == str(expected)
+
+
+def _term_key(value):
+    """String compared by ``terms``, booleans lower-cased like in JSON."""
+    return str(value).lower() if isinstance(value, bool) else str(value)
+
+
+def _tokens(value):
+    """Lower-cased tokens of a text value."""
+    return set(re.findall(r'\w+', str(value).lower()))
+
+
+def _field_and_value(params, value_key):
+    """Split ``{field: value}`` or ``{field: {value_key: value}}``."""
+    (field, value), = params.items()
+    if isinstance(value, dict) and value_key in value:
+        value = value[value_key]
+    return field, value
+
+
+def _leaf(test):
+    """Clause keeping the candidates for which ``test(record)`` holds."""
+    def clause(records, candidates):
+        return [i for i in candidates if test(records[i])]
+    return clause
+
+
+def _compile_term(params):
+    field, expected = _field_and_value(params, 'value')
+    return _leaf(lambda record: any(
+        _equals(v, expected) for v in field_values(record, field)
+    ))
+
+
+def _compile_terms(params):
+    (field, expected), = (
+        (k, v) for k, v in params.items() if k != 'boost'
+    )
+    hashable = {_term_key(v) for v in expected}
+    return _leaf(lambda record: any(
+        _term_key(v) in hashable for v in field_values(record, field)
+    ))
+
+
+def _compile_match(params):
+    field, query = _field_and_value(params, 'query')
+    query_tokens = _tokens(query)
+    return _leaf(lambda record: any(
+        query_tokens & _tokens(v) for v in field_values(record, field)
+    ))
+
+
+def _compile_exists(params):
+    field = params['field']
+    return _leaf(lambda record: bool(field_values(record, field)))
+
+
+_RANGE_OPERATORS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+
+def _is_date_math(bound):
+    """Tell if a range bound is ``now`` date math."""
+    if not isinstance(bound, str) or not bound.startswith('now'):
+        return False
+    if bound.split('/')[0] != 'now':
+        raise UnsupportedQueryError(
+            'Unsupported date math {0}'.format(bound))
+    # Rounding (e.g. ``now/d``) is ignored
+    return True
+
+
+def _compile_range(params):
+    (field, bounds), = params.items()
+    checks = [
+        (_RANGE_OPERATORS[name], bound) for name, bound in bounds.items()
+        if name in _RANGE_OPERATORS
+    ]
+    dates = any(_is_date_math(bound) for _, bound in checks)
+
+    def clause(records, candidates):
+        resolved = checks
+        if dates:
+            now = utcnow()
+            resolved = [
+                (op, now if _is_date_math(bound) else parse_datetime(bound))
+                for op, bound in checks
+            ]
+
+        def test(record):
+            for value in field_values(record, field):
+                if dates:
+                    value = parse_datetime(value)
+                try:
+                    if all(op(value, bound) for op, bound in resolved):
+                        return True
+                except TypeError:
+                    continue
+            return False
+        return [i for i in candidates if test(records[i])]
+    return clause
+
+
+def _minimum_should_match(spec, clauses):
+    """Number of ``should`` clauses to match for an ES specification."""
+    if isinstance(spec, int):
+        return spec
+    spec = str(spec).strip()
+    if spec.isdigit():
+        return int(spec)
+    conditional = re.match(r'^(\d+)<(\d+)$', spec)
+    if conditional:
+        threshold, value = map(int, conditional.groups())
+        return value if clauses > threshold else clauses
+    raise UnsupportedQueryError(
+        'Unsupported minimum_should_match {0}'.format(spec))
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def _compile_bool(params):
+    required = [
+        compile_clause(q) for key in ('must', 'filter')
+        for q in _as_list(params.get(key, []))
+    ]
+    should = [compile_clause(q) for q in _as_list(params.get('should', []))]
+    must_not = [
+        compile_clause(q) for q in _as_list(params.get('must_not', []))
+    ]
+    if 'minimum_should_match' in params:
+        minimum = _minimum_should_match(
+            params['minimum_should_match'], len(should))
+    else:
+        minimum = 0 if required else 1
+    minimum = min(minimum, len(should))
+
+    def clause(records, candidates):
+        for sub in required:
+            if not candidates:
+                break
+            candidates = sub(records, candidates)
+        for sub in must_not:
+            if not candidates:
+                break
+            excluded = set(sub(records, candidates))
+            candidates = [i for i in candidates if i not in excluded]
+        if minimum and candidates:
+            counts = dict.fromkeys(candidates, 0)
+            for sub in should:
+                for i in sub(records, candidates):
+                    counts[i] += 1
+            candidates = [i for i in candidates if counts[i] >= minimum]
+        return candidates
+    return clause
+
+
+_COMPILERS = {
+    'match_all': lambda params: lambda records, candidates: candidates,
+    'match_none': lambda params: lambda records, candidates: [],
+    'term': _compile_term,
+    'terms': _compile_terms,
+    'match': _compile_match,
+    'exists': _compile_exists,
+    'range': _compile_range,
+    'bool': _compile_bool,
+}
+
+
+def compile_clause(query):
+    """Compile a query (dict or ``elasticsearch_dsl`` query) into a clause.
+
+    A clause is a function ``(records, candidates)`` returning the list of
+    candidate positions of the records matching the query.
+    """
+    if hasattr(query, 'to_dict'):
+        query = query.to_dict()
+    (name, params), = query.items()
+    try:
+        compiler = _COMPILERS[name]
+    except KeyError:
+        raise UnsupportedQueryError('Unsupported query {0}'.format(name))
+    return compiler(params)
+
+
+def compile_query(query):
+    """Compile a query into a predicate over a list of records.
+
+    :returns: A function taking a list of records and returning the list of
+        booleans telling which records match.
+    """
+    clause = compile_clause(query)
+
+    def predicate(records):
+        matching = set(clause(records, list(range(len(records)))))
+        return [i in matching for i in range(len(records))]
+    return predicate
+
+
+def filter_records(query, records):
+    """Records of ``records`` matching ``query``."""
+    records = list(records)
+    clause = compile_clause(query)
+    return [records[i] for i in clause(records, list(range(len(records))))]
+
+
+def policy_query(policy, action='read'):
+    """Query filter of a policy action, combined like the search does."""
+    filters = policy(action=action).query_filters
+    if not filters:
+        return {'match_all': {}}
+    return reduce(operator.or_, filters)
+
+
+def synthetic_records(count, users=10, groups=5, seed=0):
+    """Random records exercising the fields read by the generators."""
+    rnd = random.Random(seed)
+    restrictions = ['owners', 'groups', 'ip_single', 'ip_range']
+    records = []
+    for _ in range(count):
+        records.append({
+            'owners': rnd.sample(range(1, users + 1), rnd.randint(0, 3)),
+            'group_restrictions': [
+                'group-{0}'.format(i)
+                for i in rnd.sample(range(groups), rnd.randint(0, 2))
+            ],
+            'applied_restrictions': rnd.sample(
+                restrictions, rnd.randint(0, len(restrictions))),
+            '_access': {
+                'metadata_restricted': rnd.random() < 0.5,
+                'files_restricted': rnd.random() < 0.5,
+            },
+            'internal': {'access_levels': {'metadata_curator': [
+                {'scheme': 'person', 'id': rnd.randint(1, users)}
+            ] if rnd.random() < 0.3 else []}},
+        })
+    return records
+
+
+def check_policy_consistency(policy, identity, records, action='read'):
+    """Compare the decisions of ``needs`` and ``query_filter``.
+
+    Must be called in a request context. The query filters are built for
+    ``identity`` (set as ``g.identity``) and evaluated in memory, then
+    compared with ``allows`` on each record.
+
+    :returns: The list of ``(record, allowed, matched)`` disagreements.
+    """
+    previous = g.get('identity')
+    g.identity = identity
+    try:
+        matched = compile_query(policy_query(policy, action=action))(records)
+        disagreements = []
+        for record, match in zip(records, matched):
+            allowed = policy(action=action, record=record).allows(identity)
+            if allowed != match:
+                disagreements.append((record, allowed, match))
+        return disagreements
+    finally:
+        g.identity = previous
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Explanation and logging of permission decisions."""
+
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from timeit import default_timer
+
+from .utils import ProcessThread
+
+logger = logging.getLogger('invenio_records_permissions.decisions')
+
+
+def _need_label(need):
+    """Readable label of a Need."""
+    return '{0}:{1}'.format(need.method, need.value)
+
+
+def explain_generators(generators, identity, **over):
+    """Trace of what each generator contributes to a decision.
+
+    ``matched``/``excluded`` compare the generated Needs with the identity as
+    is, i.e. before the expansion of ActionNeeds into users and roles.
+    """
+    provides = identity.provides
+    trace = []
+    for generator in generators:
+        start = default_timer()
+        needs = set(generator.needs(**over))
+        excludes = set(generator.excludes(**over))
+        elapsed = default_timer() - start
+        trace.append({
+            'generator': type(generator).__name__,
+            'needs': sorted(map(_need_label, needs)),
+            'excludes': sorted(map(_need_label, excludes)),
+            'matched': bool(needs & provides),
+            'excluded': bool(excludes & provides),
+            'time': elapsed,
+        })
+    return trace
+
+
+class DecisionLog(object):
+    """Sampled log of permission decisions.
+
+    Sampled decisions are appended to a bounded ring buffer (the oldest ones
+    are dropped when it is full) and written to the
+    ``invenio_records_permissions.decisions`` logger by a background thread,
+    outside of the request. The thread is started by the first sampled
+    decision of each process, e.g. in the workers of a preforking server.
+    """
+
+    def __init__(self, sample_rate, size=1000):
+        """Constructor."""
+        self.sample_rate = sample_rate
+        self._buffer = deque(maxlen=size)
+        self._event = threading.Event()
+        self._writer = ProcessThread(
+            self._run, 'permissions-decision-log', reset=self._reset
+        )
+
+    def _reset(self):
+        """Drop the state inherited from the parent process."""
+        self._buffer.clear()
+        self._event = threading.Event()
+
+    def record(self, policy, identity, allowed):
+        """Sample the decision of ``policy`` for ``identity``."""
+        if random.random() >= self.sample_rate:
+            return
+        self._writer.ensure_started()
+        record_id = getattr(policy.over.get('record'), 'id', None)
+        self._buffer.append({
+            'time': time.time(),
+            'policy': type(policy).__name__,
+            'action': policy.action,
+            'identity': getattr(identity, 'id', None),
+            'record': str(record_id) if record_id else None,
+            'allowed': allowed,
+        })
+        self._event.set()
+
+    def _run(self):
+        """Write the buffered decisions."""
+        event = self._event
+        while True:
+            event.wait()
+            event.clear()
+            while self._buffer:
+                logger.info(json.dumps(self._buffer.popleft(), default=str))
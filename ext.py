@@ -11,7 +11,38 @@
 
 from __future__ import absolute_import, print_function
 
+import os
+from itertools import chain
+
+import pkg_resources
+from invenio_access import Permission
+from invenio_access.permissions import superuser_access
+from invenio_records.models import RecordMetadata
+from invenio_records.signals import after_record_delete, \
+    after_record_insert, after_record_update, before_record_update
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
 from . import config
+from .analysis import dead_generators
+from .anonymous import AnonymousCache, clear_on_system_role_changes
+from .bitmaps import apply_record_changes, discard_record_changes, \
+    track_record_change, track_record_deletion
+from .cli import permissions as permissions_cli
+from .compiler import get_evaluator
+from .errors import InvalidPolicyError
+from .explain import DecisionLog
+from .identities import IdentityCache
+from .indexer import commit_permission_updates, \
+    flush_permission_updates, queue_permission_update, \
+    rollback_permission_updates, snapshot_permission_fields
+from .network import get_network_classifier
+from .policies.base import BasePermissionPolicy
+from .profiling import SlowCallProfiler
+from .policies.records import RecordPermissionPolicy, \
+    obj_or_import_string
+from .utils import get_path
 
 
 class InvenioRecordsPermissions(object):
@@ -19,13 +50,38 @@ class InvenioRecordsPermissions(object):
 
     def __init__(self, app=None):
         """Extension initialization."""
+        self.record_policy = None
+        self.network_classifier = None
+        self.decision_log = None
+        self.anonymous_filters = None
+        self.anonymous_decisions = None
+        self.policy_dependencies = {}
+        self.policies = {}
+        self.policy_discriminator = None
+        self.async_sessionmaker = None
+        self.profiler = None
+        self.identity_cache = None
+        self.access_index = None
+        self.compiled_evaluators = None
         if app:
             self.init_app(app)
 
     def init_app(self, app):
         """Flask application initialization."""
         self.init_config(app)
+        self.init_signals(app)
+        self.init_decision_log(app)
+        self.init_anonymous_cache(app)
+        self.init_profiler(app)
+        self.init_compiled_policies(app)
+        self.init_policy_registry(app)
+        self.init_policy_analysis(app)
+        self.init_identity_cache(app)
+        app.cli.add_command(permissions_cli)
         app.extensions['invenio-records-permissions'] = self
+        if app.config['RECORDS_PERMISSIONS_WARM_UP']:
+            with app.app_context():
+                self.warm_up(app)
 
     def init_config(self, app):
         """Initialize configuration."""
@@ -38,3 +94,208 @@ class InvenioRecordsPermissions(object):
         for k in dir(config):
             if k.startswith('RECORDS_PERMISSIONS_'):
                 app.config.setdefault(k, getattr(config, k))
+
+    def init_signals(self, app):
+        """Track changes of the permission fields of records."""
+        before_record_update.connect(
+            queue_permission_update, sender=app, weak=False
+        )
+        event.listen(RecordMetadata, 'load', snapshot_permission_fields)
+        event.listen(RecordMetadata, 'refresh', snapshot_permission_fields)
+        event.listen(Session, 'after_commit', commit_permission_updates)
+        event.listen(Session, 'after_rollback', rollback_permission_updates)
+        # Changes of the records readable by identities
+        after_record_insert.connect(
+            track_record_change, sender=app, weak=False
+        )
+        after_record_update.connect(
+            track_record_change, sender=app, weak=False
+        )
+        after_record_delete.connect(
+            track_record_deletion, sender=app, weak=False
+        )
+        event.listen(Session, 'after_commit', apply_record_changes)
+        event.listen(Session, 'after_rollback', discard_record_changes)
+        app.teardown_appcontext(flush_permission_updates)
+
+    def init_decision_log(self, app):
+        """Enable the sampled decision log if configured."""
+        config = app.config
+        sample_rate = config['RECORDS_PERMISSIONS_DECISION_LOG_SAMPLE_RATE']
+        if sample_rate:
+            self.decision_log = DecisionLog(
+                sample_rate,
+                size=config['RECORDS_PERMISSIONS_DECISION_LOG_SIZE'],
+            )
+
+    def init_anonymous_cache(self, app):
+        """Enable the cache of anonymous search filters and decisions."""
+        if app.config['RECORDS_PERMISSIONS_ANONYMOUS_CACHE']:
+            ttl = app.config['RECORDS_PERMISSIONS_ANONYMOUS_CACHE_TTL']
+            self.anonymous_filters = AnonymousCache(ttl)
+            self.anonymous_decisions = AnonymousCache(ttl)
+            clear_on_system_role_changes(
+                [self.anonymous_filters, self.anonymous_decisions]
+            )
+
+    def init_profiler(self, app):
+        """Enable the sampled profiling of slow checks if configured."""
+        config = app.config
+        sample_rate = config['RECORDS_PERMISSIONS_PROFILE_SAMPLE_RATE']
+        if sample_rate:
+            self.profiler = SlowCallProfiler(
+                sample_rate,
+                config['RECORDS_PERMISSIONS_PROFILE_THRESHOLD'],
+                config['RECORDS_PERMISSIONS_PROFILE_DIR'] or os.path.join(
+                    app.instance_path, 'permissions-profiles'
+                ),
+                max_files=config['RECORDS_PERMISSIONS_PROFILE_MAX_FILES'],
+            )
+
+    def init_compiled_policies(self, app):
+        """Enable the compiled evaluators of policy actions if configured."""
+        if app.config['RECORDS_PERMISSIONS_COMPILED_POLICIES']:
+            self.compiled_evaluators = {}
+
+    def init_policy_registry(self, app, entry_point_group=None):
+        """Register the policies per record discriminator value.
+
+        All the policies are imported and validated here, so that a
+        misconfiguration fails at startup rather than on a request.
+        """
+        self.policy_discriminator = \
+            app.config['RECORDS_PERMISSIONS_POLICY_DISCRIMINATOR']
+        entry_point_group = entry_point_group or \
+            'invenio_records_permissions.policies'
+
+        policies = {}
+        for entry_point in pkg_resources.iter_entry_points(
+            group=entry_point_group
+        ):
+            policies[entry_point.name] = entry_point
+        policies.update(app.config['RECORDS_PERMISSIONS_POLICIES'])
+
+        self.policies = {}
+        for value, policy in policies.items():
+            try:
+                if isinstance(policy, pkg_resources.EntryPoint):
+                    policy = policy.load()
+                policy = obj_or_import_string(policy)
+            except (ImportError, AttributeError) as e:
+                raise InvalidPolicyError(
+                    'Policy of {0!r} can not be imported: {1}'.format(value, e)
+                )
+            if not isinstance(policy, type) or \
+                    not issubclass(policy, BasePermissionPolicy):
+                raise InvalidPolicyError(
+                    'Policy of {0!r} is not a permission policy: {1!r}'
+                    .format(value, policy)
+                )
+            self.policies[value] = policy
+
+        for endpoint, value in \
+                app.config['RECORDS_PERMISSIONS_ENDPOINT_POLICIES'].items():
+            if value not in self.policies:
+                raise InvalidPolicyError(
+                    'No policy registered for {0!r} of endpoint {1!r}'
+                    .format(value, endpoint)
+                )
+
+    def init_policy_analysis(self, app):
+        """Warn about the generators the policies never evaluate."""
+        policies = {obj_or_import_string(
+            app.config.get('RECORDS_PERMISSIONS_RECORD_POLICY'),
+            default=RecordPermissionPolicy
+        )}
+        policies.update(self.policies.values())
+        for policy in sorted(policies, key=lambda p: p.__name__):
+            for action, generators in dead_generators(policy):
+                app.logger.warning(
+                    'Generators %s of %s.can_%s are redundant and never '
+                    'evaluated.', ', '.join(generators), policy.__name__,
+                    action,
+                )
+
+    def init_identity_cache(self, app):
+        """Load the roles and actions of users from a cache if enabled."""
+        if app.config['RECORDS_PERMISSIONS_IDENTITY_CACHE']:
+            self.identity_cache = IdentityCache(
+                app, ttl=app.config['RECORDS_PERMISSIONS_IDENTITY_CACHE_TTL']
+            )
+            self.identity_cache.connect()
+
+    def policy_for(self, record):
+        """Policy registered for the discriminator of ``record``, if any.
+
+        If the discriminator is a list (e.g. communities), the first
+        registered value is used.
+        """
+        value = get_path(record, self.policy_discriminator)
+        if isinstance(value, (list, tuple)):
+            value = next((v for v in value if v in self.policies), None)
+        try:
+            return self.policies.get(value)
+        except TypeError:
+            # Unhashable discriminator
+            return None
+
+    def warm_up(self, app):
+        """Precompute the state shared by all permission checks.
+
+        Meant to run before the application server forks its workers, so
+        that they all share it instead of building it on their first
+        requests: the configured policy is resolved, the network classifier
+        is built, the actions of the default and registered policies are
+        compiled (if enabled) and the ActionNeeds they use are expanded (kept
+        if invenio-access has a cache configured). The database connections
+        it opened are then disposed of, so that forked workers do not share
+        them.
+        """
+        self.record_policy = obj_or_import_string(
+            app.config.get('RECORDS_PERMISSIONS_RECORD_POLICY'),
+            default=RecordPermissionPolicy
+        )
+        get_network_classifier()
+
+        evaluators = self.compiled_evaluators
+        action_needs = {superuser_access}
+        policies = [self.record_policy] + [
+            policy for policy in self.policies.values()
+            if policy is not self.record_policy
+        ]
+        for policy in policies:
+            for name in dir(policy):
+                if not name.startswith('can_'):
+                    continue
+                if evaluators is not None:
+                    action = name[len('can_'):]
+                    get_evaluator(policy(action=action), action, evaluators)
+                for generator in getattr(policy, name):
+                    # Only record independent generators can be called here
+                    if generator.record_fields != ():
+                        continue
+                    action_needs.update(
+                        need for need in chain(
+                            generator.needs(), generator.excludes()
+                        ) if need.method == 'action'
+                    )
+        try:
+            Permission(*action_needs)._load_permissions()
+        except (AttributeError, KeyError, SQLAlchemyError):
+            app.logger.warning(
+                'Could not expand the ActionNeeds of the record permission '
+                'policy (invenio-access or the database not ready?).'
+            )
+        finally:
+            self._dispose_connections(app)
+
+    def _dispose_connections(self, app):
+        """Close the pooled connections opened by the warm-up.
+
+        Forked workers must not share the connections of the parent
+        process, they open their own ones.
+        """
+        if 'sqlalchemy' not in app.extensions:
+            return
+        from invenio_db import db
+        db.engine.dispose()
@@ -9,7 +9,8 @@
 
 """Pre-configured Permission Factories."""
 
-from .records import record_create_permission_factory, \
+from .records import arecord_files_permission_factory_many, \
+    record_create_permission_factory, \
     record_delete_permission_factory, record_files_permission_factory, \
-    record_list_permission_factory, record_read_permission_factory, \
-    record_update_permission_factory
+    record_list_permission_factory, record_permission_decisions, \
+    record_read_permission_factory, record_update_permission_factory
@@ -9,10 +9,18 @@
 
 """Record Permission Factories."""
 
+from flask import current_app, g
+from invenio_access.permissions import superuser_access
+from invenio_db import db
 from invenio_files_rest.models import Bucket, ObjectVersion
+from invenio_records.models import RecordMetadata
 from invenio_records_files.api import Record, RecordsBuckets
 
-from ..policies import get_record_permission_policy
+from ..aio import agather_records_and_expansions
+from ..policies import get_create_permission_policy, get_policies, \
+    get_record_permission_policy
+from ..preauthorized import allows_preauthorized, has_preauthorized_hits
+from ..utils import set_path, utcnow
 
 
 def record_list_permission_factory(record=None):
@@ -22,29 +30,140 @@ def record_list_permission_factory(record=None):
 
 
 def record_create_permission_factory(record=None):
-    """Pre-configured record create permission factory."""
-    PermissionPolicy = get_record_permission_policy()
+    """Pre-configured record create permission factory.
+
+    The policy depends on the endpoint, not on the submitted ``record``, see
+    ``RECORDS_PERMISSIONS_ENDPOINT_POLICIES``.
+    """
+    PermissionPolicy = get_create_permission_policy()
     return PermissionPolicy(action='create', record=record)
 
 
 def record_read_permission_factory(record=None):
-    """Pre-configured record read permission factory."""
-    PermissionPolicy = get_record_permission_policy()
-    return PermissionPolicy(action='read', record=record)
+    """Pre-configured record read permission factory.
+
+    Honours the pre-authorization of records returned by
+    :class:`~invenio_records_permissions.api.RecordsSearch`.
+    """
+    PermissionPolicy = get_record_permission_policy(record)
+    permission = PermissionPolicy(action='read', record=record)
+    if record is not None and has_preauthorized_hits():
+        permission.preauthorization = allows_preauthorized
+    return permission
 
 
 def record_update_permission_factory(record=None):
     """Pre-configured record update permission factory."""
-    PermissionPolicy = get_record_permission_policy()
+    PermissionPolicy = get_record_permission_policy(record)
     return PermissionPolicy(action='update', record=record)
 
 
 def record_delete_permission_factory(record=None):
     """Pre-configured record delete permission factory."""
-    PermissionPolicy = get_record_permission_policy()
+    PermissionPolicy = get_record_permission_policy(record)
     return PermissionPolicy(action='delete', record=record)
 
 
+def record_permission_decisions(action, records, identity=None):
+    """Decisions of ``action`` on many ``records`` for ``identity``.
+
+    Meant for bulk operations: records with the same permission fields (see
+    ``BasePermissionPolicy.acl_fingerprint``) share a single evaluation, so
+    the cost scales with the number of distinct ACLs rather than with the
+    number of records. A shared decision is only reused until it may change
+    (see ``BasePermissionPolicy.expires_at``).
+
+    :param identity: Defaults to the current identity.
+    :returns: The list of decisions, in the order of ``records``.
+    """
+    identity = identity or g.identity
+    decisions = {}
+    result = []
+    for record in records:
+        PermissionPolicy = get_record_permission_policy(record)
+        permission = PermissionPolicy(action=action, record=record)
+        fingerprint = permission.acl_fingerprint
+        if fingerprint is None:
+            result.append(permission.allows(identity))
+            continue
+        key = (PermissionPolicy, permission.action, fingerprint)
+        decision = decisions.get(key)
+        if decision is None or \
+                decision[1] is not None and decision[1] <= utcnow():
+            decision = decisions[key] = (
+                permission.allows(identity), permission.expires_at
+            )
+        result.append(decision[0])
+    return result
+
+
+def _policies_record_fields(action):
+    """Record fields needed to pick the policy of a record and decide.
+
+    ``None`` if any policy in use needs the whole record, or if the
+    extension is not initialized.
+    """
+    ext = current_app.extensions.get('invenio-records-permissions')
+    if ext is None:
+        return None
+    fields = set()
+    if ext.policies:
+        fields.add(ext.policy_discriminator)
+    for policy in get_policies():
+        policy_fields = policy(action=action).record_fields
+        if policy_fields is None:
+            return None
+        fields.update(policy_fields)
+    return sorted(fields)
+
+
+def _load_bucket_record(bucket_id, fields=None):
+    """Load the record of a bucket in a single query.
+
+    If ``fields`` (dotted paths) are given and the database supports JSON
+    path projections (PostgreSQL), only those fields are fetched instead of
+    the whole record metadata. The record then has a transient model with
+    the id and version of the stored record, and the projected ``json``.
+
+    :returns: The :class:`invenio_records_files.api.Record` or ``None``.
+    """
+    query = db.session.query(RecordMetadata).join(
+        RecordsBuckets, RecordsBuckets.record_id == RecordMetadata.id
+    ).filter(RecordsBuckets.bucket_id == bucket_id)
+
+    if fields is None or db.engine.dialect.name != 'postgresql':
+        record_metadata = query.one_or_none()
+        if record_metadata is None:
+            return None
+        return Record(record_metadata.json, model=record_metadata)
+
+    columns = [RecordMetadata.json[tuple(f.split('.'))] for f in fields]
+    row = query.with_entities(
+        RecordMetadata.id, RecordMetadata.version_id, *columns
+    ).one_or_none()
+    if row is None:
+        return None
+    data = {}
+    for path, value in zip(fields, row[2:]):
+        if value is not None:
+            set_path(data, path, value)
+    model = RecordMetadata(id=row[0], version_id=row[1], json=data)
+    return Record(data, model=model)
+
+
+def _bucket_id(obj):
+    """Id of the bucket of a files object."""
+    if isinstance(obj, Bucket):
+        # File creation
+        return str(obj.id)
+    elif isinstance(obj, ObjectVersion):
+        # File download
+        return str(obj.bucket_id)
+    # TODO: Reassess if covering FileObject, MultipartObject
+    #       makes sense via bucket_id = str(obj.bucket_id)
+    raise RuntimeError('Unknown object')
+
+
 def record_files_permission_factory(obj, action):
     """Files permission factory for any action.
 
@@ -57,29 +176,56 @@ def record_files_permission_factory(obj, action):
         :class:`invenio_records_permissions.policies.base.BasePermissionPolicy`
         instance.
     """
-    if isinstance(obj, Bucket):
-        # File creation
-        bucket_id = str(obj.id)
-    elif isinstance(obj, ObjectVersion):
-        # File download
-        bucket_id = str(obj.bucket_id)
-    else:
-        # TODO: Reassess if covering FileObject, MultipartObject
-        #       makes sense via bucket_id = str(obj.bucket_id)
-        raise RuntimeError('Unknown object')
+    bucket_id = _bucket_id(obj)
 
-    # Retrieve record
+    # Retrieve record, restricted to the fields the generators need
     # WARNING: invenio-records-files implies a one-to-one relationship
     #          between Record and Bucket, but does not enforce it
     #          "for better future" the invenio-records-files code says
-    record_bucket = \
-        RecordsBuckets.query.filter_by(bucket_id=bucket_id).one_or_none()
-    if record_bucket:
-        record_metadata = record_bucket.record
-        record = Record(record_metadata.json, model=record_metadata)
-    else:
+    fields = _policies_record_fields(action)
+    record = _load_bucket_record(bucket_id, fields=fields)
+    if record is None:
         raise RuntimeError('No record')
 
-    PermissionPolicy = get_record_permission_policy()
-
+    PermissionPolicy = get_record_permission_policy(record)
     return PermissionPolicy(action=action, record=record)
+
+
+async def arecord_files_permission_factory_many(objs, action):
+    """Asynchronous files permission factory for many objects.
+
+    The records of all the buckets are loaded in a single query, while the
+    ActionNeeds of the record independent generators are expanded
+    concurrently. Evaluate the permissions with ``await
+    permission.aallows(identity)`` or
+    :func:`~invenio_records_permissions.aio.aallows_many`.
+
+    :param objs: Buckets or object versions.
+    :param action: The required action.
+    :raises RuntimeError: If an object is unknown or has no record.
+    :returns: The list of policy instances, in the order of ``objs``.
+    """
+    bucket_ids = [_bucket_id(obj) for obj in objs]
+    action_needs = {superuser_access}
+    for policy in get_policies():
+        for generator in policy(action=action).generators:
+            if generator.record_fields != ():
+                continue
+            action_needs.update(
+                need for need in generator.needs() if need.method == 'action'
+            )
+
+    records, expansions = await agather_records_and_expansions(
+        set(bucket_ids), action_needs
+    )
+
+    permissions = []
+    for bucket_id in bucket_ids:
+        record = records.get(bucket_id)
+        if record is None:
+            raise RuntimeError('No record')
+        PermissionPolicy = get_record_permission_policy(record)
+        permission = PermissionPolicy(action=action, record=record)
+        permission.action_expansions = expansions
+        permissions.append(permission)
+    return permissions
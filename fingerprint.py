@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Fingerprint of what the permission decisions depend on for an identity.
+
+Two identities with the same fingerprint get the same decisions from the
+policy, on any record, so the fingerprint can be used in shared cache keys
+(e.g. ``Vary``-style). It is made of:
+
+- the system roles (e.g. anonymous vs authenticated);
+- the user id, only if a generator reads it;
+- the roles, all of them if a generator reads them, otherwise only those
+  referenced by the record independent generators (ActionNeeds expanded);
+- the IP classes, only if a generator reads them.
+
+By default, the generators of all the policies in use (the default one and
+the ones registered per record discriminator) are taken into account.
+"""
+
+import hashlib
+from time import monotonic
+
+from flask import current_app, g
+from invenio_access import Permission
+from invenio_access.permissions import superuser_access
+
+from .network import current_ip_classes
+from .policies import get_policies
+
+ALL_FACTS = frozenset(['user', 'roles', 'network'])
+
+
+def policy_actions(policy):
+    """Names of the actions defined by a policy class."""
+    return sorted(
+        name[len('can_'):] for name in dir(policy) if name.startswith('can_')
+    )
+
+
+def policy_dependencies(policy, actions=None):
+    """What the decisions of ``policy`` depend on.
+
+    :returns: A tuple of the identity facts read by the generators and of
+        the Needs granted or denied by the record independent generators,
+        ActionNeeds expanded into users and roles.
+    """
+    facts = set()
+    static_needs = {superuser_access}
+    static_excludes = set()
+    for action in actions or policy_actions(policy):
+        for generator in policy(action=action).generators:
+            if generator.identity_facts is None:
+                facts |= ALL_FACTS
+            else:
+                facts.update(generator.identity_facts)
+            if generator.record_fields == ():
+                static_needs.update(generator.needs())
+                static_excludes.update(generator.excludes())
+    permission = Permission(*static_needs)
+    permission.explicit_excludes |= static_excludes
+    permission._load_permissions()
+    expanded = permission._permissions.needs | permission._permissions.excludes
+    return frozenset(facts), frozenset(expanded)
+
+
+def get_policy_dependencies(policy, actions=None):
+    """Cached :func:`policy_dependencies`.
+
+    Entries expire after ``RECORDS_PERMISSIONS_FINGERPRINT_TTL`` seconds, so
+    that changes of the action assignments are taken into account.
+    """
+    ext = current_app.extensions['invenio-records-permissions']
+    key = (policy, tuple(actions) if actions else None)
+    cached = ext.policy_dependencies.get(key)
+    if cached is None or cached[0] < monotonic():
+        ttl = current_app.config['RECORDS_PERMISSIONS_FINGERPRINT_TTL']
+        cached = ext.policy_dependencies[key] = (
+            monotonic() + ttl, policy_dependencies(policy, actions=actions)
+        )
+    return cached[1]
+
+
+def permission_fingerprint(identity=None, policy=None, actions=None):
+    """Short, stable fingerprint of ``identity`` for the ``policy``.
+
+    :param identity: Defaults to the current identity.
+    :param policy: Policy class, defaults to all the policies in use.
+    :param actions: Actions to consider, defaults to all of the policy.
+    """
+    identity = identity or g.identity
+    policies = [policy] if policy else get_policies()
+    facts, static_needs = set(), set()
+    for p in policies:
+        policy_facts, policy_needs = get_policy_dependencies(
+            p, actions=actions
+        )
+        facts |= policy_facts
+        static_needs |= policy_needs
+
+    parts = []
+    for need in identity.provides:
+        if need.method == 'system_role' or need in static_needs or (
+            need.method == 'id' and 'user' in facts
+        ) or (
+            need.method == 'role' and 'roles' in facts
+        ):
+            parts.append('{0}:{1}'.format(need.method, need.value))
+    if 'network' in facts:
+        parts.extend('ip:{0}'.format(c) for c in current_ip_classes())
+
+    data = '\n'.join(
+        [p.__module__ + '.' + p.__name__ for p in policies] + sorted(parts)
+    )
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
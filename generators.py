@@ -11,19 +11,25 @@
 
 import json
 import operator
+from datetime import MAXYEAR, datetime, timezone
 from functools import reduce
 from itertools import chain
 
 from elasticsearch_dsl.query import Q
 from flask import g
-from flask_principal import ActionNeed, UserNeed, RoleNeed
+from flask_principal import ActionNeed, UserNeed
 from invenio_access.permissions import any_user, superuser_access
 from invenio_files_rest.models import Bucket, ObjectVersion
 from invenio_records_files.api import Record
 from invenio_records_files.models import RecordsBuckets
 
-from flask_login import current_user
-from invenio_records_permissions.setup import ip_ranges, single_ips
+from invenio_records_permissions.needs import NeedSet
+from invenio_records_permissions.network import IP_RANGE, IP_SINGLE, \
+    current_ip_classes
+from invenio_records_permissions.restrictions import GROUPS, OWNERS, \
+    get_descriptor, restriction_bit
+from invenio_records_permissions.utils import get_path, parse_datetime, \
+    utcnow
 
 
 class Generator(object):
@@ -33,8 +39,50 @@ class Generator(object):
     level it implements the *query filters* to restrict the search.
 
     Any context inherits from this class.
+
+    ``record_fields`` lists the record fields (dotted paths) read by
+    ``needs`` and ``excludes``. ``None`` means unknown, i.e. the whole record
+    is needed.
+
+    ``identity_facts`` lists what the generator reads from the identity
+    beyond the Needs it returns independently of any record: ``"user"``
+    (the user id), ``"roles"`` (all the roles) and ``"network"`` (the IP
+    classes). ``None`` means unknown, i.e. all of them.
+
+    ``always_grants`` and ``always_denies`` tell if the generator allows
+    (resp. denies) every identity on every record. Together with
+    ``may_exclude`` and ``subsumes`` they are used to simplify the lists of
+    generators of the policies (see
+    :mod:`~invenio_records_permissions.analysis`).
+
+    ``filter_implies_needs`` tells if every record matched by
+    ``query_filter`` is granted by ``needs`` for the same identity
+    (generators without filter trivially do). The search hits of policies
+    made of such generators are pre-authorized (see
+    :mod:`~invenio_records_permissions.preauthorized`).
     """
 
+    record_fields = None
+    identity_facts = None
+    always_grants = False
+    always_denies = False
+    filter_implies_needs = False
+
+    @property
+    def may_exclude(self):
+        """Whether ``excludes`` may return Needs."""
+        return type(self).excludes is not Generator.excludes
+
+    def subsumes(self, other):
+        """Whether every identity ``other`` allows is allowed by this one.
+
+        Only tells about ``needs``: by default generators subsume their
+        duplicates (same class and attributes).
+        """
+        if self.always_grants:
+            return True
+        return type(other) is type(self) and vars(other) == vars(self)
+
     def needs(self, **kwargs):
         """Enabling Needs."""
         return []
@@ -47,103 +95,102 @@ class Generator(object):
         """Elasticsearch filters."""
         return []
 
+    def next_change(self, **kwargs):
+        """Datetime at which the Needs of the generator change, if known.
 
-class RecordIp(Generator):
-    """
-    If the user_ip is not among the allowed IPs (see setup.py), 
-    all records containing 'ip_single' in 'applied_restrictions' will not be listed
-    """
+        ``None`` if they do not depend on time. Caches of decisions use it
+        as the expiry of their entries.
+        """
+        return None
 
-    def needs(self, record=None, **rest_over):
-        """ Allow access to records API with 'ip_single' in applied_restrictions """
+    def snippet(self):
+        """Python expression telling if the generator grants access.
 
-        # Restriction not applied to records without ip_single in applied_restrictions array
-        if "ip_single" not in record.get("applied_restrictions", []):
-            return [any_user]
-
-        # Checks if the user IP is allowed
-        visible = self.check_permission()
-
-        # View record if ip_single is among applied_restrictions and there is an IP match
-        if visible:
-            return [any_user]
-        return []
+        Used by :mod:`~invenio_records_permissions.compiler` to generate
+        specialized evaluators. The expression can use ``facts`` (an
+        :class:`~invenio_records_permissions.compiler.IdentityFacts`),
+        ``record`` and ``restrictions`` (its restriction descriptor).
+        ``None`` if the generator has no snippet.
+        """
+        return None
 
-    def query_filter(self, *args, **kwargs):
-
-        # Checks if the user IP is allowed
-        visible = self.check_permission()
+    def exclude_snippet(self):
+        """Python expression telling if the generator denies access.
 
-        # If the user's IP is not among the allowed IPs
-        if not visible:
-            # If the record contains 'ip_single' in 'applied_restrictions' will not be seen
-            return ~Q("match", **{"applied_restrictions": "ip_single"})
+        See ``snippet``. Generators not overriding ``excludes`` never deny.
+        """
+        return None if self.may_exclude else "False"
 
-        # Lists all records
-        return Q("match_all")
-
-    def check_permission(self):
-        # The user needs to be logged in
-        if "current_login_ip" not in vars(current_user):
-            return False
 
-        # Get user's ip address
-        user_ip = str(current_user.current_login_ip)
-
-        # Checks if the user IP is among single IPs
-        if user_ip in single_ips:
-            return True
-        return False
-
-
-class RecordIpRange(Generator):
+class RecordNetwork(Generator):
     """
-    If the user_ip is not in an IP range (see setup.py), 
-    all records containing 'ip_range' in 'applied_restrictions' will not be listed
+    If the user_ip is not in the network class ``ip_class`` (see network.py),
+    all records containing ``ip_class`` in 'applied_restrictions' will not be
+    listed
     """
 
+    record_fields = ("applied_restrictions",)
+    identity_facts = ("network",)
+    filter_implies_needs = True
+
+    def __init__(self, ip_class):
+        """Constructor."""
+        super(RecordNetwork, self).__init__()
+        self.ip_class = ip_class
+
     def needs(self, record=None, **rest_over):
-        # Restriction not applied to records without ip_single in applied_restrictions array
-        if "ip_range" not in record.get("applied_restrictions", []):
-            return [any_user]
+        """Allow access to records with ip_class in applied_restrictions."""
 
-        # Checks if the user IP is allowed
-        visible = self.check_permission()
+        # Restriction not applied to records without ip_class in applied_restrictions array
+        restrictions = get_descriptor(record)
+        if not restrictions.mask & restriction_bit(self.ip_class):
+            return [any_user]
 
-        # View record if ip_single is among applied_restrictions and there is an IP match
-        if visible:
+        # View record if ip_class is among applied_restrictions and there is an IP match
+        if self.check_permission():
             return [any_user]
         return []
 
     def query_filter(self, *args, **kwargs):
+        """Hide records restricted to ``ip_class`` if the user is not in it."""
+        if self.check_permission():
+            # Lists all records
+            return Q("match_all")
 
-        # Checks if the user IP is allowed
-        visible = self.check_permission()
+        return ~Q("term", **{"applied_restrictions": self.ip_class})
 
-        if not visible:
-            # Records contains 'ip_range' in 'applied_restrictions' will not be listed in the search page
-            return ~Q("match", **{"applied_restrictions": "ip_range"})
+    def check_permission(self):
+        """Checks if the user IP is in the network class."""
+        return self.ip_class in current_ip_classes()
 
-        # Lists all records
-        return Q("match_all")
+    def snippet(self):
+        """Python expression telling if the generator grants access."""
+        return (
+            "facts.any_user and (not restrictions.mask & {0} "
+            "or {1!r} in facts.ip_classes)"
+        ).format(restriction_bit(self.ip_class), self.ip_class)
 
-    def check_permission(self):
 
-        # The user needs to be logged in
-        if "current_login_ip" not in vars(current_user):
-            return False
+class RecordIp(RecordNetwork):
+    """
+    If the user_ip is not among the allowed IPs (see setup.py), 
+    all records containing 'ip_single' in 'applied_restrictions' will not be listed
+    """
+
+    def __init__(self):
+        """Constructor."""
+        super(RecordIp, self).__init__(IP_SINGLE)
 
-        # Get user's ip address
-        user_ip = str(current_user.current_login_ip)
 
-        # Checks if the user IP is in an ip_range
-        for ip_range in ip_ranges:
-            ip_start = ip_range[0]
-            ip_end = ip_range[1]
-            if user_ip >= ip_start and user_ip <= ip_end:
-                return True
+class RecordIpRange(RecordNetwork):
+    """
+    If the user_ip is not in an IP range (see setup.py), 
+    all records containing 'ip_range' in 'applied_restrictions' will not be listed
+    """
 
-        return False
+    def __init__(self):
+        """Constructor."""
+        super(RecordIpRange, self).__init__(IP_RANGE)
 
 
 class RecordOwners(Generator):
@@ -154,11 +201,22 @@ class RecordOwners(Generator):
         - when the user_id is in owners
     """
 
+    record_fields = ("applied_restrictions", "owners")
+    identity_facts = ("user",)
+
     def needs(self, record=None, **kwargs):
         # Allow access to records with 'owners' in applied_restrictions
-        if "owners" not in record.get("applied_restrictions", []):
+        restrictions = get_descriptor(record)
+        if not restrictions.mask & restriction_bit(OWNERS):
             return [any_user]
-        return [UserNeed(owner) for owner in record.get("owners", [])]
+        return NeedSet("id", restrictions.owners)
+
+    def snippet(self):
+        """Python expression telling if the generator grants access."""
+        return (
+            "(facts.any_user if not restrictions.mask & {0} "
+            "else not facts.user_ids.isdisjoint(restrictions.owners))"
+        ).format(restriction_bit(OWNERS))
 
     def query_filter(self, **kwargs):
         """Filters for current identity as owner."""
@@ -166,18 +224,25 @@ class RecordOwners(Generator):
         # Contains logged-in user information
         provides = g.identity.provides
 
+        # Like needs(), records not restricted to their owners are allowed
+        unrestricted = ~Q("match", applied_restrictions="owners")
+
         # Specify which restriction will be applied (owners)
         matches = {"applied_restrictions": "owners"}
 
         # Gets the user id
         for need in provides:
             if need.method == "id":
-                matches["_owners"] = need.value
+                matches["owners"] = need.value
                 break
 
+        # Identities without user id own no record
+        if "owners" not in matches:
+            return unrestricted
+
         # Queries Elasticsearch -> both user_id and applied_restrictions need to match
         queries = [Q("match", **{match: f"{matches[match]}"}) for match in matches]
-        return reduce(operator.and_, queries)
+        return unrestricted | reduce(operator.and_, queries)
 
 
 class RecordGroups(Generator):
@@ -188,11 +253,22 @@ class RecordGroups(Generator):
         - when the user belongs to at least one group_restrictions
     """
 
+    record_fields = ("applied_restrictions", "group_restrictions")
+    identity_facts = ("roles",)
+
     def needs(self, record=None, **rest_over):
         # Allow access to records with 'groups' in applied_restrictions
-        if "groups" not in record.get("applied_restrictions", []):
+        restrictions = get_descriptor(record)
+        if not restrictions.mask & restriction_bit(GROUPS):
             return [any_user]
-        return [RoleNeed(group) for group in record.get("group_restrictions", [])]
+        return NeedSet("role", restrictions.groups)
+
+    def snippet(self):
+        """Python expression telling if the generator grants access."""
+        return (
+            "(facts.any_user if not restrictions.mask & {0} "
+            "else not facts.roles.isdisjoint(restrictions.groups))"
+        ).format(restriction_bit(GROUPS))
 
     def query_filter(self, *args, **kwargs):
 
@@ -224,6 +300,11 @@ class RecordGroups(Generator):
 class AnyUser(Generator):
     """Allows any user."""
 
+    record_fields = ()
+    identity_facts = ()
+    always_grants = True
+    filter_implies_needs = True
+
     def __init__(self):
         """Constructor."""
         super(AnyUser, self).__init__()
@@ -232,6 +313,10 @@ class AnyUser(Generator):
         """Enabling Needs."""
         return [any_user]
 
+    def snippet(self):
+        """Python expression telling if the generator grants access."""
+        return "facts.any_user"
+
     def query_filter(self, **kwargs):
         """Match all in search."""
         # TODO: Implement with new permissions metadata
@@ -241,6 +326,10 @@ class AnyUser(Generator):
 class SuperUser(Generator):
     """Allows super users."""
 
+    record_fields = ()
+    identity_facts = ()
+    filter_implies_needs = True
+
     def __init__(self):
         """Constructor."""
         super(SuperUser, self).__init__()
@@ -249,6 +338,10 @@ class SuperUser(Generator):
         """Enabling Needs."""
         return [superuser_access]
 
+    def snippet(self):
+        """Python expression telling if the generator grants access."""
+        return "facts.superuser"
+
     def query_filter(self, record=None, **kwargs):
         """Filters for current identity as super user."""
         # TODO: Implement with new permissions metadata
@@ -258,6 +351,11 @@ class SuperUser(Generator):
 class Disable(Generator):
     """Denies ALL users including super users."""
 
+    record_fields = ()
+    identity_facts = ()
+    always_denies = True
+    filter_implies_needs = True
+
     def __init__(self):
         """Constructor."""
         super(Disable, self).__init__()
@@ -266,6 +364,14 @@ class Disable(Generator):
         """Preventing Needs."""
         return [any_user]
 
+    def snippet(self):
+        """Python expression telling if the generator grants access."""
+        return "False"
+
+    def exclude_snippet(self):
+        """Python expression telling if the generator denies access."""
+        return "facts.any_user"
+
     def query_filter(self, **kwargs):
         """Match None in search."""
         return ~Q("match_all")
@@ -274,6 +380,10 @@ class Disable(Generator):
 class Admin(Generator):
     """Allows users with admin-access (different from superuser-access)."""
 
+    record_fields = ()
+    identity_facts = ()
+    filter_implies_needs = True
+
     def __init__(self):
         """Constructor."""
         super(Admin, self).__init__()
@@ -282,6 +392,10 @@ class Admin(Generator):
         """Enabling Needs."""
         return [ActionNeed("admin-access")]
 
+    def snippet(self):
+        """Python expression telling if the generator grants access."""
+        return "facts.has_action('admin-access')"
+
 
 # class RecordOwners(Generator):
 #     """Allows record owners."""
@@ -306,6 +420,10 @@ class AnyUserIfPublic(Generator):
     TODO: Revisit when dealing with files.
     """
 
+    record_fields = ("_access.metadata_restricted",)
+    identity_facts = ()
+    filter_implies_needs = True
+
     def needs(self, record=None, **rest_over):
         """Enabling Needs."""
         is_restricted = record and record.get("_access", {}).get(
@@ -313,9 +431,12 @@ class AnyUserIfPublic(Generator):
         )
         return [any_user] if not is_restricted else []
 
-    def excludes(self, record=None, **rest_over):
-        """Preventing Needs."""
-        return []
+    def snippet(self):
+        """Python expression telling if the generator grants access."""
+        return (
+            'facts.any_user and not (record and record.get("_access", {})'
+            '.get("metadata_restricted", False))'
+        )
 
     def query_filter(self, *args, **kwargs):
         """Filters for non-restricted records."""
@@ -323,6 +444,51 @@ class AnyUserIfPublic(Generator):
         return Q("term", **{"_access.metadata_restricted": False})
 
 
+class AnyUserAfterEmbargo(Generator):
+    """Allows any user if the record is public or once its embargo lifted.
+
+    The search filter compares the embargo date with ``now`` in the search
+    engine, so it stays valid when the embargo lifts without a reindex.
+    """
+
+    identity_facts = ()
+    filter_implies_needs = True
+
+    def __init__(self, restricted_field="_access.metadata_restricted",
+                 embargo_field="_access.embargo_date"):
+        """Constructor."""
+        super(AnyUserAfterEmbargo, self).__init__()
+        self.restricted_field = restricted_field
+        self.embargo_field = embargo_field
+        self.record_fields = (restricted_field, embargo_field)
+
+    def _embargo(self, record):
+        """Embargo date of a restricted record, ``None`` if public."""
+        if not record or not get_path(record, self.restricted_field, False):
+            return None
+        embargo = parse_datetime(get_path(record, self.embargo_field))
+        # Restricted without (valid) embargo date: restricted forever
+        return embargo or datetime.max.replace(tzinfo=timezone.utc)
+
+    def needs(self, record=None, **rest_over):
+        """Enabling Needs."""
+        embargo = self._embargo(record)
+        return [any_user] if embargo is None or embargo <= utcnow() else []
+
+    def next_change(self, record=None, **rest_over):
+        """End of the embargo if it has not lifted yet."""
+        embargo = self._embargo(record)
+        if embargo is None or embargo <= utcnow() or embargo.year == MAXYEAR:
+            return None
+        return embargo
+
+    def query_filter(self, *args, **kwargs):
+        """Filters for public records and records whose embargo lifted."""
+        return Q("term", **{self.restricted_field: False}) | Q(
+            "range", **{self.embargo_field: {"lte": "now"}}
+        )
+
+
 class AllowedByAccessLevel(Generator):
     """Allows users/roles/groups that have an appropriate access level."""
 
@@ -338,6 +504,9 @@ class AllowedByAccessLevel(Generator):
         "delete": [],
     }
 
+    record_fields = ("internal.access_levels",)
+    identity_facts = ("user",)
+
     def __init__(self, action="read"):
         """Constructor."""
         self.action = action
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Cached loading of the roles and actions of identities.
+
+Flask-Security loads the roles of the current user on every request
+(``current_user.roles``) to add their ``RoleNeed``. With the cache enabled,
+this loader replaces it: the role names and the actions granted to each
+user are kept in a compact entry, keyed by user id, and added to
+``g.identity.provides`` from there.
+
+Entries are versioned: each user has a version token, and so have the
+grants of actions to roles. A change of the roles of a user
+(``User.roles``) or of their actions (``ActionUsers``) renews the user's
+token, a change of the actions of roles (``ActionRoles``,
+``ActionSystemRoles``) or of the roles themselves renews the global one,
+once committed. Entries stored under other tokens are reloaded.
+
+The entries are shared by the workers through invenio-cache if it is
+installed, otherwise they are kept per process, where changes made by other
+processes are only seen once the entries expire.
+"""
+
+import os
+import threading
+import time
+
+from flask_login import current_user
+from flask_principal import ActionNeed, RoleNeed, UserNeed, identity_loaded
+from invenio_access.permissions import ParameterizedActionNeed
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+KEY_PREFIX = 'permissions:identity:'
+"""Prefix of the cache keys."""
+
+
+def _token():
+    """New version token."""
+    return os.urandom(8).hex()
+
+
+class MemoryBackend(object):
+    """In-process cache with expiring keys."""
+
+    def __init__(self):
+        """Constructor."""
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, *keys):
+        """Values of ``keys``, ``None`` for the missing or expired ones."""
+        now = time.time()
+        values = []
+        with self._lock:
+            for key in keys:
+                value, expires = self._data.get(key, (None, None))
+                if expires and expires <= now:
+                    del self._data[key]
+                    value = None
+                values.append(value)
+        return values
+
+    def set(self, key, value, timeout=None):
+        """Store ``value``, for ``timeout`` seconds if given and not 0."""
+        with self._lock:
+            self._data[key] = (
+                value, time.time() + timeout if timeout else None
+            )
+
+
+class IdentityCache(object):
+    """Load the roles and actions of identities from a versioned cache."""
+
+    def __init__(self, app, ttl=3600):
+        """Constructor.
+
+        :param ttl: Lifetime of the entries (seconds), bounding how stale
+            the changes not seen by the invalidation can be.
+        """
+        self.app = app
+        self.ttl = ttl
+        self._backend = None
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(['hits', 'misses'], 0)
+
+    @property
+    def backend(self):
+        """invenio-cache if it is initialized, an in-process cache else."""
+        if self._backend is None:
+            ext = self.app.extensions.get('invenio-cache')
+            self._backend = ext.cache if ext is not None else MemoryBackend()
+        return self._backend
+
+    def connect(self):
+        """Replace the role loader of Flask-Security and track changes."""
+        try:
+            from flask_security.core import _on_identity_loaded
+            identity_loaded.disconnect(_on_identity_loaded, sender=self.app)
+        except ImportError:
+            pass
+        identity_loaded.connect_via(self.app, weak=False)(self.on_loaded)
+        self._listen()
+
+    def on_loaded(self, sender, identity):
+        """Add the Needs of the current user to ``identity``."""
+        identity.user = current_user
+        user_id = getattr(current_user, 'id', None)
+        if user_id is None:
+            return
+        identity.provides.add(UserNeed(user_id))
+        roles, actions = self.get(user_id)
+        identity.provides.update(RoleNeed(name) for name in roles)
+        identity.provides.update(
+            ActionNeed(action) if argument is None
+            else ParameterizedActionNeed(action, argument)
+            for action, argument in actions
+        )
+
+    def get(self, user_id):
+        """Role names and ``(action, argument)`` grants of a user."""
+        global_key, user_key, entry_key = self._keys(user_id)
+        global_version, user_version, entry = self.backend.get_many(
+            global_key, user_key, entry_key
+        )
+        if entry is not None and \
+                entry[:2] == (global_version, user_version):
+            self._count('hits')
+            return entry[2], entry[3]
+
+        self._count('misses')
+        # Versions read before the database, a concurrent change is not lost
+        roles, actions = self.load(user_id)
+        self.backend.set(
+            entry_key, (global_version, user_version, roles, actions),
+            timeout=self.ttl,
+        )
+        return roles, actions
+
+    def load(self, user_id):
+        """Role names and granted actions of a user, from the database."""
+        from invenio_access.models import ActionRoles, ActionUsers
+        from invenio_accounts.models import Role, userrole
+        from invenio_db import db
+
+        roles = db.session.query(Role.id, Role.name).join(
+            userrole, userrole.c.role_id == Role.id
+        ).filter(userrole.c.user_id == user_id).all()
+        role_ids = [role_id for role_id, _ in roles]
+
+        rows = ActionUsers.query.filter_by(user_id=user_id).all()
+        if role_ids:
+            rows += ActionRoles.query.filter(
+                ActionRoles.role_id.in_(role_ids)
+            ).all()
+        granted = {(r.action, r.argument) for r in rows if not r.exclude}
+        excluded = {(r.action, r.argument) for r in rows if r.exclude}
+        # An exclusion without argument applies to all the arguments
+        excluded_actions = {a for a, argument in excluded if argument is None}
+        actions = tuple(sorted(
+            (grant for grant in granted
+             if grant not in excluded and grant[0] not in excluded_actions),
+            key=lambda grant: (grant[0], grant[1] or ''),
+        ))
+        return tuple(sorted(name for _, name in roles)), actions
+
+    def invalidate(self, user_id=None):
+        """Renew the version of a user, or the global one if ``None``."""
+        key = self._keys(user_id)[1 if user_id is not None else 0]
+        # Versions never expire, entries do
+        self.backend.set(key, _token(), timeout=0)
+
+    def stats(self):
+        """Hits, misses and hit rate of the cache."""
+        with self._lock:
+            stats = dict(self._counters)
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / total if total else None
+        return stats
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    @staticmethod
+    def _keys(user_id):
+        """Keys of the global version, user version and entry."""
+        return (
+            KEY_PREFIX + 'version',
+            '{0}version:{1}'.format(KEY_PREFIX, user_id),
+            '{0}{1}'.format(KEY_PREFIX, user_id),
+        )
+
+    def _listen(self):
+        """Register the changes to invalidate on commit."""
+        from invenio_access.models import ActionRoles, ActionSystemRoles, \
+            ActionUsers
+        from invenio_accounts.models import Role, User
+
+        def changed_user(target, *args):
+            self._pending(object_session(target), target.id)
+
+        def changed_grant(mapper, connection, target):
+            self._pending(object_session(target), target.user_id)
+
+        def changed_roles(mapper, connection, target):
+            self._pending(object_session(target), None)
+
+        event.listen(User.roles, 'append', changed_user)
+        event.listen(User.roles, 'remove', changed_user)
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(ActionUsers, name, changed_grant)
+            event.listen(ActionRoles, name, changed_roles)
+            event.listen(ActionSystemRoles, name, changed_roles)
+        # A new role has no members yet
+        for name in ('after_update', 'after_delete'):
+            event.listen(Role, name, changed_roles)
+        event.listen(Session, 'after_commit', self._commit)
+        event.listen(Session, 'after_rollback', self._rollback)
+
+    def _pending(self, session, user_id):
+        # Objects not in a session yet have no cached entry
+        if session is not None:
+            session.info.setdefault(self._info_key, set()).add(user_id)
+
+    @property
+    def _info_key(self):
+        return 'permissions_identity_cache_{0}'.format(id(self))
+
+    def _commit(self, session):
+        for user_id in session.info.pop(self._info_key, ()):
+            self.invalidate(user_id)
+
+    def _rollback(self, session):
+        session.info.pop(self._info_key, None)
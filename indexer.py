@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Incremental re-indexing of permission metadata.
+
+Records carry the metadata read by the generators (owners, groups,
+restrictions, access flags...) in the search index as well. Whenever that
+metadata changes, the index must follow. Instead of reindexing the whole
+record, only the permission fields are sent as bulk partial updates.
+
+Updates are queued when records are updated and only sent once the
+database transaction is committed. They are dropped if it is rolled back.
+"""
+
+from collections import OrderedDict
+from copy import deepcopy
+
+from elasticsearch.helpers import bulk
+from flask import current_app, g, has_app_context
+from invenio_search import current_search_client
+from sqlalchemy.orm import object_session
+
+from .utils import get_path, set_path
+
+REPLACE_FIELDS_SCRIPT = """
+for (field in params.fields) {
+  def node = ctx._source;
+  for (int i = 0; i < field.path.size() - 1; i++) {
+    if (!(node[field.path[i]] instanceof Map)) {
+      node[field.path[i]] = new HashMap();
+    }
+    node = node[field.path[i]];
+  }
+  node[field.path[field.path.size() - 1]] = field.value;
+}
+"""
+"""Painless script replacing the permission fields of a document.
+
+A partial ``doc`` update merges objects, which would keep in the index the
+keys removed from an object field such as ``_access``.
+"""
+
+_SESSION_KEY = 'permissions_reindex_pending'
+
+
+def extract_permission_fields(data, fields):
+    """Extract the permission relevant ``fields`` of a record as a dict.
+
+    Missing fields are explicitly set to ``None`` so that the update also
+    clears them in the index.
+    """
+    doc = {}
+    for path in fields:
+        set_path(doc, path, get_path(data, path))
+    return doc
+
+
+def _normalize(value):
+    """Normalize ``value`` so that ordering does not count as a change."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _normalize(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(sorted((_normalize(v) for v in value), key=repr))
+    return value
+
+
+def access_changed(old, new, fields):
+    """Tell if the effective access of a record changed between versions."""
+    return any(
+        _normalize(get_path(old, path)) != _normalize(get_path(new, path))
+        for path in fields
+    )
+
+
+class PermissionIndexQueue(object):
+    """Batched and deduplicated queue of permission partial updates.
+
+    Records are keyed by id: queueing the same record several times only
+    keeps its latest permission fields. Added updates are pending until
+    :meth:`commit`, and the committed ones are flushed in bulk once
+    ``batch_size`` records are waiting.
+    """
+
+    def __init__(self, index, fields, batch_size=500, client=None):
+        """Constructor.
+
+        :param fields: Dotted paths of the permission fields, replaced as a
+            whole by the updates.
+        """
+        self.index = index
+        self.fields = fields
+        self.batch_size = batch_size
+        self._client = client
+        self._pending = OrderedDict()
+        self._committed = OrderedDict()
+
+    @property
+    def client(self):
+        """Search client used to send the bulk requests."""
+        if self._client is None:
+            return current_search_client
+        return self._client
+
+    def __len__(self):
+        """Number of committed records waiting to be flushed."""
+        return len(self._committed)
+
+    def add(self, record_id, doc):
+        """Queue the partial ``doc`` update of ``record_id``."""
+        record_id = str(record_id)
+        self._pending.pop(record_id, None)
+        self._pending[record_id] = doc
+
+    def commit(self):
+        """Mark the pending updates as committed, flushing full batches."""
+        for record_id, doc in self._pending.items():
+            self._committed.pop(record_id, None)
+            self._committed[record_id] = doc
+        self._pending = OrderedDict()
+        if len(self._committed) >= self.batch_size:
+            self.flush()
+
+    def rollback(self):
+        """Drop the pending updates.
+
+        :returns: The number of dropped updates.
+        """
+        dropped, self._pending = len(self._pending), OrderedDict()
+        return dropped
+
+    def actions(self, committed):
+        """Bulk actions for the ``committed`` partial updates."""
+        for record_id, doc in committed.items():
+            yield {
+                '_op_type': 'update',
+                '_index': self.index,
+                '_id': record_id,
+                'script': {
+                    'source': REPLACE_FIELDS_SCRIPT,
+                    'lang': 'painless',
+                    'params': {'fields': [
+                        {'path': path.split('.'), 'value': get_path(doc, path)}
+                        for path in self.fields
+                    ]},
+                },
+            }
+
+    def flush(self):
+        """Send all committed partial updates in bulk.
+
+        :returns: The number of successfully updated records.
+        """
+        committed, self._committed = self._committed, OrderedDict()
+        if not committed:
+            return 0
+
+        success, errors = bulk(
+            self.client, self.actions(committed), raise_on_error=False,
+            raise_on_exception=False,
+        )
+        for error in errors:
+            current_app.logger.warning(
+                'Permission partial update failed: %s', error)
+        return success
+
+
+def current_reindex_queue():
+    """Queue of the current application context, created on first use."""
+    if '_permissions_reindex_queue' not in g:
+        config = current_app.config
+        g._permissions_reindex_queue = PermissionIndexQueue(
+            config['RECORDS_PERMISSIONS_REINDEX_INDEX'],
+            config['RECORDS_PERMISSIONS_REINDEX_FIELDS'],
+            batch_size=config['RECORDS_PERMISSIONS_REINDEX_BATCH_SIZE'],
+        )
+    return g._permissions_reindex_queue
+
+
+def _snapshot(data, fields):
+    """Copy of the permission ``fields`` of ``data``, nested values too."""
+    return deepcopy(extract_permission_fields(data, fields))
+
+
+def snapshot_permission_fields(target, *args):
+    """Keep a copy of the stored permission fields of a record model.
+
+    Connected to the ``load`` and ``refresh`` events of ``RecordMetadata``.
+    Records only copy ``model.json`` shallowly, so that in-place edits of
+    nested values (e.g. ``record['owners'].append(...)``) change the model
+    too and can not be detected from it.
+    """
+    if not has_app_context() or \
+            not current_app.config['RECORDS_PERMISSIONS_REINDEX_ENABLED']:
+        return
+    fields = current_app.config['RECORDS_PERMISSIONS_REINDEX_FIELDS']
+    target._permissions_fields = _snapshot(target.json or {}, fields)
+
+
+def queue_permission_update(sender, record=None, **kwargs):
+    """Queue a partial update if a record's access is about to change.
+
+    Connected to ``before_record_update``: at that point, ``record`` holds the
+    new values, which are compared with the permission fields stored when
+    the model was loaded. Models without them (e.g. created in the same
+    session) are always queued.
+    """
+    if not current_app.config['RECORDS_PERMISSIONS_REINDEX_ENABLED']:
+        return
+    model = getattr(record, 'model', None)
+    if model is None:
+        return
+
+    fields = current_app.config['RECORDS_PERMISSIONS_REINDEX_FIELDS']
+    stored = getattr(model, '_permissions_fields', None)
+    model._permissions_fields = _snapshot(record, fields)
+    if stored is None or access_changed(stored, record, fields):
+        current_reindex_queue().add(
+            model.id, extract_permission_fields(record, fields)
+        )
+        session = object_session(model)
+        if session is not None:
+            session.info[_SESSION_KEY] = True
+
+
+def commit_permission_updates(session):
+    """Release the updates queued in ``session`` once it is committed.
+
+    Connected to the ``after_commit`` event of the SQLAlchemy sessions.
+    """
+    if session.info.pop(_SESSION_KEY, False) and has_app_context() and \
+            '_permissions_reindex_queue' in g:
+        g._permissions_reindex_queue.commit()
+
+
+def rollback_permission_updates(session):
+    """Drop the updates queued in ``session`` when it is rolled back.
+
+    Connected to the ``after_rollback`` event of the SQLAlchemy sessions.
+    """
+    if session.info.pop(_SESSION_KEY, False) and has_app_context() and \
+            '_permissions_reindex_queue' in g:
+        dropped = g._permissions_reindex_queue.rollback()
+        current_app.logger.debug(
+            'Dropped %d permission partial updates rolled back.', dropped)
+
+
+def flush_permission_updates(exception=None):
+    """Flush committed partial updates at the end of the application context.
+
+    Updates which were never committed are dropped, and logged if the
+    context failed.
+    """
+    queue = g.pop('_permissions_reindex_queue', None)
+    if queue is None:
+        return
+    dropped = queue.rollback()
+    if dropped and exception is not None:
+        current_app.logger.warning(
+            'Dropped %d uncommitted permission partial updates after '
+            'error: %s', dropped, exception)
+    queue.flush()
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""End-to-end load test of the permission checks.
+
+A self-contained application is created on a SQLite database seeded with
+records and their buckets. Worker threads then run permission checks for
+random identities (users, roles and IP classes) through the regular request
+path: the record factories, ``record_files_permission_factory`` and
+``RecordsSearch`` with ``rdm_records_filter``, against an in-process fake
+search client which evaluates the queries with
+:mod:`~invenio_records_permissions.evaluator`.
+
+The result is a JSON serializable dictionary with the throughput, the
+latency percentiles and the number of database queries, overall and per
+kind of check.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from timeit import default_timer
+
+from flask import Flask, current_app, g
+from flask_principal import AnonymousIdentity, Identity, RoleNeed, UserNeed
+from invenio_access.permissions import any_user, authenticated_user
+from sqlalchemy import event
+
+from .evaluator import compile_clause, synthetic_records
+from .network import get_network_classifier
+
+CHECKS = ('read', 'update', 'files', 'search')
+"""Kinds of checks run by the load test."""
+
+
+class FakeSearchClient(object):
+    """In-process search client over a list of documents.
+
+    Supports what ``RecordsSearch`` needs: ``search`` (``query``, ``from``,
+    ``size``, ``search_after`` on the document position, ``slice`` on the
+    document position modulo ``max``) and points in time.
+    """
+
+    def __init__(self, documents):
+        """Constructor.
+
+        :param documents: List of ``(id, source)`` tuples.
+        """
+        self.documents = list(documents)
+        self.searches = 0
+        self._lock = threading.Lock()
+
+    def search(self, index=None, body=None, **kwargs):
+        """Search the documents."""
+        with self._lock:
+            self.searches += 1
+        body = body or {}
+        sources = [source for _, source in self.documents]
+        positions = list(range(len(sources)))
+        if body.get('query'):
+            positions = compile_clause(body['query'])(sources, positions)
+        if body.get('slice'):
+            slice_id, slices = body['slice']['id'], body['slice']['max']
+            positions = [p for p in positions if p % slices == slice_id]
+        total = len(positions)
+
+        if body.get('search_after'):
+            after = body['search_after'][0]
+            positions = [p for p in positions if p > after]
+        start = body.get('from', 0)
+        size = body.get('size', 10)
+        hits = [{
+            '_index': index or 'records',
+            '_id': self.documents[p][0],
+            '_source': dict(sources[p]),
+            'sort': [p],
+        } for p in positions[start:start + size]]
+        return {
+            'took': 0,
+            'timed_out': False,
+            'hits': {
+                'total': {'value': total, 'relation': 'eq'},
+                'hits': hits,
+            },
+        }
+
+    def open_point_in_time(self, index=None, keep_alive=None, **kwargs):
+        """Open a (no-op) point in time."""
+        return {'id': 'fake-pit'}
+
+    def close_point_in_time(self, body=None, **kwargs):
+        """Close a point in time."""
+        return {'succeeded': True}
+
+
+def create_app(database_uri, instance_path, policy=None, config=None):
+    """Minimal application with the modules used by the permission checks."""
+    from invenio_access import InvenioAccess
+    from invenio_accounts import InvenioAccounts
+    from invenio_db import InvenioDB
+    from invenio_files_rest import InvenioFilesREST
+    from invenio_records import InvenioRecords
+
+    from .ext import InvenioRecordsPermissions
+
+    app = Flask('invenio_records_permissions_loadtest',
+                instance_path=instance_path)
+    app.config.update(
+        SECRET_KEY='loadtest',
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        TESTING=True,
+    )
+    if policy is not None:
+        app.config['RECORDS_PERMISSIONS_RECORD_POLICY'] = policy
+    app.config.update(config or {})
+    InvenioDB(app)
+    InvenioAccounts(app)
+    InvenioAccess(app)
+    InvenioRecords(app)
+    InvenioFilesREST(app)
+    InvenioRecordsPermissions(app)
+    return app
+
+
+def seed_records(count, users=100, groups=20, seed=0):
+    """Create ``count`` records with a bucket each.
+
+    Must be called in an application context.
+
+    :returns: The list of ``(record id, bucket id, record data)`` tuples.
+    """
+    from invenio_db import db
+    from invenio_files_rest.models import Bucket, Location
+    from invenio_records.api import Record
+    from invenio_records_files.models import RecordsBuckets
+
+    db.create_all()
+    if Location.get_default() is None:
+        db.session.add(Location(
+            name='default', default=True,
+            uri=os.path.join(current_app.instance_path, 'files'),
+        ))
+    seeded = []
+    for data in synthetic_records(count, users=users, groups=groups,
+                                  seed=seed):
+        record = Record.create(data)
+        bucket = Bucket.create()
+        RecordsBuckets.create(record=record.model, bucket=bucket)
+        seeded.append((str(record.id), str(bucket.id), dict(record)))
+    db.session.commit()
+    return seeded
+
+
+def make_identities(count, users=100, groups=20, ip_classes=(), seed=0):
+    """Random identities: anonymous ones and users with roles.
+
+    :param ip_classes: Sets of IP classes to pick the identities' from.
+    :returns: A list of ``(identity, ip classes)`` tuples.
+    """
+    rnd = random.Random(seed)
+    combinations = [frozenset(c) for c in ip_classes] or [frozenset()]
+    identities = []
+    for _ in range(count):
+        if rnd.random() < 0.3:
+            identity = AnonymousIdentity()
+        else:
+            user_id = rnd.randint(1, users)
+            identity = Identity(user_id)
+            identity.provides.update([UserNeed(user_id), authenticated_user])
+            identity.provides.update(
+                RoleNeed('group-{0}'.format(i))
+                for i in rnd.sample(range(groups), rnd.randint(0, 3))
+            )
+        identity.provides.add(any_user)
+        identities.append((identity, rnd.choice(combinations)))
+    return identities
+
+
+def _percentile(values, fraction):
+    """Percentile of sorted ``values`` (nearest rank)."""
+    if not values:
+        return None
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def _summary(latencies, queries, elapsed):
+    """Statistics of a list of latencies (seconds)."""
+    latencies = sorted(latencies)
+    return {
+        'checks': len(latencies),
+        'checks_per_sec': len(latencies) / elapsed if elapsed else None,
+        'mean': sum(latencies) / len(latencies) if latencies else None,
+        'p50': _percentile(latencies, 0.5),
+        'p99': _percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else None,
+        'db_queries': queries,
+        'db_queries_per_check': (
+            queries / len(latencies) if latencies else None
+        ),
+    }
+
+
+class QueryCounter(object):
+    """Count the queries sent to a SQLAlchemy engine, per thread."""
+
+    def __init__(self, engine):
+        """Constructor."""
+        self.engine = engine
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args, **kwargs):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    @property
+    def count(self):
+        """Queries sent by the current thread so far."""
+        return getattr(self._local, 'count', 0)
+
+    def remove(self):
+        """Stop counting."""
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def run_check(kind, record, bucket_id, client):
+    """Run one permission check in the current request context."""
+    from invenio_files_rest.models import Bucket
+
+    from .api import RecordsSearch
+    from .factories import record_files_permission_factory, \
+        record_read_permission_factory, record_update_permission_factory
+
+    if kind == 'read':
+        return record_read_permission_factory(record).can()
+    elif kind == 'update':
+        return record_update_permission_factory(record).can()
+    elif kind == 'files':
+        bucket = Bucket.get(bucket_id)
+        return record_files_permission_factory(bucket, 'bucket-read').can()
+    elif kind == 'search':
+        response = RecordsSearch(using=client)[:10].execute()
+        return len(response.hits)
+    raise ValueError('Unknown check {0}'.format(kind))
+
+
+def run_load_test(records=1000, identities=50, concurrency=4, checks=10000,
+                  mix=None, policy=None, config=None, seed=0,
+                  database_uri=None):
+    """Run the load test.
+
+    :param records: Number of seeded records (and buckets).
+    :param identities: Number of distinct identities.
+    :param concurrency: Number of worker threads.
+    :param checks: Total number of checks.
+    :param mix: Dictionary of check kind (see ``CHECKS``) to weight. Read
+        and update checks include loading the record.
+    :param policy: Import string of the record policy.
+    :param config: Extra application configuration.
+    :param database_uri: Defaults to a SQLite file in a temporary directory.
+    :returns: The JSON serializable results.
+    """
+    from invenio_db import db
+    from invenio_records.api import Record
+
+    mix = mix or {'read': 4, 'update': 1, 'files': 2, 'search': 1}
+    unknown = set(mix) - set(CHECKS)
+    if unknown:
+        raise ValueError('Unknown checks {0}'.format(sorted(unknown)))
+    instance_path = tempfile.mkdtemp(prefix='permissions-loadtest-')
+    try:
+        app = create_app(
+            database_uri or 'sqlite:///{0}'.format(
+                os.path.join(instance_path, 'loadtest.db')),
+            instance_path, policy=policy, config=config,
+        )
+        with app.app_context():
+            seeded = seed_records(records, seed=seed)
+            classifier = get_network_classifier()
+            ip_classes = sorted(classifier.classes)
+            combinations = sorted(classifier.combinations(), key=sorted)
+            counter = QueryCounter(db.engine)
+        client = FakeSearchClient(
+            (record_id, data) for record_id, _, data in seeded
+        )
+        population = make_identities(
+            identities, ip_classes=combinations, seed=seed
+        )
+        kinds = sorted(mix)
+        weights = [mix[k] for k in kinds]
+
+        results = {kind: [] for kind in kinds}
+        queries = dict.fromkeys(kinds, 0)
+        errors = []
+        lock = threading.Lock()
+
+        def worker(worker_id, count):
+            rnd = random.Random(seed + worker_id + 1)
+            latencies = {kind: [] for kind in kinds}
+            worker_queries = dict.fromkeys(kinds, 0)
+            for _ in range(count):
+                kind = rnd.choices(kinds, weights)[0]
+                record_id, bucket_id, _ = rnd.choice(seeded)
+                identity, ip_classes = rnd.choice(population)
+                before = counter.count
+                start = default_timer()
+                try:
+                    # A fresh application context per check, like requests
+                    with app.app_context(), app.test_request_context():
+                        g.identity = identity
+                        g._permissions_ip_classes = ip_classes
+                        record = None
+                        if kind in ('read', 'update'):
+                            record = Record.get_record(record_id)
+                        run_check(kind, record, bucket_id, client)
+                except Exception as e:
+                    with lock:
+                        errors.append('{0}: {1!r}'.format(kind, e))
+                    continue
+                latencies[kind].append(default_timer() - start)
+                worker_queries[kind] += counter.count - before
+            with lock:
+                for kind in kinds:
+                    results[kind].extend(latencies[kind])
+                    queries[kind] += worker_queries[kind]
+
+        per_worker = [checks // concurrency] * concurrency
+        for i in range(checks % concurrency):
+            per_worker[i] += 1
+        threads = [
+            threading.Thread(target=worker, args=(i, n))
+            for i, n in enumerate(per_worker)
+        ]
+        start = default_timer()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = default_timer() - start
+        counter.remove()
+
+        all_latencies = [v for kind in kinds for v in results[kind]]
+        return {
+            'time': time.time(),
+            'parameters': {
+                'records': records,
+                'identities': identities,
+                'concurrency': concurrency,
+                'checks': checks,
+                'mix': mix,
+                'policy': policy,
+                'ip_classes': ip_classes,
+                'seed': seed,
+            },
+            'elapsed': elapsed,
+            'total': _summary(all_latencies, sum(queries.values()), elapsed),
+            'checks': {
+                kind: _summary(results[kind], queries[kind], elapsed)
+                for kind in kinds
+            },
+            'searches': client.searches,
+            'errors': len(errors),
+            'error_samples': errors[:10],
+        }
+    finally:
+        shutil.rmtree(instance_path, ignore_errors=True)
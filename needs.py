@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Lazy sets of Needs.
+
+Records can have thousands of owners or groups. Instead of one ``UserNeed``
+or ``RoleNeed`` per entry, generators return a :class:`NeedSet` answering
+membership queries against the values (e.g. the frozensets of the
+restriction descriptor). Intersecting it with the few Needs an identity
+provides costs as many lookups; Needs are only created when iterated.
+"""
+
+from collections.abc import Set
+from itertools import chain
+
+from flask_principal import Need
+
+
+class _LazyNeeds(Set):
+    """Methods of ``set`` used by Flask-Principal (``Permission.union``...).
+
+    ``collections.abc.Set`` only provides the operators. The results are
+    plain sets.
+    """
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        # Results of the set operators are plain sets
+        return set(iterable)
+
+    def union(self, *others):
+        """Needs of the set and of ``others``."""
+        return set(self).union(*others)
+
+    def difference(self, *others):
+        """Needs of the set in none of ``others``."""
+        others = [o if isinstance(o, Set) else set(o) for o in others]
+        return {
+            need for need in self if not any(need in o for o in others)
+        }
+
+    def intersection(self, needs):
+        """Needs of ``needs`` in the set, iterating over ``needs`` only."""
+        return {need for need in needs if need in self}
+
+    def issubset(self, other):
+        """Tell if all the Needs of the set are in ``other``."""
+        if not isinstance(other, Set):
+            other = set(other)
+        return all(need in other for need in self)
+
+    def issuperset(self, other):
+        """Tell if all the Needs of ``other`` are in the set."""
+        return all(need in self for need in other)
+
+
+class NeedSet(_LazyNeeds):
+    """Set of the Needs of a method (e.g. ``"id"``) for some values."""
+
+    def __init__(self, method, values):
+        """Constructor.
+
+        :param values: Set (ideally a frozenset) of the Need values.
+        """
+        self.method = method
+        self.values = values
+
+    def __contains__(self, need):
+        try:
+            return need.method == self.method and need.value in self.values
+        except (AttributeError, TypeError):
+            return False
+
+    def __iter__(self):
+        return (Need(self.method, value) for value in self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __bool__(self):
+        return bool(self.values)
+
+    def __repr__(self):
+        return '<NeedSet {0} ({1} values)>'.format(self.method, len(self))
+
+
+class NeedSetUnion(_LazyNeeds):
+    """Union of sets of Needs, lazy ones included."""
+
+    def __init__(self, sets):
+        """Constructor."""
+        self.sets = list(sets)
+
+    def __contains__(self, need):
+        return any(need in s for s in self.sets)
+
+    def __iter__(self):
+        seen = set()
+        for need in chain.from_iterable(self.sets):
+            if need not in seen:
+                seen.add(need)
+                yield need
+
+    def __len__(self):
+        # Materializes the Needs, prefer truth tests
+        return sum(1 for _ in self)
+
+    def __bool__(self):
+        return any(self.sets)
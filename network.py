@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Classification of client IPs into network classes.
+
+The client IP of a request is mapped once to the set of *IP classes* it
+belongs to: ``ip_single`` (see ``single_ips`` in ``setup.py``), ``ip_range``
+(see ``ip_ranges`` in ``setup.py``) and the named networks of
+``RECORDS_PERMISSIONS_NETWORKS``. The classes are the values found in the
+``applied_restrictions`` of records.
+
+Networks are stored in binary prefix tries backed by arrays: they are
+compact and, built before the workers fork, stay in shared pages.
+"""
+
+import ipaddress
+from array import array
+
+from flask import current_app, g
+from flask_login import current_user
+
+from .setup import ip_ranges, single_ips
+
+IP_SINGLE = 'ip_single'
+IP_RANGE = 'ip_range'
+
+
+class PrefixTrie(object):
+    """Binary trie mapping network prefixes to a bitmask of labels."""
+
+    def __init__(self, max_length):
+        """Constructor."""
+        self.max_length = max_length
+        # Node ``n`` has children ``2n`` (bit 0) and ``2n + 1`` (bit 1)
+        self._children = array('l', [-1, -1])
+        self._masks = array('Q', [0])
+
+    def insert(self, network, mask):
+        """Add the ``mask`` bits to the node of ``network``."""
+        value = int(network.network_address)
+        node = 0
+        for position in range(network.prefixlen):
+            bit = (value >> (self.max_length - 1 - position)) & 1
+            child = self._children[2 * node + bit]
+            if child == -1:
+                child = len(self._masks)
+                self._children[2 * node + bit] = child
+                self._children.extend((-1, -1))
+                self._masks.append(0)
+            node = child
+        self._masks[node] |= mask
+
+    def lookup(self, value):
+        """Bitmask of the labels of all the prefixes containing ``value``."""
+        node = 0
+        mask = self._masks[0]
+        for position in range(self.max_length):
+            bit = (value >> (self.max_length - 1 - position)) & 1
+            node = self._children[2 * node + bit]
+            if node == -1:
+                break
+            mask |= self._masks[node]
+        return mask
+
+    def masks(self):
+        """All the bitmasks ``lookup`` can return."""
+        masks = {0}
+        stack = [(0, self._masks[0])]
+        while stack:
+            node, mask = stack.pop()
+            masks.add(mask)
+            for child in self._children[2 * node:2 * node + 2]:
+                if child != -1:
+                    stack.append((child, mask | self._masks[child]))
+        return masks
+
+
+class NetworkClassifier(object):
+    """Map IPs to the set of IP classes they belong to."""
+
+    def __init__(self, networks=None, single_ips=(), ip_ranges=()):
+        """Constructor.
+
+        :param networks: Dictionary of IP class name to list of networks
+            (e.g. ``'10.0.0.0/8'``).
+        """
+        self.labels = []
+        self._tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+
+        for ip in single_ips:
+            self.add(IP_SINGLE, ipaddress.ip_network(ip))
+        for start, end in ip_ranges:
+            for network in ipaddress.summarize_address_range(
+                ipaddress.ip_address(start), ipaddress.ip_address(end)
+            ):
+                self.add(IP_RANGE, network)
+        for name, name_networks in (networks or {}).items():
+            for network in name_networks:
+                self.add(name, ipaddress.ip_network(network, strict=False))
+
+    @property
+    def classes(self):
+        """All the IP classes known to the classifier."""
+        return frozenset(self.labels)
+
+    def add(self, label, network):
+        """Add ``network`` to the IP class ``label``."""
+        if label not in self.labels:
+            if len(self.labels) == 64:
+                raise ValueError('At most 64 IP classes are supported.')
+            self.labels.append(label)
+        mask = 1 << self.labels.index(label)
+        self._tries[network.version].insert(network, mask)
+
+    def _labels_of(self, mask):
+        """IP classes of a bitmask."""
+        return frozenset(
+            label for index, label in enumerate(self.labels)
+            if mask >> index & 1
+        )
+
+    def combinations(self):
+        """All the sets of IP classes an IP can belong to."""
+        return {
+            self._labels_of(mask)
+            for trie in self._tries.values() for mask in trie.masks()
+        }
+
+    def classify(self, ip):
+        """IP classes of ``ip`` (empty if it is not a valid IP)."""
+        try:
+            address = ipaddress.ip_address(str(ip).strip())
+        except ValueError:
+            return frozenset()
+        return self._labels_of(
+            self._tries[address.version].lookup(int(address))
+        )
+
+
+def get_network_classifier():
+    """Network classifier of the application, built on first use."""
+    ext = current_app.extensions['invenio-records-permissions']
+    if ext.network_classifier is None:
+        ext.network_classifier = NetworkClassifier(
+            current_app.config['RECORDS_PERMISSIONS_NETWORKS'],
+            single_ips=single_ips,
+            ip_ranges=ip_ranges,
+        )
+    return ext.network_classifier
+
+
+def current_ip_classes():
+    """IP classes of the current user's IP, computed once per request."""
+    if '_permissions_ip_classes' not in g:
+        # The user needs to be logged in
+        if "current_login_ip" not in vars(current_user):
+            classes = frozenset()
+        else:
+            classes = get_network_classifier().classify(
+                current_user.current_login_ip
+            )
+        g._permissions_ip_classes = classes
+    return g._permissions_ip_classes
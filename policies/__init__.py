@@ -11,4 +11,5 @@
 
 from .base import BasePermissionPolicy
 from .deposits import DepositPermissionPolicy
-from .records import RecordPermissionPolicy, get_record_permission_policy
+from .records import RecordPermissionPolicy, get_create_permission_policy, \
+    get_policies, get_record_permission_policy
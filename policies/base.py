@@ -11,10 +11,18 @@
 
 from itertools import chain
 
-from flask import current_app
+from flask import current_app, has_app_context
 from invenio_access import Permission
 
+from ..aio import aallows
+from ..analysis import simplify_generators
+from ..anonymous import anonymous_cache_key
+from ..compiler import get_evaluator, identity_facts
+from ..explain import explain_generators
+from ..profiling import permission_context
+from ..utils import acl_digest
 from ..generators import Disable
+from ..needs import NeedSet, NeedSetUnion
 
 # Where can a property be used?
 #
@@ -34,6 +42,28 @@ from ..generators import Disable
 # |-------------|------|----------|---------------|
 #
 
+_UNCACHEABLE = object()
+
+_simplified = {}
+"""Simplified generators per policy class and action."""
+
+
+class _ExtensionState(object):
+    """Attribute read from the extension of the current application.
+
+    ``None`` outside of an application context. Instances can override it,
+    e.g. with ``None`` to disable a cache.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None or not has_app_context():
+            return None
+        ext = current_app.extensions.get('invenio-records-permissions')
+        return getattr(ext, self.name, None)
+
 
 class BasePermissionPolicy(Permission):
     """
@@ -56,6 +86,30 @@ class BasePermissionPolicy(Permission):
     can_update = []
     can_delete = []
 
+    decision_log = _ExtensionState()
+    """:class:`~invenio_records_permissions.explain.DecisionLog` or None."""
+
+    anonymous_decisions = _ExtensionState()
+    """Cache of the record independent decisions of anonymous identities,
+    see :class:`~invenio_records_permissions.anonymous.AnonymousCache`."""
+
+    preauthorization = None
+    """Function deciding for pre-authorized records, see
+    :func:`~invenio_records_permissions.preauthorized.allows_preauthorized`.
+    """
+
+    action_expansions = None
+    """Expansions of ActionNeeds prefetched by the asynchronous factories."""
+
+    profiler = _ExtensionState()
+    """:class:`~invenio_records_permissions.profiling.SlowCallProfiler` or
+    None."""
+
+    compiled_evaluators = _ExtensionState()
+    """Cache of the compiled evaluators per policy class and action, see
+    :mod:`~invenio_records_permissions.compiler`. None if disabled.
+    """
+
     def __init__(self, action, **over):
         """Constructor."""
         super(BasePermissionPolicy, self).__init__()
@@ -66,9 +120,65 @@ class BasePermissionPolicy(Permission):
     def generators(self):
         """List of Needs generators for self.action.
 
-        Defaults to Disable() if no can_<self.action> defined.
+        Defaults to Disable() if no can_<self.action> defined. Redundant
+        generators are left out, see
+        :mod:`~invenio_records_permissions.analysis`.
         """
-        return getattr(self.__class__, 'can_' + self.action, [Disable()])
+        declared = getattr(self.__class__, 'can_' + self.action, None)
+        if declared is None:
+            return [Disable()]
+        key = (self.__class__, self.action)
+        cached = _simplified.get(key)
+        if cached is None or cached[0] is not declared or \
+                cached[1] != len(declared):
+            cached = _simplified[key] = (
+                declared, len(declared),
+                simplify_generators(declared).generators,
+            )
+        return cached[2]
+
+    @property
+    def record_fields(self):
+        """Record fields (dotted paths) read by the generators of the action.
+
+        ``None`` if any generator does not declare its ``record_fields``, in
+        which case the whole record is needed.
+        """
+        fields = set()
+        for generator in self.generators:
+            if generator.record_fields is None:
+                return None
+            fields.update(generator.record_fields)
+        return sorted(fields)
+
+    @property
+    def acl_fingerprint(self):
+        """Digest of the record fields read by the generators of the action.
+
+        Permissions of the same policy and action with the same fingerprint
+        make the same decision for an identity (at a given time). ``None``
+        if unknown, i.e. a generator does not declare its ``record_fields``
+        or the permission is over more than a record.
+        """
+        fields = self.record_fields
+        if fields is None or set(self.over) - {'record'}:
+            return None
+        return acl_digest(self.over.get('record') or {}, fields)
+
+    @property
+    def expires_at(self):
+        """Datetime at which the decisions of the action may change.
+
+        The earliest ``next_change`` of the generators, ``None`` if they do
+        not depend on time.
+        """
+        changes = [
+            change for change in (
+                generator.next_change(**self.over)
+                for generator in self.generators
+            ) if change is not None
+        ]
+        return min(changes) if changes else None
 
     @property
     def needs(self):
@@ -84,12 +194,24 @@ class BasePermissionPolicy(Permission):
             ``superuser_access`` Need (if tied to a User or Role) for us.
             It also expands ActionNeeds into the Users/Roles that
             provide them.
+
+        Lazy sets of Needs (see :class:`~invenio_records_permissions.needs.
+        NeedSet`), e.g. of records with many owners, are not materialized:
+        they are kept out of ``explicit_needs`` and combined with the loaded
+        Needs in a :class:`~invenio_records_permissions.needs.NeedSetUnion`.
         """
-        needs = [
-            generator.needs(**self.over) for generator in self.generators
-        ]
+        needs = []
+        lazy = []
+        for generator in self.generators:
+            generated = generator.needs(**self.over)
+            if isinstance(generated, NeedSet):
+                lazy.append(generated)
+            else:
+                needs.append(generated)
         self.explicit_needs |= set(chain.from_iterable(needs))
         self._load_permissions()  # self.explicit_needs is used here
+        if lazy:
+            return NeedSetUnion([self._permissions.needs] + lazy)
         return self._permissions.needs
 
     @property
@@ -122,10 +244,88 @@ class BasePermissionPolicy(Permission):
         """List of ElasticSearch query filters.
 
         These filters consist of additive queries mapping to what the current
-        user should be able to retrieve via search.
+        user should be able to retrieve via search. Identical filters are only
+        included once.
         """
-        filters = [
-            generator.query_filter(**self.over)
-            for generator in self.generators
-        ]
-        return [f for f in filters if f]
+        filters = []
+        for generator in self.generators:
+            f = generator.query_filter(**self.over)
+            if f and f not in filters:
+                filters.append(f)
+        return filters
+
+    def allows(self, identity):
+        """Whether the identity can access this permission."""
+        if self.profiler is not None:
+            return self.profiler.call(
+                lambda: permission_context(self), self._decide, identity
+            )
+        return self._decide(identity)
+
+    def _decide(self, identity):
+        """Decide, honouring pre-authorization, and log the decision."""
+        allowed = None
+        if self.preauthorization is not None:
+            allowed = self.preauthorization(self, identity, self._allows)
+        if allowed is None:
+            allowed = self._allows(identity)
+        if self.decision_log is not None:
+            self.decision_log.record(self, identity, allowed)
+        return allowed
+
+    async def aallows(self, identity, session=None):
+        """Asynchronous ``allows``.
+
+        See :mod:`~invenio_records_permissions.aio`.
+
+        :param session: Async SQLAlchemy session, a new one is used if not
+            given.
+        """
+        return await aallows(self, identity, session=session)
+
+    def _allows(self, identity):
+        """Evaluate the decision."""
+        if self.compiled_evaluators is not None:
+            evaluate = get_evaluator(
+                self, self.action, self.compiled_evaluators
+            )
+            if evaluate is not None:
+                return evaluate(
+                    identity_facts(identity), self.over.get('record')
+                )
+        cache = self.anonymous_decisions
+        if cache is not None:
+            return self._allows_anonymous(cache, identity)
+        return super(BasePermissionPolicy, self).allows(identity)
+
+    def _allows_anonymous(self, cache, identity):
+        """Decision reused for anonymous identities, when it can be.
+
+        It can be if no generator of the action reads the record.
+        """
+        key = anonymous_cache_key(self, identity)
+        allowed = cache.get(key) if key is not None else _UNCACHEABLE
+        if allowed is _UNCACHEABLE:
+            return super(BasePermissionPolicy, self).allows(identity)
+        if allowed is None:
+            allowed = super(BasePermissionPolicy, self).allows(identity)
+            if self.record_fields == []:
+                cache.set(key, allowed, expires_at=self.expires_at)
+            else:
+                cache[key] = _UNCACHEABLE
+        return allowed
+
+    def explain(self, identity):
+        """Structured trace of the decision for ``identity``.
+
+        Evaluates every generator separately, so it is meant for debugging
+        and never used by the regular permission checks.
+        """
+        return {
+            'policy': type(self).__name__,
+            'action': self.action,
+            'allowed': self.allows(identity),
+            'generators': explain_generators(
+                self.generators, identity, **self.over
+            ),
+        }
@@ -10,7 +10,7 @@
 """Access controls for records."""
 
 import six
-from flask import current_app
+from flask import current_app, has_request_context, request
 from werkzeug.utils import import_string
 
 from ..errors import UnknownGeneratorError
@@ -74,14 +74,55 @@ class RecordPermissionPolicy(BasePermissionPolicy):
         super(RecordPermissionPolicy, self).__init__(action, **over)
 
 
-def get_record_permission_policy():
+def get_record_permission_policy(record=None):
     """Return RecordPermissionPolicy.
 
     Relies on ``RECORDS_PERMISSIONS_RECORD_POLICY`` to
     automatically configure functionality. This way the hoster doesn't need to
     define their own CRUD factories (functions) anymore.
+    The policy resolved by the extension's warm-up is used if available.
+
+    :param record: If given, the policy registered for the discriminator of
+        the record (see ``RECORDS_PERMISSIONS_POLICIES``) is returned if any.
     """
+    ext = current_app.extensions.get('invenio-records-permissions')
+    if ext is not None and record is not None and ext.policies:
+        policy = ext.policy_for(record)
+        if policy is not None:
+            return policy
+    if ext is not None and ext.record_policy is not None:
+        return ext.record_policy
     return obj_or_import_string(
         current_app.config.get('RECORDS_PERMISSIONS_RECORD_POLICY'),
         default=RecordPermissionPolicy
     )
+
+
+def get_create_permission_policy():
+    """Return the PermissionPolicy of record creations.
+
+    The submitted record is not trusted to pick its policy: the policy
+    registered for the endpoint of the request (see
+    ``RECORDS_PERMISSIONS_ENDPOINT_POLICIES``) is returned if any, the
+    default one otherwise.
+    """
+    ext = current_app.extensions.get('invenio-records-permissions')
+    if ext is not None and has_request_context():
+        value = current_app.config.get(
+            'RECORDS_PERMISSIONS_ENDPOINT_POLICIES', {}
+        ).get(request.endpoint)
+        if value is not None and value in ext.policies:
+            return ext.policies[value]
+    return get_record_permission_policy()
+
+
+def get_policies():
+    """All the policies in use: the registered ones and the default one."""
+    ext = current_app.extensions.get('invenio-records-permissions')
+    policies = [get_record_permission_policy()]
+    if ext is not None:
+        policies.extend(
+            policy for policy in ext.policies.values()
+            if policy not in policies
+        )
+    return policies
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Pre-authorization of search hits.
+
+Hits returned by :class:`~invenio_records_permissions.api.RecordsSearch`
+were already restricted by the permission filter, so re-authorizing them
+one by one with ``record_read_permission_factory(hit).can()`` repeats the
+work. This is only sound if every record the filter matches is granted by
+the policy, which generators declare with ``filter_implies_needs`` (see
+:func:`preauthorizable`). The search of such a policy keeps its hits in
+``g``, by id, and the read policy honours them instead of evaluating its
+generators. The ``_source`` of the hits is left untouched.
+
+The hits are only pre-authorized in the request (and for the identity) of
+the search. A checked record is found among them by object (the
+``_source`` of a hit) or by record id. Nothing is computed per hit when
+searching: when a pre-authorized record is checked, its permission fields
+are compared with those of the hit, so that checking a more recent version
+of the record than the indexed one falls back to the evaluation.
+
+With ``RECORDS_PERMISSIONS_PREAUTHORIZED_CHECK_RATE``, a fraction of the
+pre-authorized checks is verified against the full evaluation and
+disagreements are logged.
+"""
+
+import random
+from collections import namedtuple
+
+from flask import current_app, g
+
+from .utils import acl_digest
+
+PreauthorizedHits = namedtuple('PreauthorizedHits', ['hits', 'sources'])
+"""Hits of the request by id, and their ids and sources by ``id()``."""
+
+PREAUTHORIZED_ACTION = 'read'
+"""The action the search filter pre-authorizes."""
+
+
+def preauthorizable(permission):
+    """Whether the search filter of ``permission`` implies its decision.
+
+    It does if all the generators of the action declare
+    ``filter_implies_needs``, none of them excludes and they build a
+    filter (an empty list of filters matches all the records).
+    """
+    # Permissions which are not policies have no record fields
+    if getattr(permission, 'action', None) != PREAUTHORIZED_ACTION or \
+            getattr(permission, 'record_fields', None) is None:
+        return False
+    generators = permission.generators
+    if not all(generator.filter_implies_needs and not generator.may_exclude
+               for generator in generators):
+        return False
+    return bool(permission.query_filters)
+
+
+def mark_preauthorized(policy, hits):
+    """Keep ``hits`` as pre-authorized for ``policy`` in the request."""
+    identity = g.get('identity')
+    for hit in hits:
+        source = hit.get('_source')
+        if source is None or '_id' not in hit:
+            continue
+        issued = g.get('_permissions_preauthorized')
+        if issued is None:
+            issued = g._permissions_preauthorized = PreauthorizedHits({}, {})
+        hit_id = str(hit['_id'])
+        issued.hits[hit_id] = (policy, identity, source)
+        # Kept alive, so that their id() are not reused
+        issued.sources[id(source)] = (hit_id, source)
+
+
+def has_preauthorized_hits():
+    """Tell if a search of the request pre-authorized hits."""
+    return g.get('_permissions_preauthorized') is not None
+
+
+def is_preauthorized(permission, identity):
+    """Tell if the record of ``permission`` is a pre-authorized hit.
+
+    Only hits of searches of the current request by ``identity``, with the
+    same policy, are pre-authorized, and only for records with the same
+    permission fields as the hit.
+    """
+    record = permission.over.get('record')
+    issued = g.get('_permissions_preauthorized')
+    if record is None or issued is None or \
+            permission.action != PREAUTHORIZED_ACTION:
+        return False
+    found = issued.sources.get(id(record))
+    hit_id = found[0] if found else str(getattr(record, 'id', None))
+    hit = issued.hits.get(hit_id)
+    if hit is None:
+        return False
+    policy, search_identity, source = hit
+    fields = permission.record_fields
+    if fields is None or type(permission) is not policy \
+            or identity is not search_identity:
+        return False
+    return source is record or acl_digest(record, fields) == \
+        acl_digest(source, fields)
+
+
+def allows_preauthorized(permission, identity, full_allows):
+    """Decision of a pre-authorized ``permission``.
+
+    A fraction of the decisions is verified with ``full_allows``, see
+    ``RECORDS_PERMISSIONS_PREAUTHORIZED_CHECK_RATE``.
+
+    :param full_allows: Function evaluating the decision in full.
+    :returns: The decision or ``None`` if the record is not pre-authorized.
+    """
+    if not is_preauthorized(permission, identity):
+        return None
+    rate = current_app.config['RECORDS_PERMISSIONS_PREAUTHORIZED_CHECK_RATE']
+    if not rate or random.random() >= rate:
+        return True
+    allowed = full_allows(identity)
+    if not allowed:
+        current_app.logger.error(
+            'Pre-authorized %s %s denied by the full evaluation '
+            '(record fields: %s).', type(permission).__name__,
+            permission.action, permission.record_fields,
+        )
+    return allowed
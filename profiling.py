@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Sampled profiling of slow permission checks.
+
+A fraction of the permission evaluations (``BasePermissionPolicy.allows``)
+and search filter builds (``rdm_records_filter``) runs under ``cProfile``.
+Profiled calls slower than a threshold are dumped, with their context
+(policy, action, record id, generators), to a directory keeping only the
+most recent dumps.
+
+The overhead is bounded: only sampled calls are profiled, at most one
+profiled call runs at a time per thread, and dumps are written by a
+background thread through a bounded queue (dropped when it is full). The
+thread is started by the first slow call of each process, e.g. in the
+workers of a preforking server. The overhead is measured by
+:meth:`SlowCallProfiler.stats`, comparing the mean latency of profiled and
+regular calls.
+"""
+
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from queue import Full, Queue
+from timeit import default_timer
+
+from .utils import ProcessThread
+
+
+class SlowCallProfiler(object):
+    """Profile sampled calls and dump the slow ones."""
+
+    def __init__(self, sample_rate, threshold, directory, max_files=50,
+                 queue_size=16):
+        """Constructor.
+
+        :param sample_rate: Fraction of the calls to profile.
+        :param threshold: Latency (seconds) above which a profile is dumped.
+        :param directory: Directory of the dumps.
+        :param max_files: Number of dumps kept, oldest removed first.
+        """
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.directory = directory
+        self.max_files = max_files
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ['calls', 'sampled', 'slow', 'dumped', 'dropped'], 0
+        )
+        self._time = {'regular': 0.0, 'sampled': 0.0}
+        self._queue_size = queue_size
+        self._queue = Queue(maxsize=queue_size)
+        self._writer = ProcessThread(
+            self._run, 'permissions-profiler', reset=self._reset
+        )
+
+    def _reset(self):
+        """Drop the queue inherited from the parent process."""
+        self._queue = Queue(maxsize=self._queue_size)
+
+    def _count(self, name, elapsed=None, kind=None):
+        with self._lock:
+            self._counters[name] += 1
+            if kind is not None:
+                self._time[kind] += elapsed
+
+    def call(self, context, func, *args, **kwargs):
+        """Call ``func``, profiling it if sampled.
+
+        :param context: Function returning the dictionary describing the
+            call, only evaluated for dumped profiles.
+        """
+        self._count('calls')
+        if getattr(self._local, 'active', False) or \
+                random.random() >= self.sample_rate:
+            start = default_timer()
+            result = func(*args, **kwargs)
+            self._time_regular(default_timer() - start)
+            return result
+
+        profile = cProfile.Profile()
+        self._local.active = True
+        start = default_timer()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active (e.g. a debugger)
+            profile = None
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.disable()
+            elapsed = default_timer() - start
+            self._local.active = False
+
+        if profile is None:
+            self._time_regular(elapsed)
+            return result
+        self._count('sampled', elapsed, 'sampled')
+        if elapsed >= self.threshold:
+            self._count('slow')
+            info = dict(context(), elapsed=elapsed, time=time.time())
+            self._writer.ensure_started()
+            try:
+                self._queue.put_nowait((profile, info))
+            except Full:
+                self._count('dropped')
+        return result
+
+    def _time_regular(self, elapsed):
+        with self._lock:
+            self._time['regular'] += elapsed
+
+    def stats(self):
+        """Counters and estimated overhead (seconds) of the profiler.
+
+        The overhead is ``None`` until both regular and profiled calls were
+        measured.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            regular = stats['calls'] - stats['sampled']
+            mean = self._time['regular'] / regular if regular else 0.0
+            mean_sampled = (
+                self._time['sampled'] / stats['sampled']
+                if stats['sampled'] else 0.0
+            )
+        stats.update(
+            mean=mean,
+            mean_sampled=mean_sampled,
+            overhead=(
+                max(mean_sampled - mean, 0.0) * stats['sampled']
+                if regular and stats['sampled'] else None
+            ),
+        )
+        return stats
+
+    def _run(self):
+        """Write the queued profiles."""
+        queue = self._queue
+        while True:
+            profile, info = queue.get()
+            try:
+                self._dump(profile, info)
+                self._count('dumped')
+            except OSError:
+                self._count('dropped')
+
+    def _dump(self, profile, info):
+        """Write a profile and its context, then rotate the directory."""
+        os.makedirs(self.directory, exist_ok=True)
+        name = '{0:.6f}-{1}-{2}'.format(
+            info['time'], info.get('kind', 'call'), threading.get_ident()
+        )
+        path = os.path.join(self.directory, name)
+        profile.dump_stats(path + '.prof')
+        with open(path + '.json', 'w') as f:
+            json.dump(info, f, default=str, indent=2)
+
+        dumps = sorted(
+            f for f in os.listdir(self.directory) if f.endswith('.prof')
+        )
+        for old in dumps[:max(len(dumps) - self.max_files, 0)]:
+            for extension in ('.prof', '.json'):
+                try:
+                    os.remove(os.path.join(
+                        self.directory, old[:-len('.prof')] + extension
+                    ))
+                except OSError:
+                    pass
+
+
+def permission_context(permission, kind='allows'):
+    """Context of a profiled permission evaluation."""
+    record = permission.over.get('record')
+    record_id = getattr(record, 'id', None)
+    if record_id is None and isinstance(record, dict):
+        record_id = record.get('id', record.get('recid'))
+    return {
+        'kind': kind,
+        'policy': '{0}.{1}'.format(
+            type(permission).__module__, type(permission).__name__
+        ),
+        'action': permission.action,
+        'record': str(record_id) if record_id is not None else None,
+        'generators': [type(g).__name__ for g in permission.generators],
+    }
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Normalized descriptor of the restrictions applied to a record.
+
+The ``applied_restrictions``, ``owners`` and ``group_restrictions`` lists of
+a record are normalized once into a bitmask of restriction kinds and
+frozensets, cached on the record for its revision and lists. Generators
+branch on the descriptor instead of scanning the lists on every check.
+
+Every applied restriction has its bit, including the IP classes without
+configured networks: a record restricted to such a class is denied to
+everyone rather than granted.
+"""
+
+from collections import namedtuple
+from threading import Lock
+
+from flask import current_app
+
+from .errors import UnknownRestrictionError
+from .network import IP_RANGE, IP_SINGLE, get_network_classifier
+
+OWNERS = 'owners'
+GROUPS = 'groups'
+
+_bits = {OWNERS: 1, GROUPS: 2, IP_SINGLE: 4, IP_RANGE: 8}
+_bits_lock = Lock()
+
+_warned = set()
+"""Unknown restriction kinds already logged."""
+
+RestrictionDescriptor = namedtuple(
+    'RestrictionDescriptor', ['mask', 'owners', 'groups', 'unknown']
+)
+"""Restrictions of a record.
+
+``mask`` has the bits (see :func:`restriction_bit`) of all the applied
+restrictions, ``owners`` and ``groups`` are frozensets of the record's
+``owners`` and ``group_restrictions`` and ``unknown`` the frozenset of the
+applied restrictions which are neither owners, groups nor a configured IP
+class.
+"""
+
+
+def restriction_bit(name):
+    """Bit of the restriction kind ``name``, allocated on first use."""
+    bit = _bits.get(name)
+    if bit is None:
+        with _bits_lock:
+            bit = _bits.setdefault(name, 1 << len(_bits))
+    return bit
+
+
+def known_restrictions():
+    """Restriction kinds handled by the generators."""
+    return {OWNERS, GROUPS} | get_network_classifier().classes
+
+
+_FIELDS = ('applied_restrictions', 'owners', 'group_restrictions')
+
+
+def _cache_key(record):
+    """Key telling if a cached descriptor is still valid for ``record``.
+
+    Made of the revision of the record and of the lists themselves (not of
+    their content), so that it is built in constant time. Lists edited in
+    place are only seen once the record is stored as a new revision.
+    """
+    return (getattr(record, 'revision_id', None),) + tuple(
+        record.get(field) for field in _FIELDS
+    )
+
+
+def _same_key(key, other):
+    """Tell if two cache keys have the same revision and lists."""
+    return key[0] == other[0] and all(
+        value is other_value for value, other_value in zip(key[1:], other[1:])
+    )
+
+
+def build_descriptor(record):
+    """Compute the restriction descriptor of ``record``.
+
+    Unknown applied restrictions are handled according to
+    ``RECORDS_PERMISSIONS_UNKNOWN_RESTRICTIONS``.
+    """
+    applied = frozenset(record.get('applied_restrictions') or ())
+    known = known_restrictions()
+    mask = 0
+    for name in applied:
+        mask |= restriction_bit(name)
+
+    unknown = applied - known
+    if unknown:
+        policy = current_app.config['RECORDS_PERMISSIONS_UNKNOWN_RESTRICTIONS']
+        message = 'Unknown applied restrictions {0} on record {1}.'.format(
+            sorted(unknown), getattr(record, 'id', None)
+        )
+        if policy == 'error':
+            raise UnknownRestrictionError(message)
+        elif policy == 'warn' and not unknown <= _warned:
+            # Logged once per unknown kind
+            with _bits_lock:
+                new = unknown - _warned
+                _warned.update(new)
+            if new:
+                current_app.logger.warning(message)
+
+    return RestrictionDescriptor(
+        mask=mask,
+        owners=frozenset(record.get('owners') or ()),
+        groups=frozenset(record.get('group_restrictions') or ()),
+        unknown=unknown,
+    )
+
+
+def get_descriptor(record):
+    """Restriction descriptor of ``record``, cached on it when possible."""
+    key = _cache_key(record)
+    cached = getattr(record, '_permissions_restrictions', None)
+    if cached is not None and _same_key(cached[0], key):
+        return cached[1]
+
+    descriptor = build_descriptor(record)
+    try:
+        record._permissions_restrictions = (key, descriptor)
+    except AttributeError:
+        # Plain dicts can not hold attributes
+        pass
+    return descriptor
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Pytest configuration."""
+
+import pytest
+from flask import Flask, g
+from flask_principal import Identity, UserNeed
+from invenio_access import InvenioAccess
+from invenio_access.permissions import any_user
+from invenio_accounts import InvenioAccounts
+from invenio_db import InvenioDB, db
+
+from invenio_records_permissions import InvenioRecordsPermissions
+
+
+@pytest.fixture()
+def database_uri():
+    """URI of the test database, in memory unless overridden."""
+    return 'sqlite://'
+
+
+@pytest.fixture()
+def app(database_uri):
+    """Application with a fresh database, in a request context."""
+    app_ = Flask('testapp')
+    app_.config.update(
+        SECRET_KEY='SECRET_KEY',
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        TESTING=True,
+    )
+    InvenioDB(app_)
+    InvenioAccounts(app_)
+    InvenioAccess(app_)
+    InvenioRecordsPermissions(app_)
+    with app_.test_request_context():
+        db.create_all()
+        # Requests from no IP class
+        g._permissions_ip_classes = frozenset()
+        yield app_
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def identity():
+    """Identity of user 1."""
+    identity_ = Identity(1)
+    identity_.provides.update([UserNeed(1), any_user])
+    return identity_
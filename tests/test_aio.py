@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Asynchronous evaluation tests."""
+
+import asyncio
+
+import pytest
+from flask_principal import ActionNeed, Identity, RoleNeed, UserNeed
+from invenio_access import Permission
+from invenio_access.models import ActionRoles, ActionSystemRoles, \
+    ActionUsers
+from invenio_access.permissions import any_user, authenticated_user, \
+    superuser_access
+from invenio_accounts.models import Role, User
+from invenio_db import db
+from invenio_files_rest.models import Bucket, Location
+from invenio_records.api import Record
+from invenio_records_files.models import RecordsBuckets
+
+from invenio_records_permissions.aio import aallows_many, \
+    aexpand_action_needs, aload_bucket_records
+from invenio_records_permissions.policies import RecordPermissionPolicy
+
+pytest.importorskip('aiosqlite')
+
+admin_access = ActionNeed('admin-access')
+
+
+@pytest.fixture()
+def database_uri(tmpdir):
+    """File database, the async engine must see the same data."""
+    return 'sqlite:///{0}'.format(tmpdir.join('test.db'))
+
+
+def run(coroutine):
+    """Run ``coroutine`` in a new event loop (``asyncio.run`` needs 3.7)."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def async_session(app):
+    """Async session on the database of ``app``, not pooled across loops."""
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    uri = app.config['SQLALCHEMY_DATABASE_URI'].replace(
+        'sqlite://', 'sqlite+aiosqlite://', 1
+    )
+    return AsyncSession(create_async_engine(uri, poolclass=NullPool))
+
+
+async def in_session(app, function, *args):
+    """Call ``function`` with an async session closed afterwards."""
+    async with async_session(app) as session:
+        return await function(*args, session=session)
+
+
+def create_grants():
+    """Users 1 and 2, role ``curators`` and grants of ``admin-access``."""
+    granted = User(email='granted@example.org', active=True)
+    denied = User(email='denied@example.org', active=True)
+    curators = Role(name='curators')
+    db.session.add_all([granted, denied, curators])
+    db.session.flush()
+    db.session.add_all([
+        ActionUsers.allow(admin_access, user=granted),
+        ActionUsers.deny(admin_access, user=denied),
+        ActionRoles.allow(admin_access, role=curators),
+        ActionSystemRoles.deny(superuser_access, role=authenticated_user),
+    ])
+    db.session.commit()
+    return granted, denied, curators
+
+
+def identity_of(user=None, roles=()):
+    """Identity providing the Needs of ``user`` and ``roles``."""
+    identity = Identity(user.id if user else None)
+    identity.provides.add(any_user)
+    if user is not None:
+        identity.provides.update([UserNeed(user.id), authenticated_user])
+    identity.provides.update(RoleNeed(role.name) for role in roles)
+    return identity
+
+
+def test_aexpand_action_needs(app):
+    create_grants()
+    expansions = run(in_session(
+        app, aexpand_action_needs, [admin_access, superuser_access]
+    ))
+
+    permission = Permission(admin_access)
+    permission._load_permissions()
+    assert set(expansions) == {admin_access, superuser_access}
+    assert set().union(*(e.needs for e in expansions.values())) == \
+        permission._permissions.needs
+    assert set().union(*(e.excludes for e in expansions.values())) == \
+        permission._permissions.excludes
+
+
+def test_aallows_many(app):
+    granted, denied, curators = create_grants()
+    records = [
+        Record({'applied_restrictions': []}),
+        Record({'applied_restrictions': ['owners'], 'owners': [granted.id]}),
+    ]
+    permissions = [
+        RecordPermissionPolicy(action=action, record=record)
+        for action in ('read', 'update', 'delete') for record in records
+    ]
+    identities = [
+        identity_of(),
+        identity_of(granted),
+        identity_of(denied),
+        identity_of(denied, roles=[curators]),
+    ]
+
+    for identity in identities:
+        decisions = run(in_session(app, aallows_many, permissions, identity))
+        assert decisions == [p.allows(identity) for p in permissions]
+
+
+class ExcludingPolicy(RecordPermissionPolicy):
+    """Record policy excluding the holders of ``admin-access``."""
+
+    def __init__(self, action, **over):
+        super(ExcludingPolicy, self).__init__(action, **over)
+        self.explicit_excludes = {admin_access}
+
+
+def test_aallows_many_explicit_excludes(app):
+    granted, denied, curators = create_grants()
+    permissions = [
+        ExcludingPolicy(action=action, record=Record({}))
+        for action in ('read', 'update')
+    ]
+    # Only holders of ``admin-access`` itself are excluded, not the Needs
+    # granted the action
+    holder = identity_of(denied)
+    holder.provides.add(admin_access)
+    identities = [
+        identity_of(),
+        identity_of(granted),
+        identity_of(denied, roles=[curators]),
+        holder,
+    ]
+
+    for identity in identities:
+        decisions = run(in_session(app, aallows_many, permissions, identity))
+        assert decisions == [p.allows(identity) for p in permissions]
+    assert run(in_session(app, aallows_many, permissions, holder)) == \
+        [False, False]
+
+
+def test_aallows_many_default_session(app):
+    granted, _, _ = create_grants()
+    permission = RecordPermissionPolicy(action='read', record=Record({}))
+    identity = identity_of(granted)
+    assert run(aallows_many([permission], identity)) == \
+        [permission.allows(identity)]
+
+
+def test_aload_bucket_records(app, tmpdir):
+    db.session.add(Location(name='local', uri=str(tmpdir), default=True))
+    db.session.flush()
+    buckets = [Bucket.create(), Bucket.create()]
+    record = Record.create({'owners': [1]})
+    RecordsBuckets.create(record=record.model, bucket=buckets[0])
+    db.session.commit()
+
+    records = run(in_session(
+        app, aload_bucket_records, [str(bucket.id) for bucket in buckets]
+    ))
+    assert list(records) == [str(buckets[0].id)]
+    loaded = records[str(buckets[0].id)]
+    assert loaded.id == record.id
+    assert loaded.revision_id == record.revision_id
+    assert loaded['owners'] == [1]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Anonymous cache tests."""
+
+from datetime import timedelta
+
+from invenio_records_permissions.anonymous import AnonymousCache
+from invenio_records_permissions.utils import utcnow
+
+
+def test_cache_expires_at():
+    cache = AnonymousCache(ttl=60)
+    cache['ttl'] = 1
+    cache.set('later', 2, expires_at=utcnow() + timedelta(hours=1))
+    cache.set('lifted', 3, expires_at=utcnow() - timedelta(seconds=1))
+
+    assert cache.get('ttl') == 1
+    assert cache.get('later') == 2
+    assert cache.get('lifted') is None
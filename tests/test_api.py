@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Search API tests."""
+
+import pytest
+from flask import g
+
+from invenio_records_permissions.api import RecordsSearch
+from invenio_records_permissions.loadtest import FakeSearchClient
+
+
+def document(i):
+    """Record ``i``, every third one restricted to user 2."""
+    if i % 3:
+        return {'_access': {'metadata_restricted': False}}
+    return {
+        '_access': {'metadata_restricted': True},
+        'applied_restrictions': ['owners'],
+        'owners': [2],
+    }
+
+
+@pytest.fixture()
+def client():
+    """Fake search client over 50 records."""
+    return FakeSearchClient((str(i), document(i)) for i in range(50))
+
+
+def test_fake_client_slices(client):
+    ids = []
+    for slice_id in range(3):
+        body = {'size': 100, 'slice': {'id': slice_id, 'max': 3}}
+        hits = client.search(body=body)['hits']['hits']
+        ids.extend(hit['_id'] for hit in hits)
+    assert sorted(ids) == sorted(str(i) for i in range(50))
+
+
+@pytest.mark.parametrize('slices,size', [(1, 7), (3, 4), (4, 100)])
+def test_export(app, identity, client, slices, size):
+    g.identity = identity
+    ids = [
+        hit['_id'] for hit in
+        RecordsSearch(using=client).export(slices=slices, size=size)
+    ]
+    assert sorted(ids) == sorted(str(i) for i in range(50) if i % 3)
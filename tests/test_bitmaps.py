@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Record access index tests."""
+
+import random
+
+from flask_principal import Identity, UserNeed
+from invenio_access.permissions import any_user
+from invenio_db import db
+from invenio_records.api import Record
+
+from invenio_records_permissions.bitmaps import Bitmap, RecordAccessIndex, \
+    get_access_index
+from invenio_records_permissions.policies import RecordPermissionPolicy
+
+
+def identity_of(user_id):
+    """Identity of a user."""
+    identity = Identity(user_id)
+    identity.provides.update([UserNeed(user_id), any_user])
+    return identity
+
+
+def owned(owner):
+    """Record restricted to ``owner``."""
+    return {
+        'applied_restrictions': ['owners'],
+        'owners': [owner],
+        '_access': {'metadata_restricted': True},
+    }
+
+
+def test_bitmap():
+    rnd = random.Random(0)
+    # Sparse and dense chunks
+    for count in (0, 1, 100, 20000):
+        ordinals = {rnd.randrange(200000) for _ in range(count)}
+        others = {rnd.randrange(200000) for _ in range(count)}
+        bitmap = Bitmap.from_ordinals(ordinals)
+        assert list(bitmap) == sorted(ordinals)
+        assert len(bitmap) == len(ordinals)
+        assert list(bitmap | Bitmap.from_ordinals(others)) == \
+            sorted(ordinals | others)
+        removed = set(list(ordinals)[:10])
+        assert list(bitmap.updated(others, removed)) == \
+            sorted((ordinals | others) - removed)
+        assert Bitmap.from_bytes(bitmap.to_bytes()) == bitmap
+
+
+def test_bitmap_compressed():
+    assert len(Bitmap.from_ordinals([5000000]).to_bytes()) < 16
+
+
+def test_index(app, tmpdir):
+    index = RecordAccessIndex.from_policy(RecordPermissionPolicy)
+    index.add_many((i, owned(i % 10)) for i in range(100))
+    assert index.count(identity_of(3)) == 10
+
+    index.add(3, owned(4))
+    index.remove(13)
+    readable = set(index.readable_ids(identity_of(3)))
+    assert len(readable) == 8 and '3' not in readable
+
+    path = str(tmpdir.join('index.bin'))
+    index.dump(path)
+    loaded = RecordAccessIndex.from_policy(RecordPermissionPolicy).load(path)
+    assert set(loaded.readable_ids(identity_of(3))) == readable
+    loaded.add(23, owned(5))
+    assert loaded.count(identity_of(3)) == 7
+
+
+def test_index_signals(app):
+    app.config['RECORDS_PERMISSIONS_ACCESS_INDEX'] = True
+    index = get_access_index()
+    assert index.count(identity_of(1)) == 0
+
+    record = Record.create(owned(1))
+    db.session.commit()
+    assert list(index.readable_ids(identity_of(1))) == [str(record.id)]
+
+    record['owners'] = [2]
+    record.commit()
+    db.session.rollback()
+    assert index.count(identity_of(2)) == 0
+
+    record = Record.get_record(record.id)
+    record['owners'] = [2]
+    record.commit()
+    db.session.commit()
+    assert index.count(identity_of(1)) == 0
+    assert index.count(identity_of(2)) == 1
+
+    record.delete()
+    db.session.commit()
+    assert index.count(identity_of(2)) == 0
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Compiled evaluators tests."""
+
+from flask import Flask, g
+from flask_principal import RoleNeed, UserNeed
+
+from invenio_records_permissions import InvenioRecordsPermissions
+from invenio_records_permissions.compiler import get_evaluator, \
+    identity_facts
+from invenio_records_permissions.generators import AnyUser, Disable
+from invenio_records_permissions.policies import BasePermissionPolicy
+
+
+class Policy(BasePermissionPolicy):
+    """Policy whose read action is reassigned."""
+
+    can_read = [AnyUser()]
+
+
+def test_identity_facts(app, identity):
+    facts = identity_facts(identity)
+    assert identity_facts(identity) is facts
+    assert facts.user_ids == frozenset([1])
+
+    # Same number of Needs
+    identity.provides.remove(UserNeed(1))
+    identity.provides.add(RoleNeed('curators'))
+    facts = identity_facts(identity)
+    assert facts.user_ids == frozenset()
+    assert facts.roles == frozenset(['curators'])
+
+    g._permissions_ip_classes = frozenset(['campus'])
+    assert identity_facts(identity).ip_classes == frozenset(['campus'])
+
+
+def test_reassigned_generators(app, identity):
+    cache = {}
+    assert get_evaluator(Policy(action='read'), 'read', cache)(
+        identity_facts(identity), None)
+    Policy.can_read = [Disable()]
+    try:
+        assert not get_evaluator(Policy(action='read'), 'read', cache)(
+            identity_facts(identity), None)
+    finally:
+        Policy.can_read = [AnyUser()]
+
+
+def test_evaluators_per_app(app):
+    app.config['RECORDS_PERMISSIONS_COMPILED_POLICIES'] = True
+    other = Flask('other')
+    other.config['RECORDS_PERMISSIONS_COMPILED_POLICIES'] = True
+    InvenioRecordsPermissions(other)
+
+    assert BasePermissionPolicy(action='read').compiled_evaluators is None
+    with other.app_context():
+        assert BasePermissionPolicy(action='read').compiled_evaluators == {}
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""In-memory evaluator tests."""
+
+from datetime import timedelta
+
+import pytest
+from elasticsearch_dsl.query import Q
+from flask_principal import Identity, UserNeed
+from invenio_access.permissions import any_user
+
+from invenio_records_permissions.errors import UnsupportedQueryError
+from invenio_records_permissions.evaluator import check_policy_consistency, \
+    compile_query, filter_records, synthetic_records
+from invenio_records_permissions.generators import AnyUserIfPublic, \
+    RecordIp
+from invenio_records_permissions.policies import BasePermissionPolicy, \
+    RecordPermissionPolicy
+from invenio_records_permissions.utils import utcnow
+
+
+class PublicPolicy(BasePermissionPolicy):
+    """Read access to public records."""
+
+    can_read = [AnyUserIfPublic()]
+
+
+class IpPolicy(BasePermissionPolicy):
+    """Read access to records not restricted to single IPs."""
+
+    can_read = [RecordIp()]
+
+
+def matches(query, records):
+    """Decisions of ``query`` on ``records``."""
+    return compile_query(query)(records)
+
+
+@pytest.mark.parametrize('value,expected', [
+    (True, True),
+    (True, 'true'),
+    (True, 'True'),
+    ('TRUE', True),
+    (False, 'false'),
+])
+def test_term_boolean(value, expected):
+    assert matches({'term': {'flag': expected}}, [{'flag': value}]) == [True]
+
+
+def test_term_boolean_mismatch():
+    records = [{'flag': False}, {'flag': 'true'}, {'flag': 1}]
+    assert matches({'term': {'flag': True}}, records) == [False, True, False]
+
+
+def test_terms():
+    records = [{'tags': ['a', 'b']}, {'tags': ['c']}, {'tags': [True]}, {}]
+    assert matches({'terms': {'tags': ['b', True]}}, records) == \
+        [True, False, True, False]
+
+
+def test_term_object_and_nested_path():
+    records = [
+        {'internal': {'levels': [{'scheme': 'person', 'id': 1}]}},
+        {'internal': {'levels': [{'scheme': 'person', 'id': 2}]}},
+    ]
+    query = {'term': {'internal.levels': {'value': {'id': 1}}}}
+    assert matches(query, records) == [True, False]
+
+
+def test_bool():
+    records = [
+        {'restrictions': ['owners'], 'owners': [1]},
+        {'restrictions': ['owners'], 'owners': [2]},
+        {'restrictions': []},
+    ]
+    query = Q('term', restrictions='owners') & Q('term', owners=1) | \
+        ~Q('term', restrictions='owners')
+    assert matches(query, records) == [True, False, True]
+
+
+def test_minimum_should_match():
+    records = [{'a': 1, 'b': 1}, {'a': 1}, {}]
+    query = {'bool': {
+        'should': [{'term': {'a': 1}}, {'term': {'b': 1}}],
+        'minimum_should_match': 2,
+    }}
+    assert matches(query, records) == [True, False, False]
+
+
+def test_range_now():
+    now = utcnow()
+    records = [
+        {'embargo': (now - timedelta(days=1)).isoformat()},
+        {'embargo': (now + timedelta(days=1)).isoformat()},
+    ]
+    query = {'range': {'embargo': {'lte': 'now'}}}
+    assert filter_records(query, records) == records[:1]
+
+
+def test_unsupported_query():
+    with pytest.raises(UnsupportedQueryError):
+        compile_query({'wildcard': {'title': 'a*'}})
+    with pytest.raises(UnsupportedQueryError):
+        compile_query({'range': {'date': {'lte': 'now-1d'}}})
+
+
+def test_policy_consistency(app, identity):
+    records = [
+        {'_access': {'metadata_restricted': False}},
+        {'_access': {'metadata_restricted': True}},
+    ]
+    assert check_policy_consistency(PublicPolicy, identity, records) == []
+
+    records = [{'applied_restrictions': ['ip_single']}, {}]
+    assert check_policy_consistency(IpPolicy, identity, records) == []
+
+
+def test_policy_inconsistency(app, identity):
+    # Granted to public records, but not matched by the filter
+    record = {}
+    assert check_policy_consistency(PublicPolicy, identity, [record]) == [
+        (record, True, False)
+    ]
+
+
+@pytest.mark.parametrize('action', ['read', 'update'])
+@pytest.mark.parametrize('user_id', [None, 1, 7])
+def test_record_policy_consistency(app, action, user_id):
+    identity = Identity(user_id)
+    identity.provides.add(any_user)
+    if user_id is not None:
+        identity.provides.add(UserNeed(user_id))
+    records = synthetic_records(200)
+    assert check_policy_consistency(
+        RecordPermissionPolicy, identity, records, action=action
+    ) == []
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Permission factories tests."""
+
+import pytest
+from flask_principal import Identity, UserNeed
+from invenio_access.permissions import any_user
+from invenio_records.api import Record
+
+from invenio_records_permissions.factories import \
+    record_permission_decisions
+from invenio_records_permissions.policies import RecordPermissionPolicy
+
+
+def owned_by(owner):
+    """Record restricted to ``owner``."""
+    return Record({
+        '_access': {'metadata_restricted': True},
+        'applied_restrictions': ['owners'],
+        'owners': [owner],
+    })
+
+
+@pytest.fixture()
+def records():
+    """Public records and records of users 1 and 2, sharing ACLs."""
+    public = [
+        Record({'_access': {'metadata_restricted': False}}) for _ in range(3)
+    ]
+    return public + [owned_by(1), owned_by(2), owned_by(1), owned_by(2)]
+
+
+def identity_of(user_id=None):
+    """Identity of ``user_id``, anonymous if ``None``."""
+    identity = Identity(user_id)
+    identity.provides.add(any_user)
+    if user_id is not None:
+        identity.provides.add(UserNeed(user_id))
+    return identity
+
+
+@pytest.mark.parametrize('action', ['read', 'update', 'delete'])
+@pytest.mark.parametrize('user_id', [None, 1, 2])
+def test_record_permission_decisions(app, records, action, user_id):
+    identity = identity_of(user_id)
+    expected = [
+        RecordPermissionPolicy(action=action, record=record).allows(identity)
+        for record in records
+    ]
+    assert record_permission_decisions(action, records, identity) == \
+        expected
+
+
+def test_record_permission_decisions_shared(app, records, monkeypatch):
+    evaluated = []
+    allows = RecordPermissionPolicy.allows
+
+    def counting_allows(self, identity):
+        evaluated.append(self.over['record'])
+        return allows(self, identity)
+
+    monkeypatch.setattr(RecordPermissionPolicy, 'allows', counting_allows)
+    decisions = record_permission_decisions('read', records, identity_of(1))
+
+    # One evaluation per distinct ACL: public, owned by 1, owned by 2
+    assert decisions == [True] * 4 + [False, True, False]
+    assert evaluated == [records[0], records[3], records[4]]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Permission re-indexing tests."""
+
+import pytest
+from invenio_db import db
+from invenio_records.api import Record
+
+from invenio_records_permissions.indexer import current_reindex_queue, \
+    queue_permission_update
+
+
+@pytest.fixture()
+def stored_record(app):
+    """Record stored and loaded again from the database."""
+    app.config['RECORDS_PERMISSIONS_REINDEX_ENABLED'] = True
+    record = Record.create({
+        'owners': [1],
+        '_access': {'metadata_restricted': False},
+    })
+    db.session.commit()
+    db.session.expunge_all()
+    return Record.get_record(record.id)
+
+
+def queued(record):
+    """Queue the update of ``record`` and tell if it was queued."""
+    queue = current_reindex_queue()
+    queue_permission_update(None, record=record)
+    queue.commit()
+    return str(record.id) in queue._committed
+
+
+def test_nested_edit(stored_record):
+    stored_record['owners'].append(2)
+    assert queued(stored_record)
+
+
+def test_nested_object_edit(stored_record):
+    stored_record['_access']['metadata_restricted'] = True
+    assert queued(stored_record)
+
+
+def test_no_change(stored_record):
+    stored_record['title'] = 'Title'
+    assert not queued(stored_record)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Lazy sets of Needs tests."""
+
+from flask_principal import Permission, RoleNeed, UserNeed
+
+from invenio_records_permissions.needs import NeedSet, NeedSetUnion
+from invenio_records_permissions.policies import RecordPermissionPolicy
+
+owners = NeedSet('id', frozenset([1, 2]))
+groups = NeedSet('role', frozenset(['curators']))
+union = NeedSetUnion([owners, groups, {UserNeed(3)}])
+
+
+def test_need_set():
+    assert UserNeed(1) in owners
+    assert UserNeed(3) not in owners
+    assert RoleNeed(1) not in owners
+    assert set(owners) == {UserNeed(1), UserNeed(2)}
+    assert owners.intersection([UserNeed(2), UserNeed(3)]) == {UserNeed(2)}
+
+
+def test_set_methods():
+    assert owners.union({UserNeed(3)}) == \
+        {UserNeed(1), UserNeed(2), UserNeed(3)}
+    assert union.difference([UserNeed(1)], owners) == \
+        {RoleNeed('curators'), UserNeed(3)}
+    assert owners.issubset(union)
+    assert owners.issubset([UserNeed(1), UserNeed(2)])
+    assert not union.issubset(owners)
+    assert union.issuperset([UserNeed(3), RoleNeed('curators')])
+
+
+def test_permission_methods(app):
+    record = {'applied_restrictions': ['owners'], 'owners': [1, 2]}
+    permission = RecordPermissionPolicy(action='update', record=record)
+    other = Permission(UserNeed(3))
+
+    assert UserNeed(3) in permission.union(other).needs
+    assert UserNeed(1) in permission.union(other).needs
+    assert UserNeed(1) in permission.difference(other).needs
+    assert not permission.issubset(other)
+    assert permission.issubset(Permission(*permission.needs))
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Pre-authorization tests."""
+
+from flask import g
+from flask_principal import Identity
+
+from invenio_records_permissions.factories import \
+    record_read_permission_factory
+from invenio_records_permissions.policies import RecordPermissionPolicy
+from invenio_records_permissions.preauthorized import is_preauthorized, \
+    mark_preauthorized
+
+
+def test_mark_preauthorized(app, identity):
+    g.identity = identity
+    source = {'_access': {'metadata_restricted': True}, 'owners': [2]}
+    hits = [{'_id': 'a', '_source': source}]
+    mark_preauthorized(RecordPermissionPolicy, hits)
+
+    # The hits are kept in the request, not in their source
+    assert hits[0]['_source'] == {
+        '_access': {'metadata_restricted': True}, 'owners': [2]
+    }
+    assert is_preauthorized(record_read_permission_factory(source), identity)
+    assert not is_preauthorized(
+        record_read_permission_factory(dict(source)), identity
+    )
+    assert not is_preauthorized(
+        record_read_permission_factory(source), Identity(2)
+    )
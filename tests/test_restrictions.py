@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Restriction descriptor tests."""
+
+from invenio_records.api import Record
+
+from invenio_records_permissions.evaluator import check_policy_consistency
+from invenio_records_permissions.generators import RecordNetwork
+from invenio_records_permissions.policies import BasePermissionPolicy
+from invenio_records_permissions.restrictions import get_descriptor, \
+    restriction_bit
+
+
+class CampusPolicy(BasePermissionPolicy):
+    """Read access restricted to the campus network."""
+
+    can_read = [RecordNetwork('campus')]
+
+
+def test_ip_class_without_networks(app, identity):
+    # No network is configured for campus
+    record = {'applied_restrictions': ['campus']}
+    descriptor = get_descriptor(record)
+    assert descriptor.mask & restriction_bit('campus')
+    assert descriptor.unknown == frozenset(['campus'])
+
+    assert RecordNetwork('campus').needs(record=record) == []
+    assert not CampusPolicy(action='read', record=record).allows(identity)
+    assert check_policy_consistency(
+        CampusPolicy, identity, [record, {'applied_restrictions': []}]
+    ) == []
+
+
+def test_descriptor_cache(app):
+    record = Record({'applied_restrictions': ['owners'], 'owners': [1]})
+    descriptor = get_descriptor(record)
+    assert get_descriptor(record) is descriptor
+
+    record['owners'] = [2]
+    assert get_descriptor(record).owners == frozenset([2])
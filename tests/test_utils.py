@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Utilities tests."""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from invenio_records_permissions.utils import parse_datetime
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('2020-01-01', datetime(2020, 1, 1, tzinfo=timezone.utc)),
+    ('2020-01-01T10:30', datetime(2020, 1, 1, 10, 30, tzinfo=timezone.utc)),
+    ('2020-01-01T10:30:05Z',
+     datetime(2020, 1, 1, 10, 30, 5, tzinfo=timezone.utc)),
+    ('2020-01-01 10:30:05.25+02:00',
+     datetime(2020, 1, 1, 10, 30, 5, 250000,
+              tzinfo=timezone(timedelta(hours=2)))),
+    ('2020-01-01T10:30:05-0130',
+     datetime(2020, 1, 1, 10, 30, 5,
+              tzinfo=timezone(-timedelta(hours=1, minutes=30)))),
+    (datetime(2020, 1, 1), datetime(2020, 1, 1, tzinfo=timezone.utc)),
+])
+def test_parse_datetime(value, expected):
+    assert parse_datetime(value) == expected
+
+
+@pytest.mark.parametrize('value', ['2020-13-01', '2020-01-01T25:00', '', 1])
+def test_parse_datetime_invalid(value):
+    assert parse_datetime(value) is None
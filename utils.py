@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+# Copyright (C) 2019 Northwestern University.
+#
+# Invenio-Records-Permissions is free software; you can redistribute it
+# and/or modify it under the terms of the MIT License; see LICENSE file for
+# more details.
+
+"""Utilities for invenio-records-permissions."""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+
+def get_path(data, path, default=None):
+    """Return the value at the dotted ``path`` of ``data``."""
+    for key in path.split('.'):
+        if not isinstance(data, dict) or key not in data:
+            return default
+        data = data[key]
+    return data
+
+
+def set_path(data, path, value):
+    """Set ``value`` at the dotted ``path`` of ``data``."""
+    keys = path.split('.')
+    for key in keys[:-1]:
+        data = data.setdefault(key, {})
+    data[keys[-1]] = value
+
+
+def acl_digest(record, fields):
+    """Digest of the permission ``fields`` of ``record``."""
+    values = [get_path(record, path) for path in fields]
+    data = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def utcnow():
+    """Current timezone aware UTC datetime."""
+    return datetime.now(timezone.utc)
+
+
+_DATETIME_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M',
+    '%Y-%m-%d',
+)
+
+_UTC_OFFSET = re.compile(r'(Z|([+-])(\d{2}):?(\d{2}))$')
+
+
+def _parse_iso(value):
+    """Datetime of an ISO 8601 string, ``None`` if it is not one.
+
+    ``datetime.fromisoformat`` needs Python 3.7, and ``%z`` only accepts
+    offsets with a colon from Python 3.7 on.
+    """
+    value = value.strip().replace(' ', 'T', 1)
+    tzinfo = None
+    offset = _UTC_OFFSET.search(value) if 'T' in value else None
+    if offset is not None:
+        value = value[:offset.start()]
+        if offset.group(1) == 'Z':
+            tzinfo = timezone.utc
+        else:
+            delta = timedelta(
+                hours=int(offset.group(3)), minutes=int(offset.group(4))
+            )
+            tzinfo = timezone(-delta if offset.group(2) == '-' else delta)
+    for fmt in _DATETIME_FORMATS:
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return parsed.replace(tzinfo=tzinfo)
+    return None
+
+
+def parse_datetime(value):
+    """Timezone aware datetime of an ISO 8601 date or datetime.
+
+    Naive values are taken as UTC. ``None`` if ``value`` is not a date.
+    """
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, date):
+        parsed = datetime(value.year, value.month, value.day)
+    elif isinstance(value, str):
+        parsed = _parse_iso(value)
+        if parsed is None:
+            return None
+    else:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class ProcessThread(object):
+    """Daemon thread started on first use, once per process.
+
+    Threads do not survive a fork: a thread started when the application is
+    loaded would not run in the workers of a preforking server.
+    """
+
+    def __init__(self, target, name, reset=None):
+        """Constructor.
+
+        :param reset: Function called before the thread starts in a process,
+            e.g. to drop the state inherited from the parent process.
+        """
+        self.target = target
+        self.name = name
+        self.reset = reset
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the thread if it does not run in the current process."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self.reset is not None:
+                self.reset()
+            threading.Thread(
+                target=self.target, name=self.name, daemon=True
+            ).start()
+            self._pid = pid